@@ -1,17 +1,44 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { exec } from 'child_process';
 import { promises as fs } from 'fs';
 import { join } from 'path';
 import path from 'path';
-import util from 'util';
-
-const execPromise = util.promisify(exec);
+import { classifyCarImage, ClassificationTimeoutError } from '@/lib/services/carClassifierWorker';
 
 interface ClassificationResult {
   result: string;
   error?: string;
 }
 
+// Manifest names written by model_assets.py, and the files the worker falls back to
+const CLASSIFIER_MODEL_NAMES = ['car_classifier_onnx', 'car_classifier_tflite', 'car_classifier_keras'];
+const CLASSIFIER_MODEL_FILES = ['car_classifier_model.onnx', 'car_classifier_model.tflite', 'car_classifier_model.h5'];
+
+async function findClassifierModel(): Promise<string | null> {
+  const modelDir = path.resolve(process.cwd(), process.env.RCMS_MODEL_DIR || 'models');
+  const candidates: string[] = [];
+  try {
+    const manifest = JSON.parse(await fs.readFile(join(modelDir, 'manifest.json'), 'utf8'));
+    for (const name of CLASSIFIER_MODEL_NAMES) {
+      const entry = manifest.models?.[name];
+      if (entry?.filename) {
+        candidates.push(join(modelDir, entry.filename));
+      }
+    }
+  } catch {
+    // No manifest: only the project root
+  }
+  candidates.push(...CLASSIFIER_MODEL_FILES.map(file => join(process.cwd(), file)));
+  for (const candidate of candidates) {
+    try {
+      await fs.access(candidate);
+      return candidate;
+    } catch {
+      // Try the next one
+    }
+  }
+  return null;
+}
+
 export async function POST(request: NextRequest): Promise<NextResponse<ClassificationResult>> {
   let imagePath: string | null = null;
   
@@ -105,40 +132,23 @@ export async function POST(request: NextRequest): Promise<NextResponse<Classific
       }, { status: 500 });
     }
     
-    // Check if model file exists
-    const modelPath = join(process.cwd(), 'car_classifier_model.h5');
-    try {
-      await fs.access(modelPath);
+    // Check if a model file exists
+    const modelPath = await findClassifierModel();
+    if (modelPath) {
       console.log(`Model file found at: ${modelPath}`);
-    } catch (accessError) {
-      console.error(`Model file not found at: ${modelPath}`);
+    } else {
+      console.error('No classification model found in the model manifest or the project root');
       return NextResponse.json({ 
         result: '',
-        error: 'Classification model not found. Please ensure car_classifier_model.h5 is in the project root.' 
+        error: 'Classification model not found. Install it with `python model_assets.py add car_classifier_onnx <file>` or put car_classifier_model.h5 in the project root.' 
       }, { status: 500 });
     }
     
-    console.log(`Executing Python script with image: ${imagePath}`);
-    
-    // Run the Python script with the image path as an argument
-    // Using absolute paths and proper escaping
-    const command = `python "${pythonScriptPath}" "${imagePath}"`;
-    console.log(`Command: ${command}`);
+    console.log(`Classifying image with resident worker: ${imagePath}`);
     
     try {
-      const { stdout, stderr } = await execPromise(command, {
-        timeout: 30000, // 30 second timeout
-        cwd: process.cwd(),
-        maxBuffer: 1024 * 1024 // 1MB buffer
-      });
-      
-      console.log('Python script stdout:', stdout);
-      if (stderr) {
-        console.log('Python script stderr:', stderr);
-      }
-      
-      // Check if we got a valid result
-      const result = stdout.trim();
+      // The worker keeps the model loaded between requests
+      const result = (await classifyCarImage(imagePath, 30000)).trim();
       if (!result) {
         throw new Error('Python script returned empty result');
       }
@@ -149,17 +159,16 @@ export async function POST(request: NextRequest): Promise<NextResponse<Classific
         result: result
       });
       
-    } catch (execError: any) {
-      console.error('Python script execution error:', execError);
+    } catch (workerError: any) {
+      console.error('Car classifier worker error:', workerError);
       
       let errorMessage = 'Failed to classify image';
-      if (execError.code === 'ENOENT') {
+      if (workerError.code === 'ENOENT') {
         errorMessage = 'Python not found. Please ensure Python is installed and in PATH.';
-      } else if (execError.signal === 'SIGTERM') {
+      } else if (workerError instanceof ClassificationTimeoutError) {
         errorMessage = 'Classification timed out. Please try with a smaller image.';
-      } else if (execError.stderr) {
-        console.error('Python stderr:', execError.stderr);
-        errorMessage = `Classification failed: ${execError.stderr}`;
+      } else if (workerError.message) {
+        errorMessage = `Classification failed: ${workerError.message}`;
       }
       
       return NextResponse.json({ 
@@ -3,6 +3,7 @@ import { spawn } from 'child_process';
 import path from 'path';
 import { NextRequest, NextResponse } from 'next/server';
 import { promises as fs } from 'fs';
+import { storeBlob } from '@/lib/services/blobStore';
 import { 
     convertYOLOToSAMPrompts, 
     filterDetectionsByConfidence, 
@@ -56,7 +57,6 @@ export async function POST(req: NextRequest): Promise<NextResponse<ResponseData>
         // Setup directories
         const dirs = {
             temp: path.join(process.cwd(), 'tmp'),
-            uploads: path.join(process.cwd(), 'uploads'),
             outputs: path.join(process.cwd(), 'public', 'outputs'),
             segments: path.join(process.cwd(), 'public', 'segments')
         };
@@ -65,15 +65,14 @@ export async function POST(req: NextRequest): Promise<NextResponse<ResponseData>
             await fs.mkdir(dir, { recursive: true });
         }
 
-        // File paths
+        // Store the upload once by content; every stage reads the stored blob
         const buffer = Buffer.from(await file.arrayBuffer());
-        const sanitizedFileName = file.name.replace(/[^a-zA-Z0-9.-]/g, '_');
-        const inputImagePath = path.join(dirs.temp, `input-${timestamp}-${sanitizedFileName}`);
+        const blob = await storeBlob(buffer);
+        const inputImagePath = blob.path;
         const outputImagePath = path.join(dirs.outputs, `annotated-${timestamp}.jpg`);
         const detectionsJsonPath = path.join(dirs.temp, `detections-${timestamp}.json`);
 
-        tempFiles.push(inputImagePath, detectionsJsonPath);
-        await fs.writeFile(inputImagePath, buffer);
+        tempFiles.push(detectionsJsonPath);
 
         // Step 1: Run YOLO Detection
         console.log('🔍 Running YOLO detection...');
@@ -169,11 +168,8 @@ export async function POST(req: NextRequest): Promise<NextResponse<ResponseData>
             console.log(`✅ SAM completed: ${segmentedParts.length} parts segmented`);
         }
 
-        // Save original image for reference
-        const originalImageUrl = `/uploads/original-${timestamp}-${sanitizedFileName}`;
-        const publicUploadsDir = path.join(process.cwd(), 'public', 'uploads');
-        await fs.mkdir(publicUploadsDir, { recursive: true });
-        await fs.writeFile(path.join(publicUploadsDir, `original-${timestamp}-${sanitizedFileName}`), buffer);
+        // The stored blob doubles as the public original
+        const originalImageUrl = blob.url;
 
         const processingTime = Date.now() - timestamp;
 
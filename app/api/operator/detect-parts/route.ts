@@ -3,6 +3,7 @@ import { spawn } from 'child_process';
 import path from 'path';
 import { NextRequest, NextResponse } from 'next/server';
 import { promises as fs } from 'fs';
+import { storeBlob } from '@/lib/services/blobStore';
 
 type DetectedPart = {
     class_name: string;
@@ -29,9 +30,7 @@ const PYTHON_EXECUTABLE = process.platform === 'win32' ? 'python' : 'python3';
 
 export async function POST(req: NextRequest): Promise<NextResponse<ResponseData>> {
     const timestamp = Date.now();
-    let tempFilePath: string | null = null;
     let detectionsJsonPath: string | null = null;
-    let originalImagePath: string | null = null;
 
     try {
         // Get the form data from the request
@@ -63,29 +62,22 @@ export async function POST(req: NextRequest): Promise<NextResponse<ResponseData>
         const buffer = Buffer.from(await file.arrayBuffer());
         
         // Create directory structure
-        const uploadsDir = path.join(process.cwd(), 'uploads');
         const outputsDir = path.join(process.cwd(), 'public', 'outputs');
         const tempDir = path.join(process.cwd(), 'tmp');
         
-        await fs.mkdir(uploadsDir, { recursive: true });
         await fs.mkdir(outputsDir, { recursive: true });
         await fs.mkdir(tempDir, { recursive: true });
 
-        // File paths
-        const sanitizedFileName = file.name.replace(/[^a-zA-Z0-9.-]/g, '_');
-        tempFilePath = path.join(tempDir, `${timestamp}-${sanitizedFileName}`);
-        originalImagePath = path.join(uploadsDir, `original-${timestamp}-${sanitizedFileName}`);
+        // Store the upload once by content; the detector reads the stored blob
+        // and the browser gets its public, immutable URL
+        const blob = await storeBlob(buffer);
         const outputImagePath = path.join(outputsDir, `annotated-${timestamp}.jpg`);
         detectionsJsonPath = path.join(tempDir, `detections-${timestamp}.json`);
 
-        // Save the uploaded image
-        await fs.writeFile(tempFilePath, buffer);
-        await fs.writeFile(originalImagePath, buffer);
-
         // Run the Python YOLO detection script
         const pythonProcess = spawn(PYTHON_EXECUTABLE, [
             path.join(process.cwd(), 'yolo_detector.py'),
-            tempFilePath,
+            blob.path,
             outputImagePath,
             detectionsJsonPath,
         ]);
@@ -128,14 +120,9 @@ export async function POST(req: NextRequest): Promise<NextResponse<ResponseData>
         console.log(`Found ${detectedParts.length} parts in detection results`);
 
         // Generate public URLs
-        const originalImageUrl = `/uploads/original-${timestamp}-${sanitizedFileName}`;
+        const originalImageUrl = blob.url;
         const annotatedImageUrl = `/outputs/annotated-${timestamp}.jpg`;
 
-        // Copy original image to public uploads folder for access
-        const publicUploadsDir = path.join(process.cwd(), 'public', 'uploads');
-        await fs.mkdir(publicUploadsDir, { recursive: true });
-        await fs.copyFile(originalImagePath, path.join(publicUploadsDir, `original-${timestamp}-${sanitizedFileName}`));
-
         // Log successful detection
         console.log(`✅ Detection completed: ${detectedParts.length} parts found`);
         console.log(`📁 Files created: ${originalImageUrl}, ${annotatedImageUrl}`);
@@ -173,9 +160,6 @@ export async function POST(req: NextRequest): Promise<NextResponse<ResponseData>
     } finally {
         // Cleanup temporary files
         try {
-            if (tempFilePath && await fs.access(tempFilePath).then(() => true).catch(() => false)) {
-                await fs.unlink(tempFilePath);
-            }
             if (detectionsJsonPath && await fs.access(detectionsJsonPath).then(() => true).catch(() => false)) {
                 await fs.unlink(detectionsJsonPath);
             }
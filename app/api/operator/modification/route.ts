@@ -3,6 +3,7 @@ import { getServerSession } from 'next-auth';
 import { authOptions } from '@/lib/auth';
 import connectDB from '@/lib/db/mongodb';
 import Modification from '@/lib/db/models/Modification';
+import { pinArtifacts } from '@/lib/services/artifactPins';
 
 // POST: Create a new modification
 export async function POST(req: Request) {
@@ -19,6 +20,7 @@ export async function POST(req: Request) {
       operator_id,
       original_image_url,
       modified_image_url,
+      thumbnail_image_url,
       modification_type,
       vehicle_part,
       description,
@@ -47,11 +49,16 @@ export async function POST(req: Request) {
       operator_id,
       original_image_url,
       modified_image_url,
+      thumbnail_image_url,
       description,
       modification_details,
       status: status || 'Saved',
       timestamp: new Date(timestamp),
     });
+    await pinArtifacts(
+      [original_image_url, modified_image_url, thumbnail_image_url, modification_details],
+      String(newModification._id)
+    );
 
     return NextResponse.json(newModification, { status: 201 });
   } catch (error) {
@@ -2,6 +2,7 @@ import { NextResponse } from 'next/server';
 import { getServerSession } from 'next-auth';
 import { authOptions } from '@/lib/auth';
 import connectDB from '@/lib/db/mongodb';
+import { pinArtifacts } from '@/lib/services/artifactPins';
 
 export async function POST(request: Request) {
   try {
@@ -48,6 +49,7 @@ export async function POST(request: Request) {
     };
 
     const result = await db.collection('modifications').insertOne(modification);
+    await pinArtifacts([original_image_url, modified_image_url, modification_details], String(result.insertedId));
 
     return NextResponse.json({
       success: true,
@@ -3,6 +3,7 @@ import { spawn } from 'child_process';
 import path from 'path';
 import { NextRequest, NextResponse } from 'next/server';
 import { promises as fs } from 'fs';
+import { storeBlob } from '@/lib/services/blobStore';
 import { convertYOLOToSAMPrompts, type YOLODetection } from '@/utils/sam-integration';
 
 interface ResponseData {
@@ -37,7 +38,6 @@ const PYTHON_EXECUTABLE = process.platform === 'win32' ? 'python' : 'python3';
 
 export async function POST(req: NextRequest): Promise<NextResponse<ResponseData>> {
     const timestamp = Date.now();
-    let tempFilePath = '';
     let samInputPath = '';
     let outputDir = '';
 
@@ -77,21 +77,19 @@ export async function POST(req: NextRequest): Promise<NextResponse<ResponseData>
             }, { status: 400 });
         }
 
-        // Setup directories and file paths
+        // Setup directories and file paths; the upload is stored once by content
         const buffer = Buffer.from(await file.arrayBuffer());
-        const sanitizedFileName = file.name.replace(/[^a-zA-Z0-9.-]/g, '_');
-        tempFilePath = path.join(process.cwd(), 'tmp', `${timestamp}-${sanitizedFileName}`);
+        const blob = await storeBlob(buffer);
         outputDir = path.join(process.cwd(), 'public', 'segments', `${timestamp}`);
         samInputPath = path.join(process.cwd(), 'tmp', `${timestamp}-sam-input.json`);
         
         // Create necessary directories
-        await fs.mkdir(path.dirname(tempFilePath), { recursive: true });
+        await fs.mkdir(path.dirname(samInputPath), { recursive: true });
         await fs.mkdir(outputDir, { recursive: true });
-        await fs.writeFile(tempFilePath, buffer);
 
         // Prepare SAM inputs
         const samInputs = partsToSegment.map(part => ({
-            image_path: tempFilePath,
+            image_path: blob.path,
             output_path: path.join(outputDir, 'segmentation_results.json'),
             prompts: [
                 { type: 'point', data: part.center_point },
@@ -143,7 +141,6 @@ export async function POST(req: NextRequest): Promise<NextResponse<ResponseData>
 
         // Clean up temporary files
         try {
-            await fs.unlink(tempFilePath);
             await fs.unlink(samInputPath);
         } catch (err) {
             console.error('Error cleaning up temporary files:', err);
@@ -20,6 +20,11 @@ export async function POST(request: Request) {
     const formData = await request.formData();
     const segmentedImage = formData.get('segmentedImage') as string;
     const segmentedPartsStr = formData.get('segmentedParts') as string;
+    // 'preview' composites on a downscaled base; 'full' renders at full resolution
+    const mode = formData.get('mode') === 'preview' ? 'preview' : 'full';
+    // Optional colour matching of references to the car: 'meanstd' or 'histogram'
+    const harmonizeValue = formData.get('harmonize');
+    const harmonize = harmonizeValue === 'meanstd' || harmonizeValue === 'histogram' ? harmonizeValue : undefined;
     
     console.log('Received stitching request with:', {
       hasSegmentedImage: !!segmentedImage,
@@ -83,7 +88,9 @@ export async function POST(request: Request) {
       segmentedImage,
       segmentedParts,
       references: [] as { className: string; imagePath: string }[],
-      outputDir: `/stitching_results/${sessionId}`
+      outputDir: `/stitching_results/${sessionId}`,
+      mode,
+      harmonize
     };
 
     // Get reference images and match them with segmented parts
@@ -96,12 +103,13 @@ export async function POST(request: Request) {
       index++;
     }
 
-    // Match references with segmented parts
-    segmentedParts.forEach(part => {
-      const imagePath = referenceMap.get(part.class_name);
-      if (imagePath) {
+    // Match references with segmented parts. One entry per class: the
+    // stitcher applies it to every instance of that class.
+    const partClasses = new Set(segmentedParts.map(part => part.class_name));
+    referenceMap.forEach((imagePath, className) => {
+      if (partClasses.has(className)) {
         inputData.references.push({
-          className: part.class_name,
+          className,
           imagePath
         });
       }
@@ -183,6 +191,8 @@ export async function POST(request: Request) {
           resolve(NextResponse.json({
             success: true,
             stitchedImageUrl: result.stitchedImageUrl,
+            derivatives: result.derivatives,
+            mode: result.mode,
             timestamp: new Date().toISOString()
           }));
         } catch (error) {
@@ -68,12 +68,21 @@ export default function StitchingView({
     modification_details: ''
   });
 
+  const buildStitchFormData = (mode: 'preview' | 'full') => {
+    const formData = new FormData();
+    formData.append('segmentedImage', segmentedImage);
+    formData.append('segmentedParts', JSON.stringify(segmentedParts));
+    formData.append('mode', mode);
+    selectedReferences.forEach((ref, index) => {
+      formData.append(`reference_${index}`, ref.imagePath);
+      formData.append(`class_${index}`, ref.className);
+    });
+    return formData;
+  };
+
   useEffect(() => {
     const performStitching = async () => {
       try {
-        const formData = new FormData();
-        formData.append('segmentedImage', segmentedImage);
-        
         // Log segmented parts before sending
         console.log('Segmented parts being sent:', segmentedParts);
         
@@ -92,12 +101,8 @@ export default function StitchingView({
           }
         });
         
-        formData.append('segmentedParts', JSON.stringify(segmentedParts));
-        
-        selectedReferences.forEach((ref, index) => {
-          formData.append(`reference_${index}`, ref.imagePath);
-          formData.append(`class_${index}`, ref.className);
-        });
+        // Render a low-resolution preview; the full render runs on save
+        const formData = buildStitchFormData('preview');
 
         console.log('Sending stitching request with:', {
           segmentedImage,
@@ -168,6 +173,16 @@ export default function StitchingView({
     }
 
     try {
+      // Render the confirmed modification at full resolution
+      const stitchResponse = await fetch('/api/operator/stitch', {
+        method: 'POST',
+        body: buildStitchFormData('full'),
+      });
+      const stitchData = await stitchResponse.json();
+      if (!stitchResponse.ok || !stitchData.success) {
+        throw new Error(stitchData.error || 'Failed to render full-resolution image');
+      }
+
       const response = await fetch('/api/operator/modification', {
         method: 'POST',
         headers: {
@@ -176,7 +191,8 @@ export default function StitchingView({
         body: JSON.stringify({
           operator_id: session?.user?.id,
           original_image_url: segmentedImage,
-          modified_image_url: stitchedImage,
+          modified_image_url: stitchData.stitchedImageUrl,
+          thumbnail_image_url: stitchData.derivatives?.thumbnail?.url,
           description: saveData.description,
           modification_details: saveData.modification_details,
           status: 'Saved',
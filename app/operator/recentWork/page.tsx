@@ -468,7 +468,7 @@ const RecentWorkPage: React.FC = () => {
                     {work.modified_image_url ? (
                       <>
                         <img
-                          src={work.modified_image_url}
+                          src={work.thumbnail_image_url || work.modified_image_url}
                           alt="Modification Preview"
                           className="w-full h-full object-cover rounded-md border"
                           onError={(e) => {
@@ -10,6 +10,7 @@ export interface Modification {
   operator_id: string;
   original_image_url: string;
   modified_image_url: string;
+  thumbnail_image_url?: string;
   modification_type?: string;
   vehicle_part?: string;
   description: string;
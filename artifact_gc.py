@@ -0,0 +1,503 @@
+import argparse
+import fnmatch
+import json
+import os
+import shutil
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import unquote, urlparse
+
+GC_DB_PATH = os.path.join('tmp', 'artifact_gc.sqlite3')
+# save-modification appends {"action": "pin", "urls": [...]} lines here
+PIN_JOURNAL_PATH = os.path.join('tmp', 'artifact_pins.jsonl')
+
+# Directories holding artifacts. depth is how many levels below the root an
+# artifact sits (a job directory is one artifact; blobs are <aa>/<bb>/<file>);
+# exclude lists names inside the root that are not artifacts of that root.
+ARTIFACT_ROOTS = (
+    {'root': os.path.join('public', 'segments'), 'depth': 1},
+    {'root': os.path.join('public', 'stitching_results'), 'depth': 1},
+    {'root': os.path.join('public', 'outputs'), 'depth': 1},
+    {'root': os.path.join('public', 'uploads'), 'depth': 1},
+    {'root': os.path.join('public', 'blobs'), 'depth': 3},
+    {'root': 'uploads', 'depth': 1, 'exclude': ('blobs',)},
+    {'root': os.path.join('uploads', 'blobs'), 'depth': 3},
+    {'root': 'tmp', 'depth': 1,
+     'exclude': ('stitch_cache', 'mask_cache', '*.sqlite3*', '*.jsonl')},
+    {'root': os.path.join('tmp', 'stitch_cache'), 'depth': 1},
+    {'root': os.path.join('tmp', 'mask_cache'), 'depth': 1},
+)
+
+# Total bytes artifacts may use, and the age after which unpinned ones go regardless
+BUDGET_ENV = 'RCMS_ARTIFACT_BUDGET_MB'
+MAX_AGE_ENV = 'RCMS_ARTIFACT_MAX_AGE_DAYS'
+DEFAULT_BUDGET_MB = 5 * 1024
+DEFAULT_MAX_AGE_DAYS = 30
+# Never evict anything used this recently: jobs may still be reading or writing it
+MIN_AGE = 3600
+# Artifacts indexed this recently are re-measured each pass while they may still grow
+SETTLE_WINDOW = 600
+# Directories stat()ed per pass beyond the roots; the rest wait for the next pass
+SCAN_BATCH = 2000
+DAEMON_INTERVAL = 300
+
+MB = 1024 * 1024
+DAY = 86400
+
+def budget_bytes(budget_mb=None):
+    if budget_mb is None:
+        budget_mb = float(os.environ.get(BUDGET_ENV, DEFAULT_BUDGET_MB))
+    return int(budget_mb * MB)
+
+def max_age_seconds(max_age_days=None):
+    if max_age_days is None:
+        max_age_days = float(os.environ.get(MAX_AGE_ENV, DEFAULT_MAX_AGE_DAYS))
+    return max_age_days * DAY
+
+def measure(path):
+    """
+    (bytes, newest mtime, last use) of a file or directory tree, or None
+    when it is gone. Hardlinked files (blob views) are charged 1/nlink to
+    each link so shared data is counted once.
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return None
+    if not os.path.isdir(path):
+        return int(st.st_size / max(st.st_nlink, 1)), st.st_mtime, max(st.st_atime, st.st_mtime)
+    size, mtime, used = 0, st.st_mtime, st.st_mtime
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                fst = os.lstat(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            size += int(fst.st_size / max(fst.st_nlink, 1))
+            mtime = max(mtime, fst.st_mtime)
+            used = max(used, fst.st_atime, fst.st_mtime)
+    return size, mtime, used
+
+def remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+def pinned_paths(url):
+    """
+    Artifact paths a public URL keeps alive: the job directory for
+    segment and stitching results, both views of a blob, and the
+    matching legacy upload.
+    """
+    path = unquote(urlparse(url).path if '://' in url else url)
+    parts = [part for part in path.split('/') if part and part not in ('.', '..')]
+    if len(parts) < 2:
+        return []
+    top = parts[0]
+    if top in ('segments', 'stitching_results', 'outputs'):
+        return [os.path.join('public', top, parts[1])]
+    if top == 'uploads':
+        return [os.path.join('public', 'uploads', parts[1]), os.path.join('uploads', parts[1])]
+    if top == 'blobs' and len(parts) == 4:
+        return [os.path.join('public', 'blobs', *parts[1:]), os.path.join('uploads', 'blobs', *parts[1:])]
+    return []
+
+def modification_urls(document):
+    """Every string that looks like a local URL anywhere in a saved modification."""
+    urls = []
+    if isinstance(document, dict):
+        for value in document.values():
+            urls.extend(modification_urls(value))
+    elif isinstance(document, list):
+        for value in document:
+            urls.extend(modification_urls(value))
+    elif isinstance(document, str) and document.startswith(('/', 'http://', 'https://')):
+        urls.append(document)
+    return urls
+
+class ArtifactIndex:
+    """
+    SQLite index of the artifacts under ARTIFACT_ROOTS: their size and
+    last use, which ones are pinned by saved modifications, and each
+    tracked directory's mtime so a pass only re-lists directories that
+    changed.
+
+    Use as a context manager.
+    """
+
+    def __init__(self, path=GC_DB_PATH, roots=ARTIFACT_ROOTS, scan_batch=SCAN_BATCH):
+        self.path = path
+        self.roots = roots
+        self.scan_batch = scan_batch
+        self.db = None
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS artifacts (
+                path TEXT PRIMARY KEY,
+                root TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                last_used REAL NOT NULL,
+                indexed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS artifacts_lru ON artifacts (last_used);
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                root TEXT NOT NULL,
+                levels INTEGER NOT NULL,
+                mtime_ns INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS pins (
+                path TEXT PRIMARY KEY,
+                url TEXT,
+                pinned_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        ''')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.close()
+        self.db = None
+        return False
+
+    def _get_state(self, key, default=None):
+        row = self.db.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_state(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+
+    # Scanning
+
+    def _root_spec(self, root):
+        for spec in self.roots:
+            if spec['root'] == root:
+                return spec
+        return None
+
+    def _forget(self, path):
+        """Drop a vanished directory and everything indexed below it."""
+        prefix = path.rstrip(os.sep) + os.sep
+        self.db.execute('DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?', (path, len(prefix), prefix))
+        self.db.execute('DELETE FROM artifacts WHERE path = ? OR substr(path, 1, ?) = ?',
+                        (path, len(prefix), prefix))
+
+    def _add_artifact(self, path, root, now):
+        measured = measure(path)
+        if measured is None:
+            return False
+        size, mtime, used = measured
+        self.db.execute('INSERT OR REPLACE INTO artifacts (path, root, size, mtime, last_used, indexed_at) '
+                        'VALUES (?, ?, ?, ?, ?, ?)', (path, root, size, mtime, used, now))
+        return True
+
+    def _check_dir(self, path, spec, levels, recorded_mtime, now, counts):
+        """Re-list a directory if its mtime moved since it was last listed."""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self._forget(path)
+            return
+        if mtime_ns == recorded_mtime:
+            return
+        counts['listed'] += 1
+        exclude = spec.get('exclude', ()) if path == spec['root'] else ()
+        entries = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith('.') or any(fnmatch.fnmatch(entry.name, p) for p in exclude):
+                    continue
+                if levels > 1 and not entry.is_dir(follow_symlinks=False):
+                    continue
+                entries[entry.path] = entry
+        if levels > 1:
+            known = {row[0]: row[1] for row in self.db.execute(
+                'SELECT path, mtime_ns FROM dirs WHERE root = ? AND levels = ? AND path LIKE ?',
+                (spec['root'], levels - 1, os.path.join(path, '%')))
+                if os.path.dirname(row[0]) == path}
+            for child in known.keys() - entries.keys():
+                self._forget(child)
+            for child in entries.keys() - known.keys():
+                self.db.execute('INSERT OR REPLACE INTO dirs (path, root, levels, mtime_ns) VALUES (?, ?, ?, NULL)',
+                                (child, spec['root'], levels - 1))
+                self._check_dir(child, spec, levels - 1, None, now, counts)
+        else:
+            known = {row[0] for row in self.db.execute(
+                'SELECT path FROM artifacts WHERE root = ? AND path LIKE ?', (spec['root'], os.path.join(path, '%')))
+                if os.path.dirname(row[0]) == path}
+            for child in known - entries.keys():
+                self.db.execute('DELETE FROM artifacts WHERE path = ?', (child,))
+                counts['removed'] += 1
+            for child in entries.keys() - known:
+                if self._add_artifact(child, spec['root'], now):
+                    counts['added'] += 1
+        self.db.execute('INSERT OR REPLACE INTO dirs (path, root, levels, mtime_ns) VALUES (?, ?, ?, ?)',
+                        (path, spec['root'], levels, mtime_ns))
+
+    def scan(self, now=None):
+        """
+        One incremental pass: the roots every time, then the next
+        scan_batch tracked subdirectories in rotation. Directories whose
+        mtime did not change are not listed again.
+        Returns counts of directories listed and artifacts added/removed.
+        """
+        now = time.time() if now is None else now
+        counts = {'listed': 0, 'added': 0, 'removed': 0}
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            for spec in self.roots:
+                if not os.path.isdir(spec['root']):
+                    self._forget(spec['root'])
+                    continue
+                row = self.db.execute('SELECT mtime_ns FROM dirs WHERE path = ?', (spec['root'],)).fetchone()
+                self._check_dir(spec['root'], spec, spec['depth'], row[0] if row else None, now, counts)
+            roots = [spec['root'] for spec in self.roots]
+            cursor = self._get_state('scan_cursor', '')
+            rows = self.db.execute('SELECT path, root, levels, mtime_ns FROM dirs WHERE path > ? ORDER BY path LIMIT ?',
+                                   (cursor, self.scan_batch)).fetchall()
+            for path, root, levels, mtime_ns in rows:
+                spec = self._root_spec(root)
+                if path in roots or spec is None:
+                    continue
+                self._check_dir(path, spec, levels, mtime_ns, now, counts)
+            self._set_state('scan_cursor', rows[-1][0] if len(rows) == self.scan_batch else '')
+            self._refresh_recent(now)
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        return counts
+
+    def _refresh_recent(self, now):
+        """Re-measure artifacts indexed while they may still have been written to."""
+        rows = self.db.execute('SELECT path, root FROM artifacts WHERE indexed_at > ? AND mtime > indexed_at - ?',
+                               (now - SETTLE_WINDOW, SETTLE_WINDOW)).fetchall()
+        for path, root in rows:
+            measured = measure(path)
+            if measured is None:
+                self.db.execute('DELETE FROM artifacts WHERE path = ?', (path,))
+            else:
+                self.db.execute('UPDATE artifacts SET size = ?, mtime = ?, last_used = ? WHERE path = ?',
+                                (*measured, path))
+
+    # Pins
+
+    def pin(self, urls, now=None):
+        """Pin the artifacts behind each URL; returns the paths pinned."""
+        now = time.time() if now is None else now
+        paths = []
+        for url in urls:
+            for path in pinned_paths(url):
+                self.db.execute('INSERT OR REPLACE INTO pins (path, url, pinned_at) VALUES (?, ?, ?)',
+                                (path, url, now))
+                paths.append(path)
+        return paths
+
+    def unpin(self, urls):
+        paths = [path for url in urls for path in pinned_paths(url)]
+        for path in paths:
+            self.db.execute('DELETE FROM pins WHERE path = ?', (path,))
+        return paths
+
+    def ingest_pin_journal(self, journal_path=PIN_JOURNAL_PATH):
+        """
+        Apply journal lines appended since the last call; the offset is kept
+        in the index, and reset when the journal is replaced or truncated.
+        """
+        try:
+            st = os.stat(journal_path)
+        except FileNotFoundError:
+            return 0
+        position = self._get_state('pin_journal', {'inode': None, 'offset': 0})
+        offset = position['offset'] if position['inode'] == st.st_ino and position['offset'] <= st.st_size else 0
+        applied = 0
+        with open(journal_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # A line still being appended; read it next time
+                    break
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    print(f"Skipping malformed pin journal line at {offset}", file=sys.stderr)
+                    continue
+                urls = [url for url in entry.get('urls', []) if isinstance(url, str)]
+                if entry.get('action') == 'unpin':
+                    self.unpin(urls)
+                else:
+                    self.pin(urls)
+                applied += 1
+        self._set_state('pin_journal', {'inode': st.st_ino, 'offset': offset})
+        return applied
+
+    def sync_mongo_pins(self, uri=None, database=None):
+        """Pin every URL referenced by the saved modifications in MongoDB."""
+        import pymongo
+        uri = uri or os.environ.get('MONGODB_URI')
+        if not uri:
+            raise ValueError('MONGODB_URI is not set')
+        client = pymongo.MongoClient(uri)
+        try:
+            db = client[database] if database else client.get_default_database()
+            pinned = 0
+            for document in db['modifications'].find({}, {'_id': 0}):
+                pinned += len(self.pin(modification_urls(document)))
+            return pinned
+        finally:
+            client.close()
+
+    # Eviction
+
+    def collect(self, budget=None, max_age=None, min_age=MIN_AGE, dry_run=False, now=None):
+        """
+        Evict unpinned artifacts, least recently used first: every one older
+        than max_age, then more until the total is under budget bytes.
+        Each candidate is stat()ed again first, so one used since it was
+        indexed survives. Returns the evicted artifacts.
+        """
+        now = time.time() if now is None else now
+        budget = budget_bytes() if budget is None else budget
+        max_age = max_age_seconds() if max_age is None else max_age
+        total = self.total_bytes()
+        evicted = []
+        candidates = self.db.execute(
+            'SELECT path, size, last_used FROM artifacts '
+            'WHERE last_used < ? AND path NOT IN (SELECT path FROM pins) ORDER BY last_used',
+            (now - min_age,)).fetchall()
+        for path, size, last_used in candidates:
+            expired = last_used < now - max_age
+            if not expired and total <= budget:
+                break
+            measured = measure(path)
+            if measured is None:
+                self.db.execute('DELETE FROM artifacts WHERE path = ?', (path,))
+                total -= size
+                continue
+            if measured[2] > last_used:
+                # Used since it was indexed; reconsider it on a later pass
+                self.db.execute('UPDATE artifacts SET size = ?, mtime = ?, last_used = ? WHERE path = ?',
+                                (*measured, path))
+                total += measured[0] - size
+                continue
+            evicted.append({'path': path, 'bytes': measured[0], 'reason': 'age' if expired else 'budget'})
+            total -= measured[0]
+            if not dry_run:
+                remove(path)
+                self.db.execute('DELETE FROM artifacts WHERE path = ?', (path,))
+        return evicted
+
+    def run_pass(self, budget=None, max_age=None, min_age=MIN_AGE, dry_run=False, journal_path=PIN_JOURNAL_PATH):
+        """Pins from the journal, an incremental scan, then eviction."""
+        pins = self.ingest_pin_journal(journal_path)
+        counts = self.scan()
+        evicted = self.collect(budget, max_age, min_age, dry_run)
+        return dict(counts, pinsApplied=pins, evicted=len(evicted),
+                    evictedBytes=sum(item['bytes'] for item in evicted), totalBytes=self.total_bytes())
+
+    def total_bytes(self):
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM artifacts').fetchone()[0]
+
+    def stats(self):
+        roots = {root: {'artifacts': count, 'bytes': size} for root, count, size in self.db.execute(
+            'SELECT root, COUNT(*), SUM(size) FROM artifacts GROUP BY root')}
+        pinned = self.db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts WHERE path IN (SELECT path FROM pins)').fetchone()
+        return {
+            'totalBytes': self.total_bytes(),
+            'pinnedArtifacts': pinned[0],
+            'pinnedBytes': pinned[1],
+            'pins': self.db.execute('SELECT COUNT(*) FROM pins').fetchone()[0],
+            'trackedDirs': self.db.execute('SELECT COUNT(*) FROM dirs').fetchone()[0],
+            'roots': roots
+        }
+
+def run_daemon(index_path=GC_DB_PATH, interval=DAEMON_INTERVAL, budget=None, max_age=None,
+               min_age=MIN_AGE, stop_event=None):
+    """Run a pass every `interval` seconds until SIGTERM/SIGINT."""
+    stop_event = stop_event or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        def shutdown(signum, frame):
+            stop_event.set()
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+    with ArtifactIndex(index_path) as index:
+        while not stop_event.is_set():
+            try:
+                summary = index.run_pass(budget, max_age, min_age)
+                # Decoded images one-shot stages left in /dev/shm, once idle
+                from shared_images import sweep_idle
+                summary['sharedImagesUnlinked'] = len(sweep_idle())
+                print(json.dumps(summary), file=sys.stderr)
+            except Exception as e:
+                print(f"Artifact GC pass failed: {e}", file=sys.stderr)
+            stop_event.wait(interval)
+
+def main():
+    parser = argparse.ArgumentParser(description='Index job artifacts and evict old ones under a byte budget.')
+    parser.add_argument('--index', default=GC_DB_PATH, help='SQLite index file')
+    parser.add_argument('--budget-mb', type=float, help=f'Byte budget in MB (default ${BUDGET_ENV} or {DEFAULT_BUDGET_MB})')
+    parser.add_argument('--max-age-days', type=float,
+                        help=f'Evict unpinned artifacts older than this (default ${MAX_AGE_ENV} or {DEFAULT_MAX_AGE_DAYS})')
+    parser.add_argument('--min-age', type=float, default=MIN_AGE, help='Seconds an artifact is protected after use')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('scan', help='Update the index incrementally')
+    collect = commands.add_parser('collect', help='Scan, then evict; prints the evicted artifacts')
+    collect.add_argument('--dry-run', action='store_true', help='Only report what would be evicted')
+    commands.add_parser('status', help='Print index totals as JSON')
+    for name in ('pin', 'unpin'):
+        command = commands.add_parser(name, help=f'{name.capitalize()} the artifacts behind public URLs')
+        command.add_argument('urls', nargs='+')
+    sync = commands.add_parser('sync-mongo', help='Pin everything referenced by saved modifications')
+    sync.add_argument('--uri', help='MongoDB URI (default $MONGODB_URI)')
+    daemon = commands.add_parser('daemon', help='Run a pass every --interval seconds')
+    daemon.add_argument('--interval', type=float, default=DAEMON_INTERVAL)
+
+    args = parser.parse_args()
+    budget = budget_bytes(args.budget_mb)
+    max_age = max_age_seconds(args.max_age_days)
+
+    if args.command == 'daemon':
+        run_daemon(args.index, args.interval, budget, max_age, args.min_age)
+        return
+
+    with ArtifactIndex(args.index) as index:
+        if args.command == 'scan':
+            index.ingest_pin_journal()
+            print(json.dumps(index.scan()))
+        elif args.command == 'collect':
+            index.ingest_pin_journal()
+            index.scan()
+            evicted = index.collect(budget, max_age, args.min_age, args.dry_run)
+            print(json.dumps({'dryRun': args.dry_run, 'evicted': evicted, 'totalBytes': index.total_bytes()}, indent=2))
+        elif args.command == 'status':
+            print(json.dumps(index.stats(), indent=2))
+        elif args.command == 'pin':
+            print(json.dumps({'pinned': index.pin(args.urls)}))
+        elif args.command == 'unpin':
+            print(json.dumps({'unpinned': index.unpin(args.urls)}))
+        else:
+            print(json.dumps({'pinned': index.sync_mongo_pins(args.uri)}))
+
+if __name__ == "__main__":
+    main()
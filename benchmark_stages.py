@@ -0,0 +1,403 @@
+import cv2
+import numpy as np
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from yolo_detector import preprocess_image, filter_detections
+from sam_segmentation import segment_image
+from inference_backends import StubSamPredictor
+from memory_guard import peak_rss_mb
+from stitching import stitch_part_with_mask, stitch_references
+from thread_budget import available_cpus, configure_worker, format_cpus
+
+# Megapixel sizes and part counts of the default matrix
+DEFAULT_SIZES = (1, 12, 48)
+DEFAULT_PART_COUNTS = (1, 10, 30)
+DEFAULT_RUNS = 5
+# A stage regresses when its p50 grows by more than this fraction
+DEFAULT_TOLERANCE = 0.2
+SEED = 1234
+# Workers x threads split search: the stage run in every worker, and for how long
+DEFAULT_SPLIT_CASE = 'stitch_references/12mp/10parts'
+DEFAULT_SPLIT_SECONDS = 10.0
+
+def synthetic_image(megapixels, seed=SEED):
+    """Deterministic 4:3 BGR test image: gradient, shapes and sensor-like noise."""
+    height = int(round((megapixels * 1e6 * 3 / 4) ** 0.5))
+    width = int(round(height * 4 / 3))
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:, :, 0] = (x * 0.6 + y * 0.4).astype(np.uint8)
+    image[:, :, 1] = (255 - x * 0.5).astype(np.uint8)
+    image[:, :, 2] = (y * 0.8 + 40).astype(np.uint8)
+    for _ in range(20):
+        cx, cy = int(rng.integers(0, width)), int(rng.integers(0, height))
+        radius = int(rng.integers(10, max(11, width // 8)))
+        cv2.circle(image, (cx, cy), radius, tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+    noise = rng.integers(-8, 9, (height, width, 1), dtype=np.int16)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+def synthetic_detections(image_shape, count, seed=SEED):
+    """Parts laid out on a grid, in the YOLO detection format."""
+    height, width = image_shape[:2]
+    rng = np.random.default_rng(seed)
+    cols = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / cols))
+    cell_w, cell_h = width / cols, height / rows
+    detections = []
+    for i in range(count):
+        col, row = i % cols, i // cols
+        x1 = col * cell_w + cell_w * 0.1
+        y1 = row * cell_h + cell_h * 0.1
+        x2 = x1 + cell_w * 0.8
+        y2 = y1 + cell_h * 0.8
+        detections.append({
+            'class_name': f"part_{i}",
+            'confidence': float(rng.uniform(0.3, 0.99)),
+            'bbox': [float(x1), float(y1), float(x2), float(y2)],
+            'center_point': [int((x1 + x2) / 2), int((y1 + y2) / 2)]
+        })
+    return detections
+
+def reference_image(size=512):
+    """RGBA reference with a soft edge, like a prepared reference asset."""
+    reference = np.zeros((size, size, 4), dtype=np.uint8)
+    reference[:, :, :3] = cv2.resize(synthetic_image(size * size / 1e6, SEED + 1), (size, size))
+    alpha = np.zeros((size, size), dtype=np.uint8)
+    cv2.circle(alpha, (size // 2, size // 2), size // 2 - 8, 255, -1)
+    reference[:, :, 3] = cv2.GaussianBlur(alpha, (15, 15), 0)
+    return reference
+
+def build_cases(sizes, part_counts):
+    """
+    The benchmark matrix: (name, setup, run) where setup builds inputs
+    once and run is the timed call.
+    """
+    cases = []
+    for mp in sizes:
+        cases.append((f"preprocess_image/{mp}mp",
+                      lambda mp=mp: synthetic_image(mp),
+                      preprocess_image))
+        cases.append((f"jpeg_encode/{mp}mp",
+                      lambda mp=mp: synthetic_image(mp),
+                      lambda image: cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 95])))
+        cases.append((f"jpeg_decode/{mp}mp",
+                      lambda mp=mp: cv2.imencode('.jpg', synthetic_image(mp))[1],
+                      lambda data: cv2.imdecode(data, cv2.IMREAD_COLOR)))
+        for count in part_counts:
+            cases.append((f"sam_postprocess/{mp}mp/{count}parts",
+                          lambda mp=mp, count=count: sam_inputs(mp, count),
+                          lambda inputs: segment_image(*inputs)))
+            cases.append((f"stitch_references/{mp}mp/{count}parts",
+                          lambda mp=mp, count=count: stitch_inputs(mp, count),
+                          lambda inputs: stitch_references(*inputs)))
+        cases.append((f"stitch_part_with_mask/{mp}mp",
+                      lambda mp=mp: single_part_inputs(mp),
+                      lambda inputs: stitch_part_with_mask(*inputs)))
+    for count in sorted(set(part_counts) | {100}):
+        cases.append((f"filter_detections/{count}",
+                      lambda count=count: synthetic_detections((3000, 4000), count),
+                      filter_detections))
+    return cases
+
+def sam_inputs(megapixels, count):
+    image = synthetic_image(megapixels)
+    return image, synthetic_detections(image.shape, count), StubSamPredictor()
+
+def stitch_parts(image, count):
+    """
+    Segmented parts with in-memory cropped masks, as pipeline.py hands
+    them over, and the base with the parts cut out. Masks are drawn per
+    crop so setup stays small next to the stage being measured.
+    """
+    modified = image.copy()
+    segmented = []
+    for detection in synthetic_detections(image.shape, count):
+        x1, y1, x2, y2 = (int(v) for v in detection['bbox'])
+        mask = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+        cv2.ellipse(mask, ((x2 - x1) // 2, (y2 - y1) // 2), ((x2 - x1) // 2, (y2 - y1) // 2), 0, 0, 360, 255, -1)
+        modified[y1:y2, x1:x2][mask > 0] = 0
+        segmented.append(dict(detection, x=x1, y=y1, w=x2 - x1, h=y2 - y1, mask_contour=[], mask=(x1, y1, mask)))
+    return segmented, modified
+
+def stitch_inputs(megapixels, count):
+    image = synthetic_image(megapixels)
+    segmented, modified = stitch_parts(image, count)
+    references_dir = os.path.join('public', 'benchmark_refs')
+    os.makedirs(references_dir, exist_ok=True)
+    reference_path = os.path.join(references_dir, 'reference.png')
+    if not os.path.exists(reference_path):
+        cv2.imwrite(reference_path, reference_image())
+    data = {
+        'segmentedParts': segmented,
+        'references': [{'className': part['class_name'], 'imagePath': '/benchmark_refs/reference.png'}
+                       for part in segmented]
+    }
+    return modified, data
+
+def single_part_inputs(megapixels):
+    image = synthetic_image(megapixels)
+    segmented, modified = stitch_parts(image, 1)
+    part = segmented[0]
+    part_info = {'x': part['x'], 'y': part['y'], 'w': part['w'], 'h': part['h'],
+                 'contour': [], 'mask': part['mask']}
+    return modified, reference_image(), part_info, None, part['class_name']
+
+def percentile_summary(samples):
+    samples = np.array(samples) * 1000.0
+    return {
+        'runs': int(len(samples)),
+        'p50Ms': round(float(np.percentile(samples, 50)), 3),
+        'p90Ms': round(float(np.percentile(samples, 90)), 3),
+        'p99Ms': round(float(np.percentile(samples, 99)), 3),
+        'meanMs': round(float(samples.mean()), 3),
+        'minMs': round(float(samples.min()), 3)
+    }
+
+def run_case(case, runs, connection):
+    """Child process body: set up once, warm up, time `runs` calls."""
+    name, setup, run = case
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            inputs = setup()
+            setup_rss = peak_rss_mb()
+            run(inputs)
+            samples = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                run(inputs)
+                samples.append(time.perf_counter() - started)
+        # Peak RSS is a high-water mark: it only reflects the stage when above setup
+        connection.send(dict(percentile_summary(samples), peakRssMb=peak_rss_mb(), setupPeakRssMb=setup_rss))
+    except Exception as e:
+        connection.send({'error': f"{type(e).__name__}: {str(e)}"})
+    finally:
+        connection.close()
+
+def run_benchmarks(sizes=DEFAULT_SIZES, part_counts=DEFAULT_PART_COUNTS, runs=DEFAULT_RUNS, only=None):
+    """
+    Run every case in a fresh process so peak RSS is per case.
+    Returns the results document.
+    """
+    context = multiprocessing.get_context('fork')
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            for case in build_cases(sizes, part_counts):
+                name = case[0]
+                if only and not any(pattern in name for pattern in only):
+                    continue
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=run_case, args=(case, runs, sender))
+                process.start()
+                sender.close()
+                results[name] = receiver.recv() if receiver.poll(3600) else {'error': 'timed out'}
+                process.join()
+                print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+        finally:
+            os.chdir(cwd)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'runs': runs,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'results': results
+    }
+
+def candidate_splits(cores):
+    """(workers, threads) pairs filling `cores`: power-of-two worker counts and one per core."""
+    splits = {(cores, 1)}
+    workers = 1
+    while workers <= cores:
+        splits.add((workers, cores // workers))
+        workers *= 2
+    return sorted(splits)
+
+def split_worker(case, threads, cpus, seconds, barrier, connection):
+    """Child process body: take a thread budget, then run the case in a loop for `seconds`."""
+    name, setup, run = case
+    try:
+        configure_worker(threads=threads, cpus=cpus)
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            inputs = setup()
+            run(inputs)
+            # Every worker starts timing together, so they really compete for the cores
+            barrier.wait()
+            samples = []
+            started = time.perf_counter()
+            while time.perf_counter() - started < seconds:
+                call_started = time.perf_counter()
+                run(inputs)
+                samples.append(time.perf_counter() - call_started)
+            elapsed = time.perf_counter() - started
+        connection.send(dict(percentile_summary(samples), itemsPerSecond=len(samples) / elapsed))
+    except Exception as e:
+        connection.send({'error': f"{type(e).__name__}: {str(e)}"})
+    finally:
+        connection.close()
+
+def run_split_benchmark(case_name=DEFAULT_SPLIT_CASE, cores=None, seconds=DEFAULT_SPLIT_SECONDS,
+                        splits=None, pin=False):
+    """
+    Run one stage in W processes of T threads each, for every W x T split
+    of the cores, and report the throughput of each; 'best' is the split
+    with the most items per second. pin gives each worker its own cores.
+    """
+    cpus = available_cpus()[:cores] if cores else available_cpus()
+    cases = {case[0]: case for case in build_cases(DEFAULT_SIZES, DEFAULT_PART_COUNTS)}
+    if case_name not in cases:
+        raise ValueError(f"Unknown case: {case_name}")
+    context = multiprocessing.get_context('fork')
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            for workers, threads in splits or candidate_splits(len(cpus)):
+                barrier = context.Barrier(workers)
+                receivers, processes = [], []
+                for i in range(workers):
+                    worker_cpus = cpus[i * threads:(i + 1) * threads] if pin else None
+                    receiver, sender = context.Pipe(duplex=False)
+                    process = context.Process(target=split_worker,
+                                              args=(cases[case_name], threads, worker_cpus, seconds, barrier, sender))
+                    process.start()
+                    sender.close()
+                    receivers.append(receiver)
+                    processes.append(process)
+                outcomes = [receiver.recv() if receiver.poll(3600) else {'error': 'timed out'}
+                            for receiver in receivers]
+                for process in processes:
+                    process.join()
+                errors = [outcome['error'] for outcome in outcomes if 'error' in outcome]
+                key = f"{workers}x{threads}"
+                if errors:
+                    results[key] = {'workers': workers, 'threads': threads, 'error': errors[0]}
+                else:
+                    results[key] = {
+                        'workers': workers,
+                        'threads': threads,
+                        'itemsPerSecond': round(sum(outcome['itemsPerSecond'] for outcome in outcomes), 3),
+                        'p50Ms': round(float(np.median([outcome['p50Ms'] for outcome in outcomes])), 3),
+                        'p90Ms': round(max(outcome['p90Ms'] for outcome in outcomes), 3)
+                    }
+                print(f"{case_name} {key}: {json.dumps(results[key])}", file=sys.stderr)
+        finally:
+            os.chdir(cwd)
+    measured = [result for result in results.values() if 'error' not in result]
+    best = max(measured, key=lambda result: result['itemsPerSecond']) if measured else None
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'cpus': format_cpus(cpus),
+            'case': case_name,
+            'seconds': seconds,
+            'pinned': pin,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'results': results,
+        'best': best
+    }
+
+def compare_to_baseline(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Cases whose p50 latency or peak RSS grew by more than tolerance.
+    Returns a list of {'case', 'metric', 'baseline', 'current', 'change'}.
+    """
+    regressions = []
+    for name, current in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or 'error' in previous or 'error' in current:
+            continue
+        for metric in ('p50Ms', 'peakRssMb'):
+            if previous[metric] > 0 and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append({
+                    'case': name,
+                    'metric': metric,
+                    'baseline': previous[metric],
+                    'current': current[metric],
+                    'change': round(current[metric] / previous[metric] - 1, 3)
+                })
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the processing stages on synthetic inputs.')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='Image sizes in megapixels, comma separated')
+    parser.add_argument('--parts', default=','.join(str(p) for p in DEFAULT_PART_COUNTS),
+                        help='Part counts, comma separated')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help='Timed runs per case')
+    parser.add_argument('--only', action='append', help='Only run cases whose name contains this')
+    parser.add_argument('--output', help='Write the results JSON here instead of stdout')
+    parser.add_argument('--baseline', help='Compare against this results JSON; exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed relative growth before a case counts as regressed')
+    parser.add_argument('--splits', action='store_true',
+                        help='Instead of the matrix, find the best workers x threads split for one case')
+    parser.add_argument('--split-case', default=DEFAULT_SPLIT_CASE, help='Case the split search runs')
+    parser.add_argument('--split-seconds', type=float, default=DEFAULT_SPLIT_SECONDS,
+                        help='Seconds each split runs for')
+    parser.add_argument('--cores', type=int, help='Cores to split (default: all available)')
+    parser.add_argument('--pin', action='store_true', help='Pin each worker to its own cores')
+    args = parser.parse_args()
+
+    if args.splits:
+        report = run_split_benchmark(args.split_case, args.cores, args.split_seconds, pin=args.pin)
+        output = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(output)
+        else:
+            print(output)
+        best = report['best']
+        if best is None:
+            sys.exit(1)
+        print(f"Best split: {best['workers']} workers x {best['threads']} threads "
+              f"({best['itemsPerSecond']} items/s); set RCMS_WORKER_THREADS={best['threads']}",
+              file=sys.stderr)
+        sys.exit(0)
+
+    report = run_benchmarks(
+        sizes=[float(s) if '.' in s else int(s) for s in args.sizes.split(',')],
+        part_counts=[int(p) for p in args.parts.split(',')],
+        runs=args.runs,
+        only=args.only
+    )
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        report['regressions'] = regressions
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    for regression in regressions:
+        print(f"Regression: {regression['case']} {regression['metric']} "
+              f"{regression['baseline']} -> {regression['current']} (+{regression['change']:.0%})",
+              file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
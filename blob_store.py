@@ -0,0 +1,218 @@
+import argparse
+import errno
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+# Content-addressed store: every distinct upload is written once, as
+# BLOB_ROOT/<aa>/<bb>/<sha256>.<ext>, and exposed to the browser as a
+# hardlink (or reflink, or copy) at PUBLIC_BLOB_ROOT/<aa>/<bb>/<sha256>.<ext>.
+# lib/services/blobStore.ts writes the same layout.
+BLOB_ROOT = os.path.join('uploads', 'blobs')
+PUBLIC_BLOB_ROOT = os.path.join('public', 'blobs')
+BLOB_URL_ROOT = '/blobs'
+# Blob URLs never change content, so they may be cached forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+BLOB_NAME_RE = re.compile(r'^([0-9a-f]{64})\.[a-z0-9]+$')
+CHUNK_SIZE = 1024 * 1024
+# Linux FICLONE ioctl: share extents on btrfs/XFS instead of copying
+FICLONE = 0x40049409
+
+def sniff_extension(head):
+    """File extension from the leading bytes of an image, or 'bin'."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    return 'bin'
+
+def shard(digest):
+    return os.path.join(digest[:2], digest[2:4])
+
+def blob_path(digest, extension, root=BLOB_ROOT):
+    return os.path.join(root, shard(digest), f"{digest}.{extension}")
+
+def blob_url(digest, extension):
+    return f"{BLOB_URL_ROOT}/{digest[:2]}/{digest[2:4]}/{digest}.{extension}"
+
+def blob_digest(path, root=BLOB_ROOT):
+    """
+    The SHA-256 of a file inside the store, read from its name, or None
+    for files outside it; lets caches key on blobs without re-hashing.
+    """
+    name = os.path.basename(path)
+    match = BLOB_NAME_RE.match(name)
+    if match is None:
+        return None
+    directory = os.path.dirname(os.path.abspath(path))
+    for store in (root, PUBLIC_BLOB_ROOT):
+        if directory == os.path.join(os.path.abspath(store), shard(match.group(1))):
+            return match.group(1)
+    return None
+
+def clone_file(source, destination):
+    """
+    Make destination share source's data: hardlink, then reflink, then a
+    plain copy (across filesystems or where links are not supported).
+    """
+    try:
+        os.link(source, destination)
+        return 'hardlink'
+    except FileExistsError:
+        raise
+    except OSError:
+        pass
+    try:
+        import fcntl
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return 'reflink'
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(source, destination)
+    return 'copy'
+
+def install(source, destination, move=False):
+    """
+    Put source at destination unless a blob is already there (first
+    writer wins; the contents are identical by construction).
+    Returns True when the destination was created.
+    """
+    if os.path.exists(destination):
+        return False
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    # Build the file under a temporary name so readers never see a partial blob
+    fd, staging = tempfile.mkstemp(dir=os.path.dirname(destination), prefix='.incoming-')
+    os.close(fd)
+    os.unlink(staging)
+    try:
+        if move:
+            os.replace(source, staging)
+        else:
+            clone_file(source, staging)
+        # Read-only: a stray in-place write through any link would corrupt every view
+        os.chmod(staging, 0o444)
+        try:
+            os.link(staging, destination)
+        except FileExistsError:
+            return False
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.EXDEV, errno.ENOTSUP, errno.EOPNOTSUPP):
+                raise
+            os.replace(staging, destination)
+        return True
+    finally:
+        if os.path.exists(staging):
+            os.unlink(staging)
+
+def blob_record(digest, extension, size, created, root=BLOB_ROOT):
+    return {
+        'sha256': digest,
+        'extension': extension,
+        'size': size,
+        'path': blob_path(digest, extension, root),
+        'url': blob_url(digest, extension),
+        'deduplicated': not created
+    }
+
+def publish(digest, extension, root=BLOB_ROOT, public_root=PUBLIC_BLOB_ROOT):
+    """Expose a stored blob under public/ and return its URL."""
+    destination = blob_path(digest, extension, public_root)
+    if not os.path.exists(destination):
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        try:
+            clone_file(blob_path(digest, extension, root), destination)
+        except FileExistsError:
+            pass
+    return blob_url(digest, extension)
+
+def put_file(path, extension=None, move=False, public=True, root=BLOB_ROOT, public_root=PUBLIC_BLOB_ROOT):
+    """
+    Store a file by content. With move=True the source is renamed into
+    the store (no data written) instead of linked or copied.
+    Returns the blob record: sha256, extension, size, path, url, deduplicated.
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        head = f.read(CHUNK_SIZE)
+        sha.update(head)
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    extension = extension or sniff_extension(head)
+    created = install(path, blob_path(digest, extension, root), move)
+    if move and not created and os.path.exists(path):
+        os.unlink(path)
+    if public:
+        publish(digest, extension, root, public_root)
+    return blob_record(digest, extension, os.path.getsize(blob_path(digest, extension, root)), created, root)
+
+def put_bytes(data, extension=None, public=True, root=BLOB_ROOT, public_root=PUBLIC_BLOB_ROOT):
+    """Store an in-memory upload by content; see put_file."""
+    digest = hashlib.sha256(data).hexdigest()
+    extension = extension or sniff_extension(data[:16])
+    destination = blob_path(digest, extension, root)
+    created = False
+    if not os.path.exists(destination):
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        fd, staging = tempfile.mkstemp(dir=os.path.dirname(destination), prefix='.incoming-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        created = install(staging, destination, move=True)
+    if public:
+        publish(digest, extension, root, public_root)
+    return blob_record(digest, extension, len(data), created, root)
+
+def has_exif(path, limit=65536):
+    """True when a JPEG carries an Exif block (which may rotate it on decode)."""
+    with open(path, 'rb') as f:
+        return b'Exif\x00\x00' in f.read(limit)
+
+def link_or_copy(source, destination):
+    """
+    Place a derived copy of an existing file (e.g. a stage's original.jpg)
+    without writing its bytes again when the filesystem allows.
+    """
+    if os.path.exists(destination):
+        os.unlink(destination)
+    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+    return clone_file(source, destination)
+
+def main():
+    parser = argparse.ArgumentParser(description='Content-addressed upload store.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    put = commands.add_parser('put', help='Store a file and print its blob record as JSON')
+    put.add_argument('path', help="File to store, or '-' for stdin")
+    put.add_argument('--move', action='store_true', help='Rename the file into the store instead of linking')
+    put.add_argument('--private', action='store_true', help='Do not publish under public/blobs')
+    locate = commands.add_parser('path', help='Print the store path of a blob URL or digest')
+    locate.add_argument('blob', help='Blob URL (/blobs/...) or <sha256>.<ext>')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'put':
+            if args.path == '-':
+                record = put_bytes(sys.stdin.buffer.read(), public=not args.private)
+            else:
+                record = put_file(args.path, move=args.move, public=not args.private)
+            print(json.dumps(record))
+        else:
+            match = BLOB_NAME_RE.match(os.path.basename(args.blob))
+            if match is None:
+                raise ValueError(f"Not a blob reference: {args.blob}")
+            print(blob_path(match.group(1), os.path.basename(args.blob).split('.', 1)[1]))
+    except Exception as e:
+        print(json.dumps({'success': False, 'error': str(e)}))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
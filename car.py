@@ -3,45 +3,74 @@ import numpy as np
 import os
 import sys
 import argparse
+import json
+import socketserver
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from car_backends import BACKENDS, load_classifier, resolve_backend, convert_model, run_parity_check
+from classification_cache import ClassificationCache, DEFAULT_TTL, file_sha256
+from instrumentation import span, serve_metrics_from_env
+from thread_budget import configure_worker, worker_threads
+from inference_backends import create_backend, configured_backend
 
-def load_car_classifier_model():
+# Batch mode: images per model.predict call and the most decode threads
+# (never more than the worker's thread budget)
+BATCH_SIZE = 32
+DECODE_WORKERS = 8
+MODEL_INPUT_SIZE = (224, 224)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+# Heuristic detector: longest side of the decode it works on, and its features
+HEURISTIC_MAX_SIZE = 256
+HEURISTIC_FEATURES = ('mean_intensity', 'std_intensity', 'edge_ratio', 'aspect_ratio')
+# Bump when the heuristic changes so cached heuristic results are not reused
+HEURISTIC_VERSION = 'v2'
+HEURISTIC_MODEL_KEY = f"heuristic:{HEURISTIC_VERSION}"
+
+def load_car_classifier_model(backend=None, model_path=None):
     """
-    Load the pre-trained car classifier model
+    Load the pre-trained car classifier model.
+    Converted ONNX/TFLite models are preferred; TensorFlow is only imported
+    for the Keras backend.
     """
     try:
-        import tensorflow as tf
-        from tensorflow.keras.models import load_model
-        
-        # Load the model
-        model_path = 'car_classifier_model.h5'
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"Model file not found: {model_path}")
-        
-        model = load_model(model_path)
-        return model
-    except ImportError:
-        raise ImportError("TensorFlow is required to load the model")
+        return load_classifier(backend, model_path)
+    except (ImportError, FileNotFoundError, ValueError):
+        raise
     except Exception as e:
         raise Exception(f"Error loading model: {str(e)}")
 
-def preprocess_image_for_model(image_path, target_size=(224, 224)):
+def load_model_input(image_path, target_size=MODEL_INPUT_SIZE):
+    """
+    Decode one image into a normalized (h, w, 3) RGB float32 array
+    """
+    # Read and resize image
+    with span('classify', 'decode'):
+        img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError("Could not read image file")
+    with span('classify', 'preprocess'):
+        return model_input_from_image(img, target_size)
+
+def model_input_from_image(img, target_size=MODEL_INPUT_SIZE):
+    """
+    Normalized (h, w, 3) RGB float32 model input from a decoded BGR image
+    """
+    # Convert BGR to RGB
+    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    
+    # Resize to target size
+    img_resized = cv2.resize(img_rgb, target_size)
+    
+    # Normalize pixel values to [0, 1]
+    return img_resized.astype(np.float32) / 255.0
+
+def preprocess_image_for_model(image_path, target_size=MODEL_INPUT_SIZE):
     """
     Preprocess image for the car classifier model
     """
     try:
-        # Read and resize image
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError("Could not read image file")
-        
-        # Convert BGR to RGB
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Resize to target size
-        img_resized = cv2.resize(img_rgb, target_size)
-        
-        # Normalize pixel values to [0, 1]
-        img_normalized = img_resized.astype(np.float32) / 255.0
+        img_normalized = load_model_input(image_path, target_size)
         
         # Add batch dimension
         img_batch = np.expand_dims(img_normalized, axis=0)
@@ -50,101 +79,568 @@ def preprocess_image_for_model(image_path, target_size=(224, 224)):
     except Exception as e:
         raise Exception(f"Error preprocessing image: {str(e)}")
 
+def classification_result(is_car, probability, confidence, backend):
+    """
+    Structured classification; 'result' is the string the Node.js side shows
+    """
+    if is_car:
+        result = f"This is a car (confidence: {confidence:.2f})"
+    else:
+        result = f"This is not a car (confidence: {confidence:.2f})"
+    return {
+        'result': result,
+        'is_car': bool(is_car),
+        'probability': float(probability),
+        'confidence': float(confidence),
+        'backend': backend
+    }
+
+def prediction_result(prediction, backend=None):
+    """
+    Turn one row of model output into a structured classification
+    """
+    # Assuming binary classification (car vs not car)
+    # If your model has different output format, adjust accordingly
+    car_probability = prediction[0] if len(prediction) == 1 else prediction[1]
+    
+    # Determine classification
+    is_car = car_probability > 0.5
+    confidence = car_probability if is_car else 1 - car_probability
+    return classification_result(is_car, car_probability, confidence, backend)
+
+def format_prediction(prediction):
+    """
+    Turn one row of model output into the classification string
+    """
+    return prediction_result(prediction)['result']
+
 def classify_car_with_model(image_path, model):
     """
     Classify car using the loaded model
     """
+    return model_classification(image_path, model)['result']
+
+def model_classification(image_path, model):
+    """
+    Structured classification of one image with the loaded model
+    """
     try:
         # Preprocess the image
         processed_image = preprocess_image_for_model(image_path)
         
         # Make prediction
-        prediction = model.predict(processed_image, verbose=0)
+        with span('classify', 'inference', backend=getattr(model, 'backend', None)):
+            prediction = model.predict(processed_image, verbose=0)
         
-        # Assuming binary classification (car vs not car)
-        # If your model has different output format, adjust accordingly
         if len(prediction.shape) > 1:
             # If prediction is 2D, take the first row
             prediction = prediction[0]
         
-        # Get the probability of being a car
-        car_probability = prediction[0] if len(prediction) == 1 else prediction[1]
-        
-        # Determine classification
-        is_car = car_probability > 0.5
-        confidence = car_probability if is_car else 1 - car_probability
-        
-        if is_car:
-            return f"This is a car (confidence: {confidence:.2f})"
-        else:
-            return f"This is not a car (confidence: {confidence:.2f})"
+        return prediction_result(prediction, getattr(model, 'backend', None))
             
     except Exception as e:
         raise Exception(f"Error in model classification: {str(e)}")
 
+def read_reduced_gray(image_path, max_size=HEURISTIC_MAX_SIZE):
+    """
+    Decode an image as grayscale at roughly max_size on its longest side.
+    JPEGs are scaled down inside the decoder (1/2, 1/4 or 1/8), so large
+    uploads are never decoded at full resolution.
+    """
+    data = np.fromfile(image_path, dtype=np.uint8)
+    smallest = cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if smallest is None:
+        raise ValueError("Could not read image file")
+
+    # Pick the strongest reduction that still covers max_size
+    gray = smallest
+    for factor, flag in ((8, None), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                         (2, cv2.IMREAD_REDUCED_GRAYSCALE_2), (1, cv2.IMREAD_GRAYSCALE)):
+        if max(smallest.shape) * 8 // factor >= max_size or factor == 1:
+            if flag is not None:
+                gray = cv2.imdecode(data, flag)
+            break
+    return reduce_gray(gray, max_size)
+
+def reduce_gray(gray, max_size=HEURISTIC_MAX_SIZE):
+    """
+    Shrink a grayscale image to at most max_size on its longest side
+    """
+    height, width = gray.shape
+    if max(height, width) > max_size:
+        scale = max_size / max(height, width)
+        gray = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                          interpolation=cv2.INTER_AREA)
+    return gray
+
+def extract_heuristic_features(gray):
+    """
+    Feature vector of a grayscale image, in HEURISTIC_FEATURES order
+    """
+    height, width = gray.shape
+    mean, std = cv2.meanStdDev(gray)
+    edge_ratio = cv2.countNonZero(cv2.Canny(gray, 50, 150)) / (height * width)
+    return np.array([mean[0, 0], std[0, 0], edge_ratio, width / height], dtype=np.float32)
+
+def heuristic_score(features):
+    """
+    Score a feature vector: one point per typical car characteristic,
+    out of 4.
+    """
+    mean_intensity, std_intensity, edge_ratio, aspect_ratio = features
+    score = 0
+    # Cars typically have moderate contrast
+    if 50 < std_intensity < 150:
+        score += 1
+    # Cars have many edges
+    if edge_ratio > 0.1:
+        score += 1
+    # Cars are usually not too bright or too dark
+    if 50 < mean_intensity < 200:
+        score += 1
+    # Aspect ratio check (cars are typically wider than tall)
+    if 1.2 < aspect_ratio < 3.0:
+        score += 1
+    return score
+
+def heuristic_car_features(image_path, max_size=HEURISTIC_MAX_SIZE):
+    """
+    Structured heuristic result for one image: features, score,
+    is_car and confidence.
+    """
+    with span('classify', 'decode', reduced=True):
+        gray = read_reduced_gray(image_path, max_size)
+    return heuristic_detection(gray)
+
+def heuristic_detection(gray):
+    """
+    Structured heuristic result for an already reduced grayscale image
+    """
+    with span('classify', 'inference', backend='heuristic'):
+        features = extract_heuristic_features(gray)
+        score = heuristic_score(features)
+    is_car = score >= 3
+    return {
+        'features': dict(zip(HEURISTIC_FEATURES, (float(f) for f in features))),
+        'score': score,
+        'is_car': is_car,
+        'confidence': score / 4.0 if is_car else 1 - score / 4.0
+    }
+
+def heuristic_car_features_batch(image_paths, workers=DECODE_WORKERS, max_size=HEURISTIC_MAX_SIZE):
+    """
+    Heuristic features for many images in parallel (OpenCV releases the
+    GIL while decoding). Returns results in input order; unreadable
+    images get {'error': ...} instead.
+    """
+    def features_or_error(image_path):
+        try:
+            return heuristic_car_features(image_path, max_size)
+        except Exception as e:
+            return {'error': f"Error in car detection: {str(e)}"}
+
+    workers = min(workers, worker_threads())
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(features_or_error, image_paths))
+
+def heuristic_classification(image_path):
+    """
+    Structured classification from the heuristic; the score out of 4
+    stands in for the car probability
+    """
+    try:
+        detection = heuristic_car_features(image_path)
+    except Exception as e:
+        raise Exception(f"Error in car detection: {str(e)}")
+    return detection_classification(detection)
+
+def detection_classification(detection):
+    """Structured classification from a heuristic detection"""
+    return classification_result(detection['is_car'], detection['score'] / 4.0,
+                                 detection['confidence'], 'heuristic')
+
 def simple_car_detection(image_path):
     """
-    Simple car detection using OpenCV's built-in cascade classifiers
+    Simple car detection from image statistics on a reduced-resolution decode
     This is a fallback method that doesn't require TensorFlow
     """
+    return heuristic_classification(image_path)['result']
+
+def iter_image_paths(source):
+    """
+    Stream image paths from a folder (walked recursively), a text file
+    with one path per line, or '-' for paths on stdin.
+    """
+    if source == '-':
+        lines = sys.stdin
+    elif os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, name)
+        return
+    else:
+        lines = open(source, 'r', encoding='utf-8')
+    with lines:
+        for line in lines:
+            if line.strip():
+                yield line.strip()
+
+def decode_for_batch(image_path, target_size=MODEL_INPUT_SIZE):
+    """
+    Decode task run on the thread pool; errors are returned, not raised,
+    so one bad file does not stop the batch.
+    """
     try:
-        # Read the image
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError("Could not read image file")
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Try to load a car cascade classifier (you'd need to download this)
-        # For now, we'll use a simple heuristic based on image characteristics
-        
-        # Simple heuristic: check image dimensions and color distribution
-        height, width = gray.shape
-        
-        # Calculate some basic features
-        mean_intensity = np.mean(gray)
-        std_intensity = np.std(gray)
-        edge_count = np.sum(cv2.Canny(gray, 50, 150) > 0)
-        edge_ratio = edge_count / (height * width)
-        
-        # Simple scoring based on typical car image characteristics
-        score = 0
-        
-        # Cars typically have moderate contrast
-        if 50 < std_intensity < 150:
-            score += 1
-            
-        # Cars have many edges
-        if edge_ratio > 0.1:
-            score += 1
-            
-        # Cars are usually not too bright or too dark
-        if 50 < mean_intensity < 200:
-            score += 1
-            
-        # Aspect ratio check (cars are typically wider than tall)
-        aspect_ratio = width / height
-        if 1.2 < aspect_ratio < 3.0:
-            score += 1
-            
-        # Simple threshold
-        is_car = score >= 3
-        confidence = score / 4.0
-        
-        if is_car:
-            return f"This is a car (confidence: {confidence:.2f})"
-        else:
-            return f"This is not a car (confidence: {1-confidence:.2f})"
-            
+        return load_model_input(image_path, target_size), None
     except Exception as e:
-        raise Exception(f"Error in car detection: {str(e)}")
+        return None, f"Error preprocessing image: {str(e)}"
+
+def iter_decoded(paths, executor, window):
+    """
+    Yield (path, array, error) in input order while at most `window`
+    decodes are in flight, so memory stays bounded for any input size.
+    """
+    in_flight = deque()
+    for path in paths:
+        in_flight.append((path, executor.submit(decode_for_batch, path)))
+        if len(in_flight) >= window:
+            path, future = in_flight.popleft()
+            yield (path,) + future.result()
+    while in_flight:
+        path, future = in_flight.popleft()
+        yield (path,) + future.result()
+
+def classify_batches(paths, model, batch_size=BATCH_SIZE, workers=DECODE_WORKERS):
+    """
+    Classify a stream of image paths, yielding one result dict per path
+    in input order: {"path", "result"} or {"path", "error"}.
+
+    Images are decoded on a thread pool and fed to the model in fixed-size
+    batches; the last batch is zero-padded so the model never sees a new
+    input shape. Without a model each image goes through simple detection.
+    """
+    workers = min(workers, worker_threads())
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if model is None:
+            def detect(path):
+                try:
+                    return {'path': path, 'result': simple_car_detection(path)}
+                except Exception as e:
+                    return {'path': path, 'error': f"Error: {str(e)}"}
+            # map() would queue every path up front; keep a bounded window instead
+            in_flight = deque()
+            for path in paths:
+                in_flight.append(executor.submit(detect, path))
+                if len(in_flight) >= 2 * workers:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+            return
+
+        batch = np.zeros((batch_size,) + MODEL_INPUT_SIZE[::-1] + (3,), dtype=np.float32)
+        batch_paths = []
+        pending = []
+
+        def flush():
+            # Results for this batch, including decode errors, in input order
+            predictions = []
+            if batch_paths:
+                with span('classify', 'inference', backend=getattr(model, 'backend', None), batch=len(batch_paths)):
+                    predictions = model.predict(batch, batch_size=batch_size, verbose=0)
+            slots = iter(range(len(batch_paths)))
+            for path, error in pending:
+                if error:
+                    yield {'path': path, 'error': error}
+                else:
+                    prediction = np.asarray(predictions[next(slots)]).reshape(-1)
+                    yield {'path': path, 'result': format_prediction(prediction)}
+            batch_paths.clear()
+            pending.clear()
+
+        for path, image, error in iter_decoded(paths, executor, 2 * batch_size):
+            if error is None:
+                batch[len(batch_paths)] = image
+                batch_paths.append(path)
+            pending.append((path, error))
+            if len(batch_paths) == batch_size:
+                yield from flush()
+        if pending:
+            batch[len(batch_paths):] = 0
+            yield from flush()
+
+def run_batch(source, output_path=None, batch_size=BATCH_SIZE, workers=DECODE_WORKERS, backend=None, model_path=None):
+    """
+    Batch CLI: classify every image from `source` and write JSON lines.
+    """
+    classifier = load_classifier_backend(backend, model_path)
+    if hasattr(classifier, 'model'):
+        results = classify_batches(iter_image_paths(source), classifier.model, batch_size, workers)
+    else:
+        results = classify_files(iter_image_paths(source), classifier)
+    out = open(output_path, 'w', encoding='utf-8') if output_path else sys.stdout
+    count = 0
+    try:
+        for result in results:
+            out.write(json.dumps(result) + '\n')
+            count += 1
+        out.flush()
+    finally:
+        if output_path:
+            out.close()
+    print(f"Classified {count} images", file=sys.stderr)
+
+def classify_files(paths, classifier):
+    """classify_batches' output for a backend without a batchable model (e.g. the stub)."""
+    for path in paths:
+        try:
+            yield {'path': path, 'result': classifier.classify_file(path)['result']}
+        except Exception as e:
+            yield {'path': path, 'error': f"Error: {str(e)}"}
+
+def load_classifier_backend(backend=None, model_path=None):
+    """
+    The configured classifier from inference_backends (CLASSIFIER_BACKEND).
+    The default, 'auto', is the model load_model_or_fallback picks;
+    backend and model_path choose its model file.
+    """
+    name = configured_backend('classifier')
+    if name in ('auto', 'heuristic'):
+        return create_backend('classifier', name, backend=backend, model_path=model_path)
+    return create_backend('classifier', name)
+
+def load_model_or_fallback(backend=None, model_path=None):
+    """
+    Load the classifier model, or return None to use simple detection.
+    """
+    try:
+        print("Loading car classifier model...", file=sys.stderr)
+        with span('classify', 'model_load'):
+            model = load_car_classifier_model(backend, model_path)
+        print(f"Model loaded successfully ({model.backend} backend)", file=sys.stderr)
+        return model
+    except ImportError as e:
+        print(f"{str(e)}, using simple detection", file=sys.stderr)
+    except Exception as e:
+        print(f"Model loading failed: {str(e)}, falling back to simple detection", file=sys.stderr)
+    return None
+
+def warmup_model(model, target_size=(224, 224)):
+    """
+    Run one dummy prediction so the first real request does not pay for
+    graph tracing and kernel initialisation.
+    """
+    if model is not None:
+        model.predict(np.zeros((1,) + target_size + (3,), dtype=np.float32), verbose=0)
+
+def classify_image_result(image_path, model):
+    """
+    Structured classification of one image with the model, falling back
+    to simple detection.
+    """
+    if not os.path.exists(image_path):
+        raise FileNotFoundError(f"Image file not found: {image_path}")
+    if model is not None:
+        try:
+            return model_classification(image_path, model)
+        except Exception as e:
+            print(f"Model classification failed: {str(e)}, falling back to simple detection", file=sys.stderr)
+    return heuristic_classification(image_path)
+
+def classify_with(image_path, classifier):
+    """
+    Classify a file with a loaded model (None for simple detection) or a
+    classifier backend from load_classifier_backend.
+    """
+    if hasattr(classifier, 'classify_file'):
+        return classifier.classify_file(image_path)
+    return classify_image_result(image_path, classifier)
+
+def classify_decoded_image(image, model):
+    """
+    Structured classification of an already decoded BGR image, falling
+    back to simple detection; used when the caller holds the pixels.
+    """
+    if model is not None:
+        try:
+            with span('classify', 'preprocess'):
+                batch = np.expand_dims(model_input_from_image(image), axis=0)
+            with span('classify', 'inference', backend=getattr(model, 'backend', None)):
+                prediction = np.asarray(model.predict(batch, verbose=0))
+            return prediction_result(prediction.reshape(len(batch), -1)[0], getattr(model, 'backend', None))
+        except Exception as e:
+            print(f"Model classification failed: {str(e)}, falling back to simple detection", file=sys.stderr)
+    with span('classify', 'preprocess', backend='heuristic'):
+        height, width = image.shape[:2]
+        scale = min(1.0, HEURISTIC_MAX_SIZE / max(height, width))
+        if scale < 1.0:
+            image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    return detection_classification(heuristic_detection(gray))
+
+def backend_cache_key(name):
+    """Cache key of a classifier backend that has no model file (e.g. the stub)."""
+    return f"backend:{name}"
+
+def model_cache_key(cache, model):
+    """
+    Cache key of a loaded model or classifier backend, or of the heuristic
+    when there is no model.
+    """
+    if getattr(model, 'stage', None) == 'classifier':
+        if not hasattr(model, 'model'):
+            return backend_cache_key(model.name)
+        model = model.model
+    return HEURISTIC_MODEL_KEY if model is None else cache.model_key(model.backend, model.model_path)
+
+def expected_model_key(cache, backend=None, model_path=None):
+    """
+    Cache key of the model that would be loaded, found without loading
+    it (or importing its framework).
+    """
+    name = configured_backend('classifier')
+    if name == 'heuristic':
+        return HEURISTIC_MODEL_KEY
+    if name != 'auto':
+        return backend_cache_key(name)
+    try:
+        backend, model_path = resolve_backend(backend, model_path)
+        return cache.model_key(backend, model_path)
+    except (OSError, ValueError):
+        return HEURISTIC_MODEL_KEY
+
+def classify_image_cached(image_path, cache, model_key, get_model):
+    """
+    Classify through the result cache. get_model is only called on a
+    miss, so a hit never loads the model. Heuristic fallbacks are stored
+    under the heuristic key, not the model's.
+    """
+    if not os.path.exists(image_path):
+        raise FileNotFoundError(f"Image file not found: {image_path}")
+    image_hash = file_sha256(image_path)
+    cached = cache.get(image_hash, model_key)
+    if cached is not None:
+        return dict(cached, cached=True)
+
+    result = classify_with(image_path, get_model())
+    stored_key = HEURISTIC_MODEL_KEY if result['backend'] == 'heuristic' else model_key
+    cache.put(image_hash, stored_key, result)
+    return dict(result, cached=False)
+
+def handle_request_line(line, model, lock, cache=None, model_key=None):
+    """
+    Answer one JSON-lines request: {"id": ..., "image_path": ...}.
+    Returns the JSON response line.
+    """
+    request_id = None
+    try:
+        request = json.loads(line)
+        request_id = request.get('id')
+        with lock:
+            if cache is not None:
+                classification = classify_image_cached(request['image_path'], cache, model_key, lambda: model)
+            else:
+                classification = classify_with(request['image_path'], model)
+        response = {'id': request_id, 'result': classification['result'], 'classification': classification}
+    except Exception as e:
+        response = {'id': request_id, 'error': f"Error: {str(e)}"}
+    return json.dumps(response)
+
+def run_worker(socket_path=None, backend=None, model_path=None, cache=None):
+    """
+    Resident worker: load and warm the model once, then serve JSON-lines
+    classification requests over stdin/stdout or a Unix socket.
+    """
+    model = load_classifier_backend(backend, model_path)
+    model.warmup()
+    serve_metrics_from_env()
+    lock = threading.Lock()
+    model_key = model_cache_key(cache, model) if cache is not None else None
+    ready = json.dumps({'ready': True, 'model': getattr(model, 'model', model) is not None})
+
+    if socket_path is None:
+        print(ready, flush=True)
+        for line in sys.stdin:
+            if line.strip():
+                print(handle_request_line(line, model, lock, cache, model_key), flush=True)
+        return
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if line.strip():
+                    response = handle_request_line(line.decode('utf-8'), model, lock, cache, model_key)
+                    self.wfile.write((response + '\n').encode('utf-8'))
+                    self.wfile.flush()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    with socketserver.ThreadingUnixStreamServer(socket_path, RequestHandler) as server:
+        server.daemon_threads = True
+        print(ready, flush=True)
+        server.serve_forever()
 
 # Main function
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Classify whether an image contains a car or not.')
-    parser.add_argument('image_path', type=str, help='Path to the image file')
+    parser.add_argument('image_path', type=str, nargs='?', help='Path to the image file')
+    parser.add_argument('--worker', action='store_true',
+                        help='Keep the model loaded and serve JSON-lines requests on stdin')
+    parser.add_argument('--socket', type=str, help='Serve worker requests on this Unix socket instead of stdin')
+    parser.add_argument('--batch', type=str, metavar='SOURCE',
+                        help="Classify a folder, a file of image paths, or '-' for paths on stdin; writes JSON lines")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Images per model call in batch mode')
+    parser.add_argument('--workers', type=int, default=DECODE_WORKERS, help='Decode threads in batch mode')
+    parser.add_argument('--output', type=str, help='Write batch results to this file instead of stdout')
+    parser.add_argument('--backend', choices=BACKENDS,
+                        help='Classifier backend (default: first converted model found, then the Keras model)')
+    parser.add_argument('--model', type=str, help='Model file to load instead of the default for the backend')
+    parser.add_argument('--convert', choices=('onnx', 'tflite'),
+                        help='Convert the Keras model and check parity against it')
+    parser.add_argument('--parity', choices=('onnx', 'tflite'),
+                        help='Check a converted model against the Keras model')
+    parser.add_argument('--features', action='store_true',
+                        help='Print the heuristic features of image_path as JSON')
+    parser.add_argument('--parity-images', type=str,
+                        help='Folder or path list of images to use for the parity check')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the structured result (probability, backend, cached) as JSON')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the result cache')
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_TTL,
+                        help='Seconds a cached result stays valid')
     args = parser.parse_args()
+    configure_worker('classify')
+
+    if args.convert or args.parity:
+        target = args.convert or args.parity
+        keras_path = args.model if args.model and args.model.endswith('.h5') else None
+        converted_path = args.model if args.model and not args.model.endswith('.h5') else None
+        try:
+            if args.convert:
+                converted_path = convert_model(target, keras_path, converted_path)
+            image_paths = list(iter_image_paths(args.parity_images)) if args.parity_images else []
+            report = run_parity_check(target, image_paths, load_model_input, keras_path, converted_path)
+        except Exception as e:
+            print(f"Error: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0 if report['passed'] else 1)
+    if args.worker or args.socket:
+        if args.no_cache:
+            run_worker(args.socket, args.backend, args.model)
+        else:
+            with ClassificationCache(ttl=args.cache_ttl) as cache:
+                run_worker(args.socket, args.backend, args.model, cache)
+        sys.exit(0)
+    if args.batch:
+        run_batch(args.batch, args.output, args.batch_size, args.workers, args.backend, args.model)
+        sys.exit(0)
+    if args.features and args.image_path:
+        print(json.dumps(heuristic_car_features(args.image_path)))
+        sys.exit(0)
+    if not args.image_path:
+        parser.error('image_path is required unless --worker, --socket or --batch is given')
     
     try:
         print(f"Processing image: {args.image_path}", file=sys.stderr)
@@ -153,23 +649,19 @@ if __name__ == "__main__":
         if not os.path.exists(args.image_path):
             raise FileNotFoundError(f"Image file not found: {args.image_path}")
         
-        # Try to use TensorFlow model first
-        try:
-            print("Loading car classifier model...", file=sys.stderr)
-            model = load_car_classifier_model()
-            print("Model loaded successfully, performing classification...", file=sys.stderr)
-            result = classify_car_with_model(args.image_path, model)
-        except ImportError:
-            print("TensorFlow not available, using simple detection", file=sys.stderr)
-            result = simple_car_detection(args.image_path)
-        except Exception as e:
-            print(f"Model loading failed: {str(e)}, falling back to simple detection", file=sys.stderr)
-            result = simple_car_detection(args.image_path)
+        # Try to use the classifier model first; a cache hit skips loading it
+        if args.no_cache:
+            classification = classify_with(args.image_path, load_classifier_backend(args.backend, args.model))
+        else:
+            with ClassificationCache(ttl=args.cache_ttl) as cache:
+                model_key = expected_model_key(cache, args.backend, args.model)
+                classification = classify_image_cached(args.image_path, cache, model_key,
+                                                       lambda: load_classifier_backend(args.backend, args.model))
         
         # Print result (this is captured by the Node.js script)
-        print(result)
+        print(json.dumps(classification) if args.json else classification['result'])
         
     except Exception as e:
         print(f"Error: {str(e)}", file=sys.stderr)
         print(f"Error: {str(e)}")  # Also print to stdout for Node.js
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
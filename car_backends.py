@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import numpy as np
+from thread_budget import worker_threads
+from model_assets import resolve_model_path
+
+# Model files, in the order the automatic backend choice tries them
+KERAS_MODEL_PATH = 'car_classifier_model.h5'
+ONNX_MODEL_PATH = 'car_classifier_model.onnx'
+TFLITE_MODEL_PATH = 'car_classifier_model.tflite'
+BACKENDS = ('onnx', 'tflite', 'keras')
+BACKEND_EXTENSIONS = {'.onnx': 'onnx', '.tflite': 'tflite', '.h5': 'keras', '.keras': 'keras'}
+DEFAULT_MODEL_PATHS = {'onnx': ONNX_MODEL_PATH, 'tflite': TFLITE_MODEL_PATH, 'keras': KERAS_MODEL_PATH}
+# Names in the model manifest; the paths above are the fallback in the project root
+MODEL_NAMES = {'onnx': 'car_classifier_onnx', 'tflite': 'car_classifier_tflite', 'keras': 'car_classifier_keras'}
+# Largest allowed |p_keras - p_converted| over the parity inputs
+PARITY_TOLERANCE = 1e-3
+PARITY_SAMPLES = 32
+
+class KerasClassifier:
+    """The original .h5 model; importing TensorFlow happens only here."""
+    backend = 'keras'
+
+    def __init__(self, model_path):
+        try:
+            from tensorflow.keras.models import load_model
+        except ImportError:
+            raise ImportError("TensorFlow is required to load the .h5 model")
+        self.model_path = model_path
+        self.model = load_model(model_path)
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        return self.model.predict(batch, batch_size=batch_size, verbose=verbose)
+
+class OnnxClassifier:
+    """Converted model on ONNX Runtime's CPU provider."""
+    backend = 'onnx'
+
+    def __init__(self, model_path):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("onnxruntime is required to load the .onnx model")
+        self.model_path = model_path
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = worker_threads()
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+class TFLiteClassifier:
+    """Converted model on the standalone TFLite interpreter."""
+    backend = 'tflite'
+
+    def __init__(self, model_path):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            try:
+                from ai_edge_litert.interpreter import Interpreter
+            except ImportError:
+                raise ImportError("tflite-runtime or ai-edge-litert is required to load the .tflite model")
+        self.model_path = model_path
+        self.interpreter = Interpreter(model_path=model_path, num_threads=worker_threads())
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.input_shape = None
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        # Only re-plan the interpreter when the batch shape changes
+        if self.input_shape != batch.shape:
+            self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+            self.interpreter.allocate_tensors()
+            self.input_shape = batch.shape
+        self.interpreter.set_tensor(self.input_index, batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index).copy()
+
+BACKEND_CLASSES = {'onnx': OnnxClassifier, 'tflite': TFLiteClassifier, 'keras': KerasClassifier}
+
+def default_model_path(backend):
+    return resolve_model_path(MODEL_NAMES[backend], DEFAULT_MODEL_PATHS[backend])
+
+def resolve_backend(backend=None, model_path=None):
+    """
+    Pick (backend, model_path). An explicit backend or model path is used
+    as given; otherwise the first converted model on disk wins, and the
+    Keras model is only used when no converted model exists.
+    """
+    if model_path and not backend:
+        backend = BACKEND_EXTENSIONS.get(os.path.splitext(model_path)[1].lower())
+        if backend is None:
+            raise ValueError(f"Cannot tell the backend of model file: {model_path}")
+    if backend:
+        if backend not in BACKEND_CLASSES:
+            raise ValueError(f"Unknown classifier backend: {backend}")
+        return backend, model_path or default_model_path(backend)
+
+    for candidate in BACKENDS:
+        path = default_model_path(candidate)
+        if os.path.exists(path):
+            if candidate == 'keras':
+                print("No converted model found, loading the Keras model (run `python car.py --convert onnx`)",
+                      file=sys.stderr)
+            return candidate, path
+    raise FileNotFoundError(f"No model file found: {', '.join(DEFAULT_MODEL_PATHS[b] for b in BACKENDS)}")
+
+def load_classifier(backend=None, model_path=None):
+    """
+    Load the classifier for a backend; the returned object has
+    predict(batch, batch_size=None, verbose=0) and a `backend` name.
+    """
+    backend, model_path = resolve_backend(backend, model_path)
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found: {model_path}")
+    return BACKEND_CLASSES[backend](model_path)
+
+def convert_model(target, keras_path=None, output_path=None):
+    """
+    Convert the Keras model to ONNX or TFLite. Needs TensorFlow (and
+    tf2onnx for ONNX); the result is written atomically next to the model.
+    """
+    if target not in ('onnx', 'tflite'):
+        raise ValueError(f"Unknown conversion target: {target}")
+    keras_path = keras_path or default_model_path('keras')
+    output_path = output_path or DEFAULT_MODEL_PATHS[target]
+    keras_model = KerasClassifier(keras_path).model
+    tmp_path = output_path + '.tmp'
+
+    if target == 'tflite':
+        import tensorflow as tf
+        converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+        with open(tmp_path, 'wb') as f:
+            f.write(converter.convert())
+    else:
+        import tensorflow as tf
+        import tf2onnx
+        input_shape = (None,) + tuple(keras_model.input_shape[1:])
+        signature = (tf.TensorSpec(input_shape, tf.float32, name='input'),)
+        tf2onnx.convert.from_keras(keras_model, input_signature=signature, output_path=tmp_path)
+    os.replace(tmp_path, output_path)
+    print(f"Converted {keras_path} to {output_path}", file=sys.stderr)
+    return output_path
+
+def car_probabilities(predictions):
+    """Probability of 'car' for each row of model output."""
+    predictions = np.asarray(predictions, dtype=np.float32).reshape(len(predictions), -1)
+    return predictions[:, 0] if predictions.shape[1] == 1 else predictions[:, 1]
+
+def check_parity(reference, candidate, inputs, tolerance=PARITY_TOLERANCE):
+    """
+    Compare two classifiers on the same inputs. Returns a report with the
+    largest probability difference and how many car/not-car labels differ.
+    """
+    expected = car_probabilities(reference.predict(inputs, batch_size=len(inputs), verbose=0))
+    actual = car_probabilities(candidate.predict(inputs, batch_size=len(inputs), verbose=0))
+    diff = np.abs(expected - actual)
+    return {
+        'samples': int(len(inputs)),
+        'maxAbsDiff': float(diff.max()),
+        'meanAbsDiff': float(diff.mean()),
+        'labelMismatches': int(np.sum((expected > 0.5) != (actual > 0.5))),
+        'tolerance': tolerance,
+        'passed': bool(diff.max() <= tolerance)
+    }
+
+def parity_inputs(image_paths, load_input, samples=PARITY_SAMPLES, input_size=(224, 224)):
+    """
+    Parity inputs: the given images, topped up with seeded random inputs
+    so the check also runs without a labelled set.
+    """
+    arrays = [load_input(path) for path in image_paths[:samples]]
+    rng = np.random.default_rng(0)
+    while len(arrays) < samples:
+        arrays.append(rng.random(input_size[::-1] + (3,), dtype=np.float32))
+    return np.stack(arrays)
+
+def run_parity_check(target, image_paths, load_input, keras_path=None, model_path=None):
+    """CLI entry: print the parity report as JSON and return it."""
+    reference = KerasClassifier(keras_path or default_model_path('keras'))
+    candidate = load_classifier(target, model_path)
+    report = check_parity(reference, candidate, parity_inputs(image_paths, load_input))
+    report['backend'] = candidate.backend
+    print(json.dumps(report))
+    return report
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from blob_store import blob_digest
+
+CACHE_PATH = os.path.join('tmp', 'classification_cache.sqlite3')
+# Results older than this are treated as missing and evicted
+DEFAULT_TTL = 7 * 24 * 3600
+
+# (path, mtime, size) -> SHA-256, so repeated lookups skip re-hashing
+_digest_cache = {}
+
+def file_sha256(path):
+    """
+    SHA-256 of a file's contents, memoized by path, mtime and size.
+    Files in the blob store are named by their digest and never hashed.
+    """
+    digest = blob_digest(path)
+    if digest is not None:
+        return digest
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    digest = _digest_cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        _digest_cache[key] = digest
+    return digest
+
+class ClassificationCache:
+    """
+    SQLite store of classification results keyed by image SHA-256 and
+    model key ("<backend>:<model file SHA-256>"). Model file hashes are
+    memoized in the same database by path, mtime and size so a cold
+    process does not re-hash the model on every run.
+
+    Use as a context manager.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.db = None
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # The worker serves requests from several threads under one lock
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS results (
+                image_sha256 TEXT NOT NULL,
+                model_key TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (image_sha256, model_key)
+            );
+            CREATE INDEX IF NOT EXISTS results_created_at ON results (created_at);
+            CREATE TABLE IF NOT EXISTS model_hashes (
+                path TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                PRIMARY KEY (path, mtime_ns, size)
+            );
+        ''')
+        self.evict_expired()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.close()
+        self.db = None
+        return False
+
+    def model_key(self, backend, model_path):
+        """Cache key part for a model file, hashing it at most once per version."""
+        stat = os.stat(model_path)
+        key = (os.path.abspath(model_path), stat.st_mtime_ns, stat.st_size)
+        row = self.db.execute(
+            'SELECT sha256 FROM model_hashes WHERE path = ? AND mtime_ns = ? AND size = ?', key
+        ).fetchone()
+        if row is None:
+            digest = file_sha256(model_path)
+            with self.db:
+                self.db.execute('DELETE FROM model_hashes WHERE path = ?', (key[0],))
+                self.db.execute('INSERT INTO model_hashes VALUES (?, ?, ?, ?)', key + (digest,))
+        else:
+            digest = row[0]
+        return f"{backend}:{digest}"
+
+    def get(self, image_sha256, model_key):
+        """Cached result dict, or None when missing or expired."""
+        row = self.db.execute(
+            'SELECT result FROM results WHERE image_sha256 = ? AND model_key = ? AND created_at >= ?',
+            (image_sha256, model_key, time.time() - self.ttl)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, image_sha256, model_key, result):
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                (image_sha256, model_key, json.dumps(result), time.time())
+            )
+
+    def evict_expired(self):
+        """Delete results older than the TTL; returns how many were removed."""
+        with self.db:
+            cursor = self.db.execute('DELETE FROM results WHERE created_at < ?', (time.time() - self.ttl,))
+        return cursor.rowcount
@@ -1,35 +1,17 @@
-import os
-import urllib.request
-from pathlib import Path
-
-def download_file(url: str, destination: str):
-    """Download a file from a URL to a destination path"""
-    print(f"Downloading {url} to {destination}...")
-    os.makedirs(os.path.dirname(destination), exist_ok=True)
-    urllib.request.urlretrieve(url, destination)
-    print(f"Downloaded to {destination}")
+import sys
+from model_assets import install, CATALOGUE
 
 def main():
-    # Create models directory if it doesn't exist
-    models_dir = Path("models")
-    models_dir.mkdir(exist_ok=True)
-
-    # SAM model URLs
-    model_urls = {
-        "sam_vit_h": "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth",
-        "sam_vit_l": "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_l_0b3195.pth",
-        "sam_vit_b": "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth"
-    }
-
-    # Download the smallest model (vit_b) by default
-    model_name = "sam_vit_b"
-    model_url = model_urls[model_name]
-    model_path = models_dir / f"{model_name}.pth"
-
-    if not model_path.exists():
-        download_file(model_url, str(model_path))
-    else:
-        print(f"Model already exists at {model_path}")
+    # The SAM model sam_segmentation.py uses, unless another one is named
+    model_name = sys.argv[1] if len(sys.argv) > 1 else "sam_vit_l"
+    if model_name not in CATALOGUE:
+        print(f"Unknown model {model_name} (available: {', '.join(CATALOGUE)})", file=sys.stderr)
+        sys.exit(1)
+    try:
+        install(model_name)
+    except Exception as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+
+# Width in pixels of the base ring sampled around a part
+RING_WIDTH = 8
+# Limit on the LAB std ratio so flat surroundings cannot blow out the reference
+MAX_GAIN = 2.0
+MIN_GAIN = 0.5
+# Minimum number of samples on either side before harmonizing
+MIN_SAMPLES = 50
+# Base pixels darker than this are the cut-out holes of segmented parts
+HOLE_THRESHOLD = 8
+
+def ring_samples(base_img, x, y, mask, ring_width=RING_WIDTH):
+    """
+    LAB pixels of the base in a thin ring just outside a part's mask.
+    x, y is the mask's top-left corner on the base image.
+    Returns an (N, 3) uint8 array.
+    """
+    h, w = mask.shape
+    img_h, img_w = base_img.shape[:2]
+    x0, y0 = max(x - ring_width, 0), max(y - ring_width, 0)
+    x1, y1 = min(x + w + ring_width, img_w), min(y + h + ring_width, img_h)
+    if x0 >= x1 or y0 >= y1:
+        return np.empty((0, 3), dtype=np.uint8)
+
+    # Place the mask in the expanded window and dilate it into a ring
+    window_mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    mx0, my0 = max(x0 - x, 0), max(y0 - y, 0)
+    mx1, my1 = min(x1 - x, w), min(y1 - y, h)
+    window_mask[my0 + y - y0:my1 + y - y0, mx0 + x - x0:mx1 + x - x0] = mask[my0:my1, mx0:mx1]
+    _, window_mask = cv2.threshold(window_mask, 127, 255, cv2.THRESH_BINARY)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * ring_width + 1, 2 * ring_width + 1))
+    ring = cv2.dilate(window_mask, kernel) & ~window_mask
+
+    window = np.ascontiguousarray(base_img[y0:y1, x0:x1, :3])
+    ring &= np.where(window.max(axis=2) > HOLE_THRESHOLD, 255, 0).astype(np.uint8)
+    if not ring.any():
+        return np.empty((0, 3), dtype=np.uint8)
+    return cv2.cvtColor(window, cv2.COLOR_BGR2LAB)[ring > 0]
+
+def mean_std_lut(source, target):
+    """Per-channel LUT moving source LAB mean/std onto target's."""
+    lut = np.empty((256, 3), dtype=np.uint8)
+    values = np.arange(256, dtype=np.float32)
+    for c in range(3):
+        src_mean, src_std = source[:, c].mean(), source[:, c].std()
+        dst_mean, dst_std = target[:, c].mean(), target[:, c].std()
+        gain = dst_std / src_std if src_std > 1e-3 else 1.0
+        gain = min(max(gain, MIN_GAIN), MAX_GAIN)
+        lut[:, c] = np.clip(np.rint((values - src_mean) * gain + dst_mean), 0, 255).astype(np.uint8)
+    return lut
+
+def histogram_lut(source, target):
+    """Per-channel LUT matching source LAB histograms to target's."""
+    lut = np.empty((256, 3), dtype=np.uint8)
+    for c in range(3):
+        src_cdf = np.cumsum(np.bincount(source[:, c], minlength=256)).astype(np.float64)
+        dst_cdf = np.cumsum(np.bincount(target[:, c], minlength=256)).astype(np.float64)
+        src_cdf /= src_cdf[-1]
+        dst_cdf /= dst_cdf[-1]
+        lut[:, c] = np.clip(np.searchsorted(dst_cdf, src_cdf), 0, 255).astype(np.uint8)
+    return lut
+
+def harmonize_patch(ref_rgb, alpha, base_samples, method='meanstd'):
+    """
+    Match a reference patch's colours to the base samples around it.
+    Statistics use the visible part of the patch (alpha > 0.5); the
+    transform is applied to the patch only, through a lookup table.
+    """
+    if len(base_samples) < MIN_SAMPLES:
+        return ref_rgb
+    ref_lab = cv2.cvtColor(ref_rgb, cv2.COLOR_BGR2LAB)
+    ref_samples = ref_lab[alpha > 0.5]
+    if len(ref_samples) < MIN_SAMPLES:
+        return ref_rgb
+
+    if method == 'histogram':
+        lut = histogram_lut(ref_samples, base_samples)
+    elif method == 'meanstd':
+        lut = mean_std_lut(ref_samples, base_samples)
+    else:
+        raise ValueError(f"Unknown harmonization method: {method}")
+
+    harmonized = cv2.LUT(ref_lab, lut.reshape(1, 256, 3))
+    return cv2.cvtColor(harmonized, cv2.COLOR_LAB2BGR)
@@ -0,0 +1,304 @@
+import cv2
+import numpy as np
+import os
+import time
+from instrumentation import span
+
+# Stages with pluggable backends, and the environment variable picking each one
+STAGES = ('classifier', 'detector', 'segmenter')
+BACKEND_ENV_VARS = {
+    'classifier': 'CLASSIFIER_BACKEND',
+    'detector': 'DETECTOR_BACKEND',
+    'segmenter': 'SEGMENTER_BACKEND'
+}
+DEFAULT_BACKENDS = {'classifier': 'auto', 'detector': 'ultralytics', 'segmenter': 'sam'}
+
+# Part classes the stub detector reports, matching the reference folders in public/
+STUB_PART_CLASSES = (
+    'Car hood', 'Front bumper', 'Headlight - -L-', 'Headlight - -R-',
+    'Side mirror - -L-', 'Side mirror - -R-'
+)
+
+_registry = {stage: {} for stage in STAGES}
+
+def register_backend(stage, name):
+    """Class decorator adding a backend to the registry."""
+    if stage not in _registry:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    def register(cls):
+        cls.stage = stage
+        cls.name = name
+        _registry[stage][name] = cls
+        return cls
+    return register
+
+def available_backends(stage):
+    return sorted(_registry[stage])
+
+def configured_backend(stage, config=None):
+    """Backend name for a stage: config entry, then environment, then default."""
+    if config and config.get(stage):
+        return config[stage]
+    return os.environ.get(BACKEND_ENV_VARS[stage], DEFAULT_BACKENDS[stage])
+
+def create_backend(stage, name=None, load=True, **options):
+    """
+    Instantiate (and by default load) a backend by stage and name; the
+    name defaults to the configured one.
+    """
+    name = name or configured_backend(stage)
+    if name not in _registry[stage]:
+        raise ValueError(f"Unknown {stage} backend: {name} (available: {', '.join(available_backends(stage))})")
+    backend = _registry[stage][name](**options)
+    if load:
+        backend.load()
+    return backend
+
+class InferenceBackend:
+    """
+    Interface every stage backend implements.
+
+    load() loads weights once, warmup() runs a throwaway inference,
+    predict_batch(items) returns one output per input item, and
+    metadata() describes the backend for logs and results.
+    """
+    stage = None
+    name = None
+
+    def load(self):
+        return self
+
+    def warmup(self):
+        pass
+
+    def predict_batch(self, items, **options):
+        raise NotImplementedError
+
+    def predict(self, item, **options):
+        return self.predict_batch([item], **options)[0]
+
+    def metadata(self):
+        return {'stage': self.stage, 'backend': self.name}
+
+def stub_delay(delay_ms):
+    if delay_ms:
+        time.sleep(delay_ms / 1000.0)
+
+# Classifier: items are BGR images, outputs are car.py classification dicts;
+# classify_file(path) classifies an image file the way car.py's CLI does
+
+@register_backend('classifier', 'auto')
+class ModelClassifierBackend(InferenceBackend):
+    """car.py's classifier (ONNX, TFLite or Keras), falling back to the heuristic."""
+
+    def __init__(self, backend=None, model_path=None):
+        self.backend = backend
+        self.model_path = model_path
+        self.model = None
+
+    def load(self):
+        from car import load_model_or_fallback
+        self.model = load_model_or_fallback(self.backend, self.model_path)
+        return self
+
+    def warmup(self):
+        from car import warmup_model
+        warmup_model(self.model)
+
+    def classify_file(self, image_path):
+        from car import classify_image_result
+        return classify_image_result(image_path, self.model)
+
+    def predict_batch(self, items):
+        from car import classify_decoded_image, model_input_from_image, prediction_result
+        if self.model is None or len(items) == 1:
+            return [classify_decoded_image(image, self.model) for image in items]
+        batch = np.stack([model_input_from_image(image) for image in items])
+        predictions = np.asarray(self.model.predict(batch, batch_size=len(batch), verbose=0))
+        return [prediction_result(row, self.model.backend) for row in predictions.reshape(len(batch), -1)]
+
+    def metadata(self):
+        return dict(super().metadata(),
+                    model=getattr(self.model, 'backend', 'heuristic'),
+                    modelPath=getattr(self.model, 'model_path', None))
+
+@register_backend('classifier', 'heuristic')
+class HeuristicClassifierBackend(ModelClassifierBackend):
+    """The image-statistics heuristic only; no model file needed."""
+
+    def load(self):
+        self.model = None
+        return self
+
+@register_backend('classifier', 'stub')
+class StubClassifierBackend(InferenceBackend):
+    """Deterministic classifier: car probability from mean brightness."""
+
+    def __init__(self, delay_ms=0):
+        self.delay_ms = delay_ms
+
+    def classify_file(self, image_path):
+        image = cv2.imread(image_path)
+        if image is None:
+            raise FileNotFoundError(f"Image file not found: {image_path}")
+        with span('classify', 'inference', backend=self.name):
+            return self.predict(image)
+
+    def predict_batch(self, items):
+        from car import prediction_result
+        stub_delay(self.delay_ms)
+        results = []
+        for image in items:
+            probability = 1.0 / (1.0 + np.exp(-(float(np.mean(image)) - 64.0) / 32.0))
+            results.append(prediction_result([probability], self.name))
+        return results
+
+# Detector: items are BGR images, outputs are lists of detection dicts;
+# detect(image, annotate) also returns the annotated image the routes save
+
+@register_backend('detector', 'ultralytics')
+class UltralyticsDetectorBackend(InferenceBackend):
+    """YOLOv8 through ultralytics, with yolo_detector.py's pre- and post-processing."""
+
+    def __init__(self, model_path=None):
+        from yolo_detector import detector_model_path
+        self.model_path = model_path or detector_model_path()
+        self.model = None
+
+    def load(self):
+        from yolo_detector import load_yolo_model
+        self.model = load_yolo_model(self.model_path)
+        return self
+
+    def warmup(self):
+        from yolo_detector import warmup_yolo_model
+        warmup_yolo_model(self.model)
+
+    def detect(self, image, annotate=False):
+        """yolo_detector's traced single-image path; annotations are ultralytics' own plot."""
+        from yolo_detector import detect_parts
+        detections, results = detect_parts(self.model, image)
+        annotated = results[0].plot(img=image.copy()) if annotate and len(results) > 0 else None
+        return detections, annotated
+
+    def predict_batch(self, items):
+        from yolo_detector import (preprocess_image, parse_detections, filter_detections,
+                                   CONFIDENCE_THRESHOLD, IOU_THRESHOLD)
+        # One model call for the whole batch
+        results = self.model([preprocess_image(image) for image in items],
+                             conf=CONFIDENCE_THRESHOLD, iou=IOU_THRESHOLD, verbose=False)
+        return [filter_detections(parse_detections(result, self.model.names)) for result in results]
+
+    def metadata(self):
+        names = self.model.names if self.model is not None else {}
+        return dict(super().metadata(), modelPath=self.model_path, classes=names)
+
+@register_backend('detector', 'stub')
+class StubDetectorBackend(InferenceBackend):
+    """Deterministic detector: `parts` boxes on a grid over the image."""
+
+    def __init__(self, parts=len(STUB_PART_CLASSES), delay_ms=0):
+        self.parts = parts
+        self.delay_ms = delay_ms
+
+    def predict_batch(self, items):
+        stub_delay(self.delay_ms)
+        return [self.grid(image.shape) for image in items]
+
+    def detect(self, image, annotate=False):
+        from yolo_detector import draw_detections
+        with span('detect', 'inference', backend=self.name):
+            detections = self.predict(image)
+        return detections, draw_detections(image, detections) if annotate else None
+
+    def grid(self, image_shape):
+        height, width = image_shape[:2]
+        cols = int(np.ceil(np.sqrt(self.parts))) if self.parts else 1
+        rows = int(np.ceil(self.parts / cols)) if self.parts else 1
+        cell_w, cell_h = width / cols, height / rows
+        detections = []
+        for i in range(self.parts):
+            col, row = i % cols, i // cols
+            x1 = col * cell_w + cell_w * 0.1
+            y1 = row * cell_h + cell_h * 0.1
+            x2 = x1 + cell_w * 0.8
+            y2 = y1 + cell_h * 0.8
+            detections.append({
+                'class_name': STUB_PART_CLASSES[i % len(STUB_PART_CLASSES)],
+                'confidence': round(0.95 - 0.01 * i, 2),
+                'bbox': [float(x1), float(y1), float(x2), float(y2)],
+                'center_point': [int((x1 + x2) / 2), int((y1 + y2) / 2)]
+            })
+        return detections
+
+    def metadata(self):
+        return dict(super().metadata(), classes=dict(enumerate(STUB_PART_CLASSES)))
+
+# Segmenter: items are (image, detections), outputs are
+# sam_segmentation.segment_image's (parts, masks, modified_image)
+
+@register_backend('segmenter', 'sam')
+class SamSegmenterBackend(InferenceBackend):
+    """segment_anything's SamPredictor."""
+
+    def __init__(self, checkpoint=None):
+        from sam_segmentation import sam_checkpoint_path
+        self.checkpoint = checkpoint or sam_checkpoint_path()
+        self.predictor = None
+
+    def load(self):
+        from sam_segmentation import load_sam_predictor
+        self.predictor = load_sam_predictor(self.checkpoint)
+        return self
+
+    def warmup(self):
+        from sam_segmentation import warmup_predictor
+        warmup_predictor(self.predictor)
+
+    def predict_batch(self, items, scale=1.0):
+        """scale < 1 segments at a reduced working resolution (see segment_image)."""
+        from sam_segmentation import segment_image, release_device_memory
+        outputs = []
+        for image, detections in items:
+            outputs.append(segment_image(image, detections, self.predictor, scale))
+            release_device_memory()
+        return outputs
+
+    def metadata(self):
+        return dict(super().metadata(), checkpoint=self.checkpoint,
+                    device=str(getattr(getattr(self.predictor, 'model', None), 'device', 'unknown')))
+
+class StubSamPredictor:
+    """Deterministic SAM stand-in: three nested ellipses inside the prompted box."""
+
+    def set_image(self, image):
+        self.shape = image.shape[:2]
+
+    def predict(self, point_coords, point_labels, box, multimask_output):
+        x1, y1, x2, y2 = (int(v) for v in box)
+        center = ((x1 + x2) // 2, (y1 + y2) // 2)
+        masks = []
+        for fraction in (0.6, 0.8, 1.0):
+            mask = np.zeros(self.shape, dtype=np.uint8)
+            axes = (max(1, int((x2 - x1) * fraction / 2)), max(1, int((y2 - y1) * fraction / 2)))
+            cv2.ellipse(mask, center, axes, 0, 0, 360, 1, -1)
+            masks.append(mask > 0)
+        return np.array(masks), np.array([0.7, 0.8, 0.9]), None
+
+@register_backend('segmenter', 'stub')
+class StubSegmenterBackend(SamSegmenterBackend):
+    """Real mask post-processing on top of the stub predictor; no checkpoint."""
+
+    def __init__(self, delay_ms=0):
+        self.checkpoint = None
+        self.delay_ms = delay_ms
+        self.predictor = None
+
+    def load(self):
+        self.predictor = StubSamPredictor()
+        return self
+
+    def predict_batch(self, items, scale=1.0):
+        stub_delay(self.delay_ms)
+        return super().predict_batch(items, scale)
@@ -0,0 +1,157 @@
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Phases every stage reports; stages may add their own (e.g. stitching's composite)
+PHASES = ('decode', 'preprocess', 'model_load', 'inference', 'postprocess', 'encode', 'write')
+
+# Where span JSON lines go: unset = nowhere, '-' = stderr, anything else = file appended to
+SPANS_ENV = 'RCMS_SPANS'
+# Quiet mode drops the per-detection / per-part progress prints
+QUIET_ENV = 'RCMS_QUIET'
+# Resident workers serve /metrics on this port when set
+METRICS_PORT_ENV = 'RCMS_METRICS_PORT'
+
+# Prometheus histogram bucket bounds, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_NAME = 'rcms_stage_phase_duration_seconds'
+
+_lock = threading.Lock()
+# (stage, phase) -> {'count', 'sum', 'buckets'}
+_histograms = {}
+_quiet = os.environ.get(QUIET_ENV, '').lower() in ('1', 'true', 'yes')
+_spans_target = os.environ.get(SPANS_ENV) or None
+_spans_file = None
+
+def set_quiet(quiet=True):
+    global _quiet
+    _quiet = quiet
+
+def is_quiet():
+    return _quiet
+
+def log(*args, **kwargs):
+    """print() for hot-loop progress messages; silent in quiet mode."""
+    if not _quiet:
+        print(*args, **kwargs)
+
+def set_spans_target(target):
+    """Send span lines to '-' (stderr), a file path, or nowhere (None)."""
+    global _spans_target, _spans_file
+    with _lock:
+        if _spans_file is not None:
+            _spans_file.close()
+            _spans_file = None
+        _spans_target = target
+
+def _write_span_line(line):
+    global _spans_file
+    if _spans_target == '-':
+        sys.stderr.write(line + '\n')
+        sys.stderr.flush()
+        return
+    if _spans_file is None:
+        directory = os.path.dirname(_spans_target)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        _spans_file = open(_spans_target, 'a', buffering=1)
+    _spans_file.write(line + '\n')
+
+def record_span(stage, phase, seconds, **fields):
+    """Add one measured span to the histograms and emit it as a JSON line."""
+    with _lock:
+        histogram = _histograms.get((stage, phase))
+        if histogram is None:
+            histogram = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(DURATION_BUCKETS)}
+            _histograms[(stage, phase)] = histogram
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][i] += 1
+        if _spans_target:
+            line = json.dumps(dict(fields, ts=round(time.time(), 6), pid=os.getpid(),
+                                   stage=stage, phase=phase, durationMs=round(seconds * 1000, 3)))
+            _write_span_line(line)
+
+@contextlib.contextmanager
+def span(stage, phase, **fields):
+    """Time the enclosed block as one (stage, phase) span."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, phase, time.perf_counter() - started, **fields)
+
+def timed(stage, phase):
+    """Decorator form of span() for whole functions."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage, phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def snapshot():
+    """Copy of the histograms: {(stage, phase): {'count', 'sum', 'buckets'}}."""
+    with _lock:
+        return {key: dict(value, buckets=list(value['buckets'])) for key, value in _histograms.items()}
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+def prometheus_text():
+    """The histograms in the Prometheus text exposition format."""
+    lines = [
+        f"# HELP {METRIC_NAME} Time spent per stage and phase.",
+        f"# TYPE {METRIC_NAME} histogram"
+    ]
+    for (stage, phase), histogram in sorted(snapshot().items()):
+        labels = f'stage="{stage}",phase="{phase}"'
+        # Buckets are recorded per bound already, so they are cumulative
+        for bound, count in zip(DURATION_BUCKETS, histogram['buckets']):
+            lines.append(f'{METRIC_NAME}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{METRIC_NAME}_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{METRIC_NAME}_sum{{{labels}}} {histogram["sum"]:.6f}')
+        lines.append(f'{METRIC_NAME}_count{{{labels}}} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_metrics(port, host='127.0.0.1'):
+    """
+    Serve /metrics from a daemon thread; returns the server (port 0 picks
+    a free port, see server.server_address).
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics", file=sys.stderr)
+    return server
+
+def serve_metrics_from_env(offset=0):
+    """Start the metrics server when RCMS_METRICS_PORT is set; offset spreads worker processes."""
+    port = os.environ.get(METRICS_PORT_ENV)
+    if not port:
+        return None
+    return serve_metrics(int(port) + offset)
@@ -0,0 +1,466 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import sys
+import time
+from instrumentation import span, serve_metrics_from_env
+from process_status import pid_alive
+from thread_budget import configure_worker, plan_threads, affinity_enabled, demand_weights
+
+QUEUE_PATH = os.path.join('tmp', 'job_queue.sqlite3')
+
+# Jobs of a stage that may run at once, whatever the number of workers
+STAGE_LIMITS = {'classify': 4, 'detect': 2, 'segment': 1, 'stitch': 2, 'pipeline': 1}
+# Worker processes started per stage by `serve` unless overridden. A pipeline
+# worker loads its own YOLO and SAM at startup, so it is opt-in (--workers)
+DEFAULT_WORKERS = {'classify': 1, 'detect': 1, 'segment': 1, 'stitch': 2}
+# Queued + running jobs a stage accepts before enqueue reports "queue full"
+MAX_PENDING = {'classify': 200, 'detect': 50, 'segment': 20, 'stitch': 50, 'pipeline': 20}
+DEFAULT_MAX_PENDING = 50
+MAX_ATTEMPTS = 3
+# Seconds before the first retry; doubles with every further attempt
+RETRY_BACKOFF = 2.0
+POLL_INTERVAL = 0.2
+# Stages with jobs in this many recent seconds get their full share of the cores
+DEMAND_WINDOW = 7 * 86400
+# Seconds between sweeps of idle shared decoded images while serving
+SHARED_IMAGE_SWEEP_INTERVAL = 30
+# Exit code of `enqueue` when the queue is full (EX_TEMPFAIL)
+QUEUE_FULL_EXIT_CODE = 75
+
+class QueueFullError(Exception):
+    """Raised by enqueue when a stage already has MAX_PENDING jobs waiting."""
+
+class JobQueue:
+    """
+    Local job queue in SQLite, shared by the Node.js routes (through the
+    CLI) and the worker processes. Jobs are claimed by highest priority
+    first, then oldest, and never beyond a stage's concurrency limit.
+
+    Use as a context manager.
+    """
+
+    def __init__(self, path=QUEUE_PATH, stage_limits=None, max_pending=None):
+        self.path = path
+        self.stage_limits = dict(STAGE_LIMITS, **(stage_limits or {}))
+        self.max_pending = dict(MAX_PENDING, **(max_pending or {}))
+        self.db = None
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Autocommit; claims take the write lock explicitly with BEGIN IMMEDIATE
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                stage TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                result TEXT,
+                error TEXT,
+                worker_pid INTEGER,
+                created_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (stage, status, priority DESC, id);
+        ''')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.close()
+        self.db = None
+        return False
+
+    def _transaction(self):
+        self.db.execute('BEGIN IMMEDIATE')
+
+    def enqueue(self, stage, payload, priority=0, max_attempts=MAX_ATTEMPTS):
+        """Add a job and return its id; raises QueueFullError for backpressure."""
+        if stage not in self.stage_limits:
+            raise ValueError(f"Unknown stage: {stage}")
+        now = time.time()
+        self._transaction()
+        try:
+            pending = self.db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE stage = ? AND status IN ('queued', 'running')", (stage,)
+            ).fetchone()[0]
+            if pending >= self.max_pending.get(stage, DEFAULT_MAX_PENDING):
+                raise QueueFullError(f"Queue full for stage {stage}: {pending} jobs pending")
+            cursor = self.db.execute(
+                'INSERT INTO jobs (stage, payload, priority, max_attempts, created_at, available_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (stage, json.dumps(payload), priority, max_attempts, now, now)
+            )
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        return cursor.lastrowid
+
+    def claim(self, stage, worker_pid=None):
+        """
+        Take the next runnable job of a stage, or None when there is none
+        or the stage is at its concurrency limit.
+        Returns (job_id, payload, attempt).
+        """
+        now = time.time()
+        self._transaction()
+        try:
+            running = self.db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE stage = ? AND status = 'running'", (stage,)
+            ).fetchone()[0]
+            row = None
+            if running < self.stage_limits.get(stage, 1):
+                row = self.db.execute(
+                    "SELECT id, payload, attempts FROM jobs WHERE stage = ? AND status = 'queued' "
+                    "AND available_at <= ? ORDER BY priority DESC, id LIMIT 1", (stage, now)
+                ).fetchone()
+            if row is not None:
+                self.db.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, worker_pid = ? "
+                    "WHERE id = ?", (now, worker_pid or os.getpid(), row[0])
+                )
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def complete(self, job_id, result):
+        self.db.execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = ? WHERE id = ?",
+            (json.dumps(result), time.time(), job_id)
+        )
+
+    def fail(self, job_id, error):
+        """Record a failed attempt: requeue with backoff, or fail for good."""
+        now = time.time()
+        attempts, max_attempts = self.db.execute(
+            'SELECT attempts, max_attempts FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if attempts < max_attempts:
+            self.db.execute(
+                "UPDATE jobs SET status = 'queued', error = ?, available_at = ?, worker_pid = NULL WHERE id = ?",
+                (error, now + RETRY_BACKOFF * 2 ** (attempts - 1), job_id)
+            )
+            return 'queued'
+        self.db.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?", (error, now, job_id)
+        )
+        return 'failed'
+
+    def requeue_stale(self):
+        """Return jobs whose worker process died to the queue; returns how many."""
+        rows = self.db.execute("SELECT id, worker_pid FROM jobs WHERE status = 'running'").fetchall()
+        stale = [job_id for job_id, pid in rows if pid is None or not pid_alive(pid)]
+        for job_id in stale:
+            self.fail(job_id, 'Worker exited while running the job')
+        return len(stale)
+
+    def get(self, job_id):
+        row = self.db.execute(
+            'SELECT id, stage, status, priority, attempts, result, error, created_at, finished_at '
+            'FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'stage': row[1],
+            'status': row[2],
+            'priority': row[3],
+            'attempts': row[4],
+            'result': json.loads(row[5]) if row[5] else None,
+            'error': row[6],
+            'createdAt': row[7],
+            'finishedAt': row[8]
+        }
+
+    def wait(self, job_id, timeout=None, poll_interval=POLL_INTERVAL):
+        """Poll until a job is done or failed; returns the job, or None on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in ('done', 'failed'):
+                return job
+            if deadline is not None and time.time() >= deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def active_stages(self, since):
+        """Stages that had jobs enqueued since the given time."""
+        return {stage for (stage,) in self.db.execute('SELECT DISTINCT stage FROM jobs WHERE created_at >= ?',
+                                                      (since,))}
+
+    def stats(self):
+        """Job counts per stage and status."""
+        stats = {}
+        for stage, status, count in self.db.execute(
+                'SELECT stage, status, COUNT(*) FROM jobs GROUP BY stage, status'):
+            stats.setdefault(stage, {})[status] = count
+        return stats
+
+def resident(models, key, loader):
+    """Load a model on a worker's first job and keep it for the next ones."""
+    if key not in models:
+        models[key] = loader()
+    return models[key]
+
+def load_classify_model():
+    from car import load_classifier_backend
+    classifier = load_classifier_backend()
+    classifier.warmup()
+    return classifier
+
+def load_backend(stage):
+    """The stage's configured inference backend (*_BACKEND), loaded and warmed up."""
+    from inference_backends import create_backend
+    backend = create_backend(stage)
+    backend.warmup()
+    return backend
+
+def load_detect_model():
+    return load_backend('detector')
+
+def load_segment_model():
+    return load_backend('segmenter')
+
+def load_pipeline_models():
+    from pipeline import load_models
+    return load_models()
+
+# Resident model of each stage: its key in the worker's models dict and its (warming) loader
+STAGE_MODELS = {
+    'classify': ('classifier', load_classify_model),
+    'detect': ('detector', load_detect_model),
+    'segment': ('segmenter', load_segment_model),
+    'pipeline': ('pipeline', load_pipeline_models)
+}
+
+def preload(stage, models):
+    """Load and warm up a stage's model before the worker takes its first job."""
+    if stage in STAGE_MODELS:
+        resident(models, *STAGE_MODELS[stage])
+
+def handle_classify(payload, models):
+    return resident(models, *STAGE_MODELS['classify']).classify_file(payload['image_path'])
+
+def handle_detect(payload, models):
+    import cv2
+    from shared_images import open_image
+    from yolo_detector import detection_output
+    detector = resident(models, *STAGE_MODELS['detect'])
+    with open_image(payload['image_path']) as shared:
+        image = shared.array
+        if image is None:
+            raise ValueError("Failed to load input image")
+        filtered_parts, annotated = detector.detect(image, annotate=bool(payload.get('output_path')))
+        output_data = detection_output(filtered_parts, image, detector.metadata()['classes'])
+        if payload.get('json_output_path'):
+            with open(payload['json_output_path'], 'w') as f:
+                json.dump(output_data, f, indent=2)
+        if payload.get('output_path') and annotated is not None:
+            cv2.imwrite(payload['output_path'], annotated)
+    return output_data
+
+def handle_segment(payload, models):
+    from sam_segmentation import run_sam_inputs
+    return run_sam_inputs(payload, resident(models, *STAGE_MODELS['segment']))
+
+def handle_stitch(payload, models):
+    from stitching import run_stitch
+    return run_stitch(payload)
+
+def handle_pipeline(payload, models):
+    from pipeline import run_job
+    return run_job(payload, resident(models, *STAGE_MODELS['pipeline']))
+
+STAGE_HANDLERS = {
+    'classify': handle_classify,
+    'detect': handle_detect,
+    'segment': handle_segment,
+    'stitch': handle_stitch,
+    'pipeline': handle_pipeline
+}
+
+def run_worker(stage, queue_path=QUEUE_PATH, handlers=None, max_jobs=None, stop_event=None, metrics_offset=None,
+               threads=None, cpus=None):
+    """
+    Worker process loop for one stage: claim, run, record, repeat.
+    Models stay loaded between jobs. Returns after max_jobs jobs, or when
+    stop_event is set. With metrics_offset and RCMS_METRICS_PORT set, the
+    worker serves /metrics on the port plus the offset. threads and cpus
+    are its share of the node (see thread_budget.plan_threads). With the
+    default handlers the stage's model is loaded and warmed up before the
+    worker reports ready.
+    """
+    if metrics_offset is not None:
+        serve_metrics_from_env(metrics_offset)
+    if threads is not None or cpus is not None:
+        configure_worker(stage, threads, cpus)
+    models = {}
+    if handlers is None:
+        try:
+            preload(stage, models)
+        except Exception as e:
+            # Jobs retry the load and fail (and are retried) as before
+            print(f"[{stage}:{os.getpid()}] Model preload failed: {str(e)}", file=sys.stderr)
+    handlers = handlers or STAGE_HANDLERS
+    handler = handlers[stage]
+    print(f"[{stage}:{os.getpid()}] Ready", file=sys.stderr)
+    done = 0
+    with JobQueue(queue_path) as queue:
+        while stop_event is None or not stop_event.is_set():
+            claimed = queue.claim(stage)
+            if claimed is None:
+                if max_jobs is not None:
+                    return done
+                time.sleep(POLL_INTERVAL)
+                continue
+            job_id, payload, attempt = claimed
+            print(f"[{stage}:{os.getpid()}] Job {job_id} attempt {attempt}", file=sys.stderr)
+            try:
+                with span(stage, 'job'):
+                    output = handler(payload, models)
+                queue.complete(job_id, output)
+            except Exception as e:
+                status = queue.fail(job_id, f"{type(e).__name__}: {str(e)}")
+                print(f"[{stage}:{os.getpid()}] Job {job_id} failed ({status}): {str(e)}", file=sys.stderr)
+            done += 1
+            if max_jobs is not None and done >= max_jobs:
+                return done
+    return done
+
+def serve(workers, queue_path=QUEUE_PATH):
+    """
+    Start N worker processes per stage and supervise them: restart
+    workers that exit and requeue the jobs they held, until SIGTERM/SIGINT.
+    The node's cores are split between the workers so they do not
+    oversubscribe the CPU, weighted towards the stages that have had jobs
+    lately; RCMS_CPU_AFFINITY=1 also pins each to its cores.
+    """
+    stop_event = multiprocessing.Event()
+    with JobQueue(queue_path) as queue:
+        active = queue.active_stages(time.time() - DEMAND_WINDOW)
+    slots = plan_threads(workers, weights=demand_weights(workers, active))
+    pin = affinity_enabled()
+
+    def start(stage, index):
+        # Each worker keeps its slot's metrics port and cores across restarts
+        slot = slots[index]
+        process = multiprocessing.Process(target=run_worker, args=(stage, queue_path),
+                                          kwargs={'stop_event': stop_event, 'metrics_offset': index,
+                                                  'threads': slot['threads'],
+                                                  'cpus': slot['cpus'] if pin else None},
+                                          daemon=True)
+        process.start()
+        return process
+
+    stages = [stage for stage, count in workers.items() for _ in range(count)]
+    pool = [(stage, start(stage, i)) for i, stage in enumerate(stages)]
+    print(f"Started {len(pool)} workers: {json.dumps(workers)}, threads: "
+          f"{json.dumps([slot['threads'] for slot in slots])}", file=sys.stderr)
+
+    def shutdown(signum, frame):
+        stop_event.set()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    from shared_images import sweep_idle
+    swept_at = time.time()
+    with JobQueue(queue_path) as queue:
+        while not stop_event.is_set():
+            for i, (stage, process) in enumerate(pool):
+                if not process.is_alive():
+                    print(f"Worker {process.pid} for {stage} exited with {process.exitcode}, restarting",
+                          file=sys.stderr)
+                    pool[i] = (stage, start(stage, i))
+            queue.requeue_stale()
+            if time.time() - swept_at >= SHARED_IMAGE_SWEEP_INTERVAL:
+                # An idle node does not keep decoded images in /dev/shm past their TTL
+                sweep_idle()
+                swept_at = time.time()
+            stop_event.wait(1.0)
+
+    for stage, process in pool:
+        process.join(timeout=30)
+
+def parse_workers(spec):
+    """'classify=2,segment=1' -> {'classify': 2, 'segment': 1}"""
+    workers = {}
+    for item in spec.split(','):
+        stage, _, count = item.partition('=')
+        if stage not in STAGE_HANDLERS:
+            raise ValueError(f"Unknown stage: {stage}")
+        workers[stage] = int(count or 1)
+    return workers
+
+def main():
+    parser = argparse.ArgumentParser(description='Local job queue for the Python processing stages.')
+    parser.add_argument('--queue', default=QUEUE_PATH, help='SQLite queue file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help='Queue a job; exits 75 when the queue is full')
+    enqueue.add_argument('stage', choices=sorted(STAGE_HANDLERS))
+    enqueue.add_argument('payload', help="Payload JSON file, or '-' for stdin")
+    enqueue.add_argument('--priority', type=int, default=0, help='Higher runs first')
+    enqueue.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+    enqueue.add_argument('--wait', type=float, metavar='SECONDS', help='Wait for the result up to SECONDS')
+
+    status = commands.add_parser('status', help='Print a job as JSON')
+    status.add_argument('job_id', type=int)
+
+    commands.add_parser('stats', help='Print job counts per stage and status')
+
+    serve_parser = commands.add_parser('serve', help='Run the worker pool')
+    serve_parser.add_argument('--workers', help="Workers per stage, e.g. 'classify=2,segment=1'")
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(parse_workers(args.workers) if args.workers else DEFAULT_WORKERS, args.queue)
+        return
+
+    with JobQueue(args.queue) as queue:
+        if args.command == 'enqueue':
+            if args.payload == '-':
+                payload = json.load(sys.stdin)
+            else:
+                with open(args.payload, 'r') as f:
+                    payload = json.load(f)
+            try:
+                job_id = queue.enqueue(args.stage, payload, args.priority, args.max_attempts)
+            except QueueFullError as e:
+                print(json.dumps({'success': False, 'queueFull': True, 'error': str(e)}))
+                sys.exit(QUEUE_FULL_EXIT_CODE)
+            if args.wait is None:
+                print(json.dumps({'success': True, 'id': job_id}))
+                return
+            job = queue.wait(job_id, args.wait)
+            if job is None:
+                print(json.dumps({'success': False, 'id': job_id, 'error': 'Timed out waiting for job'}))
+                sys.exit(1)
+            print(json.dumps(dict(job, success=job['status'] == 'done')))
+            sys.exit(0 if job['status'] == 'done' else 1)
+        elif args.command == 'status':
+            job = queue.get(args.job_id)
+            print(json.dumps(job))
+            sys.exit(0 if job is not None else 1)
+        else:
+            print(json.dumps(queue.stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import numpy as np
+import hashlib
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+CACHE_ROOT = os.path.join('tmp', 'stitch_cache')
+
+def layer_cache_dir(image_path, variant=''):
+    """
+    Cache directory for one base image. The key covers the file identity
+    and the render variant so a re-segmented base gets a fresh cache.
+    """
+    stat = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}:{stat.st_mtime_ns}:{stat.st_size}:{variant}"
+    return os.path.join(os.getcwd(), CACHE_ROOT, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+def rects_intersect(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+class LayerCache:
+    """
+    Per-session stitching cache: the base image, the current composite and
+    every part's rendered layer (ROI patch + alpha), keyed by part and
+    reference. Arrays are memory-mapped so only touched ROIs are paged in.
+
+    Use as a context manager; the session is locked while it is open.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        self.base_path = os.path.join(cache_dir, 'base.npy')
+        self.composite_path = os.path.join(cache_dir, 'composite.npy')
+        self.manifest = {'scale': 1.0, 'layers': []}
+        self.base = None
+        self.composite = None
+        self._lock_file = None
+
+    def __enter__(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock_file = open(os.path.join(self.cache_dir, 'lock'), 'w')
+        if fcntl is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            if (os.path.exists(self.manifest_path) and os.path.exists(self.base_path)
+                    and os.path.exists(self.composite_path)):
+                with open(self.manifest_path, 'r') as f:
+                    self.manifest = json.load(f)
+                self.base = np.load(self.base_path, mmap_mode='r')
+                self.composite = np.load(self.composite_path, mmap_mode='r+')
+        except Exception as e:
+            print(f"Warning: Discarding unreadable layer cache {self.cache_dir}: {str(e)}")
+            self.manifest = {'scale': 1.0, 'layers': []}
+            self.base = None
+            self.composite = None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.composite is not None:
+            self.composite.flush()
+        self.base = None
+        self.composite = None
+        if fcntl is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+        return False
+
+    @property
+    def scale(self):
+        return self.manifest.get('scale', 1.0)
+
+    def has_base(self):
+        return self.base is not None
+
+    def set_base(self, base_img, scale=1.0):
+        """Start the session from a freshly decoded base image."""
+        np.save(self.base_path, np.ascontiguousarray(base_img))
+        np.save(self.composite_path, np.ascontiguousarray(base_img))
+        self.base = np.load(self.base_path, mmap_mode='r')
+        self.composite = np.load(self.composite_path, mmap_mode='r+')
+        self.manifest = {'scale': scale, 'layers': []}
+        self._save_manifest()
+
+    def _layer_path(self, key):
+        return os.path.join(self.cache_dir, f"layer_{key}.npz")
+
+    def _save_layer(self, key, layer):
+        x, y, ref_rgb, alpha = layer
+        with open(self._layer_path(key), 'wb') as f:
+            np.savez(f, origin=np.array([x, y]), ref_rgb=ref_rgb, alpha=alpha)
+
+    def _load_layer(self, key):
+        with np.load(self._layer_path(key)) as data:
+            x, y = (int(v) for v in data['origin'])
+            return x, y, data['ref_rgb'], data['alpha']
+
+    def _save_manifest(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def update(self, layers, layer_bounds, blend_layer, executor=None):
+        """
+        Bring the composite up to date with the requested layers.
+
+        layers is an ordered list of dicts with 'part', 'key' and 'render'
+        (a callable producing the layer). Only layers whose key changed are
+        rendered, and only their old and new ROIs are re-blended from the
+        base, together with whatever other layers overlap those ROIs.
+        Returns the composite and the number of layers re-rendered.
+        """
+        old_layers = self.manifest['layers']
+        old_by_part = {entry['part']: entry for entry in old_layers}
+        requested_parts = [layer['part'] for layer in layers]
+        kept_order = [entry['part'] for entry in old_layers if entry['part'] in requested_parts]
+
+        def is_cached(layer):
+            old = old_by_part.get(layer['part'])
+            return (old is not None and old['key'] == layer['key']
+                    and os.path.exists(self._layer_path(old['key'])))
+
+        stale = [layer for layer in layers if not is_cached(layer)]
+        if executor is not None:
+            rendered_layers = list(executor.map(lambda layer: layer['render'](), stale))
+        else:
+            rendered_layers = [layer['render']() for layer in stale]
+        rendered_by_part = {layer['part']: part_layer for layer, part_layer in zip(stale, rendered_layers)}
+
+        loaded = {}
+        new_layers = []
+        dirty = []
+        rendered = 0
+        for layer in layers:
+            old = old_by_part.get(layer['part'])
+            if layer['part'] not in rendered_by_part:
+                new_layers.append(old)
+                continue
+            if old is not None:
+                dirty.append(old['roi'])
+            part_layer = rendered_by_part[layer['part']]
+            if part_layer is None:
+                continue
+            rendered += 1
+            self._save_layer(layer['key'], part_layer)
+            loaded[layer['key']] = part_layer
+            roi = list(layer_bounds(part_layer, self.base.shape))
+            new_layers.append({'part': layer['part'], 'key': layer['key'], 'roi': roi})
+            dirty.append(roi)
+
+        for entry in old_layers:
+            if entry['part'] not in requested_parts:
+                dirty.append(entry['roi'])
+
+        if kept_order != [p for p in requested_parts if p in old_by_part]:
+            # Stacking order changed, rebuild every region
+            dirty = [entry['roi'] for entry in old_layers + new_layers]
+
+        for roi in dirty:
+            x0, y0, x1, y1 = roi
+            if x0 >= x1 or y0 >= y1:
+                continue
+            self.composite[y0:y1, x0:x1] = self.base[y0:y1, x0:x1]
+            for entry in new_layers:
+                if rects_intersect(entry['roi'], roi):
+                    if entry['key'] not in loaded:
+                        loaded[entry['key']] = self._load_layer(entry['key'])
+                    blend_layer(self.composite, loaded[entry['key']], roi)
+
+        # Drop layer files that are no longer part of the composite
+        live_keys = {entry['key'] for entry in new_layers}
+        for entry in old_layers:
+            if entry['key'] not in live_keys and os.path.exists(self._layer_path(entry['key'])):
+                os.remove(self._layer_path(entry['key']))
+
+        self.manifest['layers'] = new_layers
+        self._save_manifest()
+        return self.composite, rendered
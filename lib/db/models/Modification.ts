@@ -5,6 +5,7 @@ export interface IModification {
   operator_id: string;
   original_image_url: string;
   modified_image_url: string;
+  thumbnail_image_url?: string;
   description: string;
   modification_details: string;
   status: 'Saved' | 'Pending' | 'Approved';
@@ -20,6 +21,7 @@ const modificationSchema = new Schema<IModification>(
     operator_id: { type: String, required: true },
     original_image_url: { type: String, required: true },
     modified_image_url: { type: String, required: true },
+    thumbnail_image_url: { type: String },
     description: { type: String, required: true },
     modification_details: { type: String, required: true },
     status: { type: String, default: 'Saved', enum: ['Saved', 'Pending', 'Approved'] },
@@ -0,0 +1,38 @@
+// Pins the artifacts a saved modification refers to, so artifact_gc.py never
+// evicts them. Each save appends one JSON line to tmp/artifact_pins.jsonl;
+// the GC applies new lines on its next pass.
+import path from 'path';
+import { promises as fs } from 'fs';
+
+const PIN_JOURNAL_PATH = path.join(process.cwd(), 'tmp', 'artifact_pins.jsonl');
+
+// Every local URL (or absolute URL) found anywhere in the values
+const collectUrls = (value: unknown, urls: string[] = []): string[] => {
+  if (typeof value === 'string') {
+    if (value.startsWith('/') || /^https?:\/\//.test(value)) urls.push(value);
+  } else if (Array.isArray(value)) {
+    value.forEach((item) => collectUrls(item, urls));
+  } else if (value && typeof value === 'object') {
+    Object.values(value).forEach((item) => collectUrls(item, urls));
+  }
+  return urls;
+};
+
+export async function pinArtifacts(values: unknown[], modificationId?: string): Promise<void> {
+  const urls = Array.from(new Set(collectUrls(values)));
+  if (urls.length === 0) return;
+  const line = JSON.stringify({
+    action: 'pin',
+    urls,
+    modification_id: modificationId,
+    pinned_at: new Date().toISOString()
+  });
+  try {
+    await fs.mkdir(path.dirname(PIN_JOURNAL_PATH), { recursive: true });
+    // One write per line keeps concurrent appends from interleaving
+    await fs.appendFile(PIN_JOURNAL_PATH, line + '\n');
+  } catch (error) {
+    // The modification is saved either way; `artifact_gc.py sync-mongo` recovers missed pins
+    console.error('Failed to record artifact pins:', error);
+  }
+}
@@ -0,0 +1,83 @@
+// Content-addressed upload store, same layout as blob_store.py: each distinct
+// upload is written once to uploads/blobs/<aa>/<bb>/<sha256>.<ext> and exposed
+// at /blobs/<aa>/<bb>/<sha256>.<ext> through a hardlink under public/blobs.
+// The URL is derived from the bytes, so it is stable and cacheable forever.
+import crypto from 'crypto';
+import path from 'path';
+import { constants as fsConstants, promises as fs } from 'fs';
+
+const BLOB_ROOT = path.join(process.cwd(), 'uploads', 'blobs');
+const PUBLIC_BLOB_ROOT = path.join(process.cwd(), 'public', 'blobs');
+const BLOB_URL_ROOT = '/blobs';
+
+export type StoredBlob = {
+  sha256: string;
+  extension: string;
+  size: number;
+  path: string; // absolute path of the stored blob, for the Python stages
+  url: string; // public, immutable URL
+  deduplicated: boolean;
+};
+
+const sniffExtension = (buffer: Buffer): string => {
+  if (buffer.subarray(0, 3).equals(Buffer.from([0xff, 0xd8, 0xff]))) return 'jpg';
+  if (buffer.subarray(0, 8).equals(Buffer.from([0x89, 0x50, 0x4e, 0x47, 0x0d, 0x0a, 0x1a, 0x0a]))) return 'png';
+  if (buffer.toString('latin1', 0, 4) === 'RIFF' && buffer.toString('latin1', 8, 12) === 'WEBP') return 'webp';
+  if (['GIF87a', 'GIF89a'].includes(buffer.toString('latin1', 0, 6))) return 'gif';
+  return 'bin';
+};
+
+const blobPath = (root: string, sha256: string, extension: string) =>
+  path.join(root, sha256.slice(0, 2), sha256.slice(2, 4), `${sha256}.${extension}`);
+
+const exists = (filePath: string) => fs.access(filePath).then(() => true, () => false);
+
+// Hardlink, falling back to a copy-on-write clone or a plain copy
+const cloneFile = async (source: string, destination: string) => {
+  try {
+    await fs.link(source, destination);
+  } catch (error) {
+    if ((error as NodeJS.ErrnoException).code === 'EEXIST') return;
+    await fs.copyFile(source, destination, fsConstants.COPYFILE_FICLONE | fsConstants.COPYFILE_EXCL)
+      .catch((copyError: NodeJS.ErrnoException) => {
+        if (copyError.code !== 'EEXIST') throw copyError;
+      });
+  }
+};
+
+export const storeBlob = async (buffer: Buffer): Promise<StoredBlob> => {
+  const sha256 = crypto.createHash('sha256').update(buffer).digest('hex');
+  const extension = sniffExtension(buffer);
+  const destination = blobPath(BLOB_ROOT, sha256, extension);
+
+  let created = false;
+  if (!(await exists(destination))) {
+    await fs.mkdir(path.dirname(destination), { recursive: true });
+    // Write under a temporary name so readers never see a partial blob
+    const staging = path.join(path.dirname(destination), `.incoming-${process.pid}-${crypto.randomUUID()}`);
+    await fs.writeFile(staging, buffer, { mode: 0o444 });
+    try {
+      await fs.link(staging, destination);
+      created = true;
+    } catch (error) {
+      if ((error as NodeJS.ErrnoException).code !== 'EEXIST') throw error;
+    } finally {
+      await fs.unlink(staging).catch(() => {});
+    }
+  }
+
+  const publicPath = blobPath(PUBLIC_BLOB_ROOT, sha256, extension);
+  if (!(await exists(publicPath))) {
+    await fs.mkdir(path.dirname(publicPath), { recursive: true });
+    await cloneFile(destination, publicPath);
+  }
+
+  return {
+    sha256,
+    extension,
+    size: buffer.length,
+    path: destination,
+    url: `${BLOB_URL_ROOT}/${sha256.slice(0, 2)}/${sha256.slice(2, 4)}/${sha256}.${extension}`,
+    deduplicated: !created,
+  };
+};
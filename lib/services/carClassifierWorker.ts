@@ -0,0 +1,146 @@
+// Server-side client for the resident car classifier (`python car.py --worker`).
+// The worker loads and warms the model once and answers JSON-lines requests,
+// so a classification no longer pays for a Python start and a model load.
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+import path from 'path';
+import readline from 'readline';
+
+// Use 'python' instead of 'python3' for Windows compatibility
+const PYTHON_EXECUTABLE = process.platform === 'win32' ? 'python' : 'python3';
+// A worker that has not loaded its model by then is killed; the next request starts another
+const STARTUP_TIMEOUT_MS = 120000;
+
+type PendingRequest = {
+  resolve: (result: string) => void;
+  reject: (error: Error) => void;
+  timer: NodeJS.Timeout;
+};
+
+type WorkerState = {
+  process: ChildProcessWithoutNullStreams;
+  ready: Promise<void>;
+  pending: Map<number, PendingRequest>;
+  nextId: number;
+  // Fails every pending request with error and kills the process
+  stop: (error: Error) => void;
+};
+
+// Kept on globalThis so dev-mode module reloads reuse the running worker
+const globalForWorker = globalThis as unknown as { carClassifierWorker?: WorkerState | null };
+
+const startWorker = (): WorkerState => {
+  const scriptPath = path.join(process.cwd(), 'car.py');
+  const child = spawn(PYTHON_EXECUTABLE, [scriptPath, '--worker'], { cwd: process.cwd() });
+  const pending = new Map<number, PendingRequest>();
+
+  let markReady: () => void = () => {};
+  let markFailed: (error: Error) => void = () => {};
+  const ready = new Promise<void>((resolve, reject) => {
+    markReady = resolve;
+    markFailed = reject;
+  });
+  // Failures are reported to each caller; avoid an unhandled rejection
+  ready.catch(() => {});
+  const startupTimer = setTimeout(() => {
+    stop(new Error(`Car classifier worker did not start within ${STARTUP_TIMEOUT_MS} ms`));
+  }, STARTUP_TIMEOUT_MS);
+
+  const lines = readline.createInterface({ input: child.stdout });
+  lines.on('line', (line) => {
+    let message: { ready?: boolean; id?: number; result?: string; error?: string };
+    try {
+      message = JSON.parse(line);
+    } catch {
+      console.log('Car classifier worker output:', line);
+      return;
+    }
+    if (message.ready) {
+      clearTimeout(startupTimer);
+      markReady();
+      return;
+    }
+    const request = message.id !== undefined ? pending.get(message.id) : undefined;
+    if (!request) return;
+    pending.delete(message.id as number);
+    clearTimeout(request.timer);
+    if (message.error) {
+      request.reject(new Error(message.error));
+    } else {
+      request.resolve(message.result ?? '');
+    }
+  });
+
+  child.stderr.on('data', (data: Buffer) => {
+    console.log('Car classifier worker:', data.toString().trim());
+  });
+
+  const fail = (error: Error) => {
+    clearTimeout(startupTimer);
+    markFailed(error);
+    pending.forEach((request) => {
+      clearTimeout(request.timer);
+      request.reject(error);
+    });
+    pending.clear();
+    if (globalForWorker.carClassifierWorker?.process === child) {
+      globalForWorker.carClassifierWorker = null;
+    }
+  };
+  const stop = (error: Error) => {
+    fail(error);
+    if (child.exitCode === null && child.signalCode === null) {
+      child.kill();
+    }
+  };
+  child.on('error', fail);
+  child.on('exit', (code, signal) => fail(new Error(`Car classifier worker exited with ${signal ?? `code ${code}`}`)));
+  // Writing to a worker that just died; the exit handler fails the requests
+  child.stdin.on('error', (error) => console.error('Car classifier worker stdin:', error.message));
+
+  return { process: child, ready, pending, nextId: 1, stop };
+};
+
+const getWorker = (): WorkerState => {
+  if (!globalForWorker.carClassifierWorker) {
+    globalForWorker.carClassifierWorker = startWorker();
+  }
+  return globalForWorker.carClassifierWorker;
+};
+
+export class ClassificationTimeoutError extends Error {}
+
+export const classifyCarImage = (imagePath: string, timeoutMs = 30000): Promise<string> => {
+  const worker = getWorker();
+  const id = worker.nextId++;
+
+  return new Promise<string>((resolve, reject) => {
+    // The timeout also covers the model load on a cold worker
+    let timedOut = false;
+    let sent = false;
+    const timer = setTimeout(() => {
+      timedOut = true;
+      worker.pending.delete(id);
+      reject(new ClassificationTimeoutError('Classification timed out'));
+      if (sent) {
+        // The worker is stuck on this request and answers in order, so every
+        // later request would wait behind it: replace it, and start loading
+        // the new one's model right away
+        worker.stop(new Error('Car classifier worker was restarted after a timed-out request'));
+        getWorker();
+      }
+    }, timeoutMs);
+
+    worker.ready.then(
+      () => {
+        if (timedOut) return;
+        worker.pending.set(id, { resolve, reject, timer });
+        sent = true;
+        worker.process.stdin.write(JSON.stringify({ id, image_path: imagePath }) + '\n');
+      },
+      (error: Error) => {
+        clearTimeout(timer);
+        reject(error);
+      }
+    );
+  });
+};
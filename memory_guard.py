@@ -0,0 +1,275 @@
+import math
+import os
+import resource
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+
+# Memory budget for one job in MB; unset = 75% of the memory this process may use
+MEMORY_BUDGET_ENV = 'RCMS_MEMORY_BUDGET_MB'
+MEMORY_BUDGET_FRACTION = 0.75
+# RCMS_MEMORY_TRACKING=0 turns off tracemalloc and RSS sampling
+MEMORY_TRACKING_ENV = 'RCMS_MEMORY_TRACKING'
+RSS_SAMPLE_INTERVAL = 0.05
+TOP_ALLOCATIONS = 5
+# Take a tracemalloc snapshot whenever traced memory grows this much past the last one
+SNAPSHOT_GROWTH = 1.1
+MIN_SNAPSHOT_BYTES = 1024 * 1024
+
+# Working-set estimates, in bytes per image pixel. Model weights and
+# activations do not scale with the image and are in the baseline RSS.
+# Segmentation: RGB copy, combined mask, SAM's 3 candidate masks, the
+# modified image and the per-part cut-out being written
+SEGMENT_BYTES_PER_PIXEL = 16
+# ...plus one full-frame boolean mask kept per part
+SEGMENT_BYTES_PER_PART_PIXEL = 1
+# Stitching: base and the composite copy
+STITCH_BYTES_PER_PIXEL = 6
+# Rendered layers (RGB + float alpha) per pixel of part box, all held at once
+STITCH_BYTES_PER_LAYER_PIXEL = 16
+# Tiled stitching composites in place and only holds the layers near the band
+STITCH_TILED_BYTES_PER_PIXEL = 3
+STITCH_BYTES_PER_BAND_PIXEL = 4
+# Never work below this fraction of the input resolution
+MIN_WORKING_SCALE = 0.25
+# Aim this far under the budget when picking a reduced scale
+SCALE_MARGIN = 0.9
+
+MB = 1024 * 1024
+
+def current_rss_bytes():
+    """Resident set size now; falls back to the peak where /proc is missing."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+def peak_rss_bytes():
+    """Peak resident set size of this process over its lifetime."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def peak_rss_mb():
+    return round(peak_rss_bytes() / MB, 1)
+
+def memory_limit_bytes():
+    """Physical memory, or the cgroup limit when the process runs in a smaller one."""
+    limit = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():
+            limit = min(limit, int(value))
+    return limit
+
+def memory_budget_mb(budget_mb=None):
+    """Explicit budget, then RCMS_MEMORY_BUDGET_MB, then a share of the memory limit."""
+    if budget_mb is None and os.environ.get(MEMORY_BUDGET_ENV):
+        budget_mb = float(os.environ[MEMORY_BUDGET_ENV])
+    if budget_mb is None:
+        budget_mb = memory_limit_bytes() * MEMORY_BUDGET_FRACTION / MB
+    return float(budget_mb)
+
+def tracking_enabled():
+    return os.environ.get(MEMORY_TRACKING_ENV, '1').lower() not in ('0', 'false', 'no')
+
+class MemoryTracker:
+    """
+    Record a stage's peak RSS (sampled on a thread, plus the kernel's
+    lifetime peak when it moved) and, through tracemalloc, its traced peak
+    and the source lines holding the most memory at that peak. NumPy
+    arrays are traced; OpenCV and framework allocations only show in RSS.
+
+    Use as a context manager, then call report().
+    """
+
+    def __init__(self, stage, top=TOP_ALLOCATIONS, interval=RSS_SAMPLE_INTERVAL, trace=None):
+        self.stage = stage
+        self.top = top
+        self.interval = interval
+        self.trace = tracking_enabled() if trace is None else trace
+        self.started_tracing = False
+        self.snapshot = None
+        self.snapshot_bytes = 0
+        self.traced_peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        self.start_rss = current_rss_bytes()
+        self.start_peak_rss = peak_rss_bytes()
+        self.peak_rss = self.start_rss
+        if self.trace:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            tracemalloc.reset_peak()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._take_sample()
+
+    def _take_sample(self):
+        self.peak_rss = max(self.peak_rss, current_rss_bytes())
+        if not tracemalloc.is_tracing():
+            return
+        traced = tracemalloc.get_traced_memory()[0]
+        if traced >= MIN_SNAPSHOT_BYTES and traced > self.snapshot_bytes * SNAPSHOT_GROWTH:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_bytes = traced
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        if self.trace and tracemalloc.is_tracing():
+            self._take_sample()
+            self.traced_peak = tracemalloc.get_traced_memory()[1]
+            if self.started_tracing:
+                tracemalloc.stop()
+        self.peak_rss = max(self.peak_rss, current_rss_bytes())
+        # The kernel's lifetime peak catches spikes between samples
+        end_peak_rss = peak_rss_bytes()
+        if end_peak_rss > self.start_peak_rss:
+            self.peak_rss = max(self.peak_rss, end_peak_rss)
+        self.seconds = time.perf_counter() - self.started_at
+        return False
+
+    def largest_allocations(self):
+        if self.snapshot is None:
+            return []
+        allocations = []
+        for stat in self.snapshot.statistics('lineno')[:self.top]:
+            frame = stat.traceback[0]
+            allocations.append({
+                'location': f"{os.path.basename(frame.filename)}:{frame.lineno}",
+                'sizeMb': round(stat.size / MB, 2),
+                'blocks': stat.count
+            })
+        return allocations
+
+    def report(self):
+        report = {
+            'stage': self.stage,
+            'peakRssMb': round(self.peak_rss / MB, 1),
+            'startRssMb': round(self.start_rss / MB, 1),
+            'peakRssDeltaMb': round((self.peak_rss - self.start_rss) / MB, 1)
+        }
+        if self.trace:
+            report['tracedPeakMb'] = round(self.traced_peak / MB, 1)
+            report['largestAllocations'] = self.largest_allocations()
+        return report
+
+def image_dimensions(path):
+    """
+    (width, height) from a JPEG, PNG or WebP header without decoding the
+    pixels, or None when the format is not recognised.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        if head.startswith(b'\x89PNG\r\n\x1a\n'):
+            return struct.unpack('>II', head[16:24])
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            chunk = head[12:16]
+            if chunk == b'VP8X':
+                return (1 + int.from_bytes(head[24:27], 'little'), 1 + int.from_bytes(head[27:30], 'little'))
+            if chunk == b'VP8 ':
+                f.seek(26)
+                width, height = struct.unpack('<HH', f.read(4))
+                return width & 0x3fff, height & 0x3fff
+            if chunk == b'VP8L':
+                bits = int.from_bytes(head[21:25], 'little')
+                return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+            return None
+        if not head.startswith(b'\xff\xd8'):
+            return None
+        # Walk the JPEG markers to the first start-of-frame
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                return None
+            if marker[1] in (0xd8, 0x01) or 0xd0 <= marker[1] <= 0xd7:
+                continue
+            length = struct.unpack('>H', f.read(2))[0]
+            if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+                height, width = struct.unpack('>xHH', f.read(5))
+                return width, height
+            f.seek(length - 2, os.SEEK_CUR)
+
+def estimate_segment_mb(width, height, parts, scale=1.0):
+    pixels = width * height * scale * scale
+    return pixels * (SEGMENT_BYTES_PER_PIXEL + SEGMENT_BYTES_PER_PART_PIXEL * parts) / MB
+
+def estimate_stitch_mb(width, height, part_pixels, scale=1.0, tiled=False, band_height=1024):
+    area = scale * scale
+    layers = part_pixels * area * STITCH_BYTES_PER_LAYER_PIXEL
+    if tiled:
+        band_rows = min(height * scale, band_height)
+        band = band_rows * width * scale
+        # Layers live from their first band to their last: about two bands' worth
+        live_layers = layers * min(1.0, 2 * band_rows / max(height * scale, 1))
+        return (width * height * area * STITCH_TILED_BYTES_PER_PIXEL
+                + band * STITCH_BYTES_PER_BAND_PIXEL + live_layers) / MB
+    return (width * height * area * STITCH_BYTES_PER_PIXEL + layers) / MB
+
+def fitting_scale(estimate_mb, available_mb):
+    """Largest scale (by area) bringing estimate_mb under available_mb, clamped."""
+    if estimate_mb <= 0:
+        return 1.0
+    scale = math.sqrt(max(available_mb, 0) * SCALE_MARGIN / estimate_mb)
+    return round(max(MIN_WORKING_SCALE, min(1.0, scale)), 3)
+
+def available_mb(budget_mb=None, baseline_mb=None):
+    """Budget left after what the process already holds (loaded models etc.)."""
+    budget = memory_budget_mb(budget_mb)
+    baseline = current_rss_bytes() / MB if baseline_mb is None else baseline_mb
+    return budget, budget - baseline
+
+def plan(mode, scale, estimate, budget, available):
+    return {
+        'mode': mode,
+        'scale': scale,
+        'estimatedMb': round(estimate, 1),
+        'budgetMb': round(budget, 1),
+        'availableMb': round(available, 1)
+    }
+
+def plan_segmentation(width, height, parts, budget_mb=None, baseline_mb=None):
+    """
+    Working resolution for segmenting a width x height image with `parts`
+    detections: 'full', or 'reduced' with the scale to segment at.
+    """
+    budget, available = available_mb(budget_mb, baseline_mb)
+    estimate = estimate_segment_mb(width, height, parts)
+    if estimate <= available:
+        return plan('full', 1.0, estimate, budget, available)
+    scale = fitting_scale(estimate, available)
+    return plan('reduced', scale, estimate_segment_mb(width, height, parts, scale), budget, available)
+
+def plan_stitching(width, height, part_pixels, budget_mb=None, baseline_mb=None, band_height=1024):
+    """
+    Compositing mode for a width x height base with part boxes covering
+    part_pixels: 'full', 'tiled', or 'reduced' (tiled at a lower scale).
+    """
+    budget, available = available_mb(budget_mb, baseline_mb)
+    estimate = estimate_stitch_mb(width, height, part_pixels)
+    if estimate <= available:
+        return plan('full', 1.0, estimate, budget, available)
+    tiled = estimate_stitch_mb(width, height, part_pixels, tiled=True, band_height=band_height)
+    if tiled <= available:
+        return plan('tiled', 1.0, tiled, budget, available)
+    scale = fitting_scale(tiled, available)
+    return plan('reduced', scale,
+                estimate_stitch_mb(width, height, part_pixels, scale, True, band_height), budget, available)
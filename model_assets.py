@@ -0,0 +1,374 @@
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows: installs are not locked against each other
+    fcntl = None
+
+# Shared model directory (e.g. an NFS mount every node reads); relative to the project root by default
+MODEL_DIR_ENV = 'RCMS_MODEL_DIR'
+DEFAULT_MODEL_DIR = 'models'
+MANIFEST_FILENAME = 'manifest.json'
+
+# Parallel range requests per download and the size of each range
+CONNECTIONS = 4
+CHUNK_SIZE = 16 * 1024 * 1024
+RETRIES = 3
+TIMEOUT = 60
+BUFFER_SIZE = 1024 * 1024
+
+# A download in progress is <file>.part, with <file>.part.json listing the
+# chunks already on disk so an interrupted download picks up where it stopped
+PART_SUFFIX = '.part'
+STATE_SUFFIX = '.json'
+LOCK_SUFFIX = '.lock'
+
+# Where the models the stages use come from, with their published SHA-256.
+# (The hex in the SAM file names is an MD5 prefix, not part of the SHA-256.)
+# A catalogue checksum always applies; for other models a checksum passed to
+# install, or the one recorded the first time, is checked on later installs.
+CATALOGUE = {
+    'sam_vit_h': {'filename': 'sam_vit_h_4b8939.pth',
+                  'url': 'https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth',
+                  'sha256': 'a7bf3b02f3ebf1267aba913ff637d9a2d5c33d3173bb679e46d9f338c26f262e'},
+    'sam_vit_l': {'filename': 'sam_vit_l_0b3195.pth',
+                  'url': 'https://dl.fbaipublicfiles.com/segment_anything/sam_vit_l_0b3195.pth',
+                  'sha256': '3adcc4315b642a4d2101128f611684e8734c41232a17c648ed1693702a49a622'},
+    'sam_vit_b': {'filename': 'sam_vit_b_01ec64.pth',
+                  'url': 'https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth',
+                  'sha256': 'ec2df62732614e57411cdcf32a23ffdf28910380d03139ee0f4fcbe91eb8c912'},
+}
+
+def model_dir(directory=None):
+    return directory or os.environ.get(MODEL_DIR_ENV) or DEFAULT_MODEL_DIR
+
+def manifest_path(directory=None):
+    return os.path.join(model_dir(directory), MANIFEST_FILENAME)
+
+@contextmanager
+def locked(path):
+    """Exclusive lock on path (created if needed), held across processes and nodes sharing the file."""
+    with open(path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def write_json(path, data):
+    staging = path + '.incoming'
+    with open(staging, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(staging, path)
+
+def load_manifest(directory=None):
+    """{'models': {name: {'filename', 'sha256', 'size', 'url', 'installedAt'}}}"""
+    try:
+        with open(manifest_path(directory), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'models': {}}
+
+def record(name, entry, directory=None):
+    """Add or replace one model in the manifest; concurrent installs of other models are kept."""
+    path = manifest_path(directory)
+    with locked(path + LOCK_SUFFIX):
+        manifest = load_manifest(directory)
+        manifest['models'][name] = entry
+        write_json(path, manifest)
+
+def file_digest(path):
+    """(sha256 hex digest, size) of a file."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(BUFFER_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+def probe(url):
+    """
+    (size, validator, ranged) of url. A one-byte range request tells both
+    the size and whether the server honours ranges; the ETag (or
+    Last-Modified) tells later requests whether the file changed.
+    """
+    request = urllib.request.Request(url, headers={'Range': 'bytes=0-0'})
+    with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        if response.status == 206:
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            if total.isdigit():
+                return int(total), validator, True
+        length = response.headers.get('Content-Length')
+        return (int(length) if length else None), validator, False
+
+def get_range(url, partial, start, end, validator):
+    """Write bytes start..end (inclusive) of url at the same offset of the partial file."""
+    headers = {'Range': f'bytes={start}-{end}'}
+    if validator:
+        # The server answers 200 with the whole file instead of a stale range
+        headers['If-Range'] = validator
+    request = urllib.request.Request(url, headers=headers)
+    with urllib.request.urlopen(request, timeout=TIMEOUT) as response, open(partial, 'r+b') as f:
+        if response.status != 206:
+            raise ValueError(f"{url} changed on the server during the download")
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = response.read(min(BUFFER_SIZE, remaining))
+            if not block:
+                raise http.client.IncompleteRead(b'', remaining)
+            f.write(block)
+            remaining -= len(block)
+
+def load_state(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def download_chunks(url, partial, size, validator, connections=CONNECTIONS, chunk_size=CHUNK_SIZE):
+    """
+    Fetch url in chunk_size ranges over `connections` parallel requests into
+    a preallocated partial file. Finished chunks are recorded as they land,
+    so a later call with the same url, size and validator only fetches the
+    missing ones; anything else starts over.
+    """
+    state_path = partial + STATE_SUFFIX
+    expected = {'url': url, 'size': size, 'validator': validator, 'chunkSize': chunk_size}
+    state = load_state(state_path)
+    resumable = (state is not None and all(state.get(key) == value for key, value in expected.items())
+                 and os.path.exists(partial) and os.path.getsize(partial) == size)
+    if not resumable:
+        state = dict(expected, done=[])
+        with open(partial, 'wb') as f:
+            f.truncate(size)
+        write_json(state_path, state)
+
+    count = (size + chunk_size - 1) // chunk_size
+    done = set(state['done'])
+    missing = [index for index in range(count) if index not in done]
+    if done:
+        print(f"Resuming {url}: {len(done)} of {count} chunks already downloaded")
+    lock = threading.Lock()
+
+    def fetch_chunk(index):
+        start = index * chunk_size
+        end = min(size, start + chunk_size) - 1
+        for attempt in range(RETRIES):
+            try:
+                get_range(url, partial, start, end, validator)
+                break
+            except (OSError, http.client.HTTPException) as e:
+                if attempt == RETRIES - 1:
+                    raise
+                print(f"Chunk {index} of {url} failed ({e}), retrying", file=sys.stderr)
+                time.sleep(2 ** attempt)
+        # A chunk recorded before its data reached the disk is caught by the checksum
+        with lock:
+            done.add(index)
+            state['done'] = sorted(done)
+            write_json(state_path, state)
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, min(connections, len(missing)))) as pool:
+            list(pool.map(fetch_chunk, missing))
+
+def download_stream(url, partial):
+    """One plain request, for servers that do not honour ranges (no resume)."""
+    with urllib.request.urlopen(url, timeout=TIMEOUT) as response, open(partial, 'wb') as f:
+        shutil.copyfileobj(response, f, BUFFER_SIZE)
+
+def discard(partial):
+    for path in (partial, partial + STATE_SUFFIX):
+        if os.path.exists(path):
+            os.unlink(path)
+
+def fetch(url, destination, sha256=None, connections=CONNECTIONS, chunk_size=CHUNK_SIZE):
+    """
+    Download url to destination: resumable parallel ranges when the server
+    supports them, verified against sha256 (when given) and the size the
+    server announced, then moved into place in one rename so readers never
+    see a partial file. Returns {'sha256', 'size'}.
+    """
+    partial = destination + PART_SUFFIX
+    size, validator, ranged = probe(url)
+    print(f"Downloading {url} to {destination}...")
+    if ranged and size:
+        download_chunks(url, partial, size, validator, connections, chunk_size)
+    else:
+        discard(partial)
+        download_stream(url, partial)
+
+    digest, length = file_digest(partial)
+    if size is not None and length != size:
+        discard(partial)
+        raise ValueError(f"Download of {url} is truncated: {length} of {size} bytes")
+    if sha256 and digest != sha256.lower():
+        discard(partial)
+        raise ValueError(f"Checksum mismatch for {url}: expected {sha256.lower()}, got {digest}")
+    with open(partial, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(partial, destination)
+    discard(partial)
+    print(f"Installed {destination} ({length} bytes, sha256 {digest})")
+    return {'sha256': digest, 'size': length}
+
+def manifest_entry(filename, result, url=None):
+    return {'filename': filename, 'sha256': result['sha256'], 'size': result['size'], 'url': url,
+            'installedAt': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def install(name, url=None, sha256=None, filename=None, directory=None, connections=CONNECTIONS,
+            chunk_size=CHUNK_SIZE, force=False):
+    """
+    Download a model into the model directory and record it in the
+    manifest. The URL and file name default to the manifest's entry, then
+    the catalogue's; the checksum to the catalogue's published one, then the
+    manifest's. An installed file that still matches its
+    checksum is kept unless force is set.
+    """
+    directory = model_dir(directory)
+    known = dict(CATALOGUE.get(name, {}), **load_manifest(directory)['models'].get(name, {}))
+    url = url or known.get('url')
+    if not url:
+        raise ValueError(f"No URL known for model {name}; pass one, or use `add` for a local file")
+    sha256 = sha256 or CATALOGUE.get(name, {}).get('sha256') or known.get('sha256')
+    filename = filename or known.get('filename') or os.path.basename(urlparse(url).path)
+    os.makedirs(directory, exist_ok=True)
+    destination = os.path.join(directory, filename)
+
+    # One node downloads, the others wait and find the file installed
+    with locked(destination + LOCK_SUFFIX):
+        result = None
+        if not force and sha256 and os.path.exists(destination):
+            digest, size = file_digest(destination)
+            if digest == sha256.lower():
+                print(f"Model {name} is already installed at {destination}")
+                result = {'sha256': digest, 'size': size}
+        if result is None:
+            result = fetch(url, destination, sha256, connections, chunk_size)
+        entry = manifest_entry(filename, result, url)
+        record(name, entry, directory)
+    return entry
+
+def add(name, path, directory=None):
+    """
+    Install a local file (e.g. a trained detector or classifier) into the
+    model directory and record it in the manifest.
+    """
+    directory = model_dir(directory)
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.basename(path)
+    destination = os.path.join(directory, filename)
+    with locked(destination + LOCK_SUFFIX):
+        if not (os.path.exists(destination) and os.path.samefile(path, destination)):
+            staging = destination + PART_SUFFIX
+            shutil.copyfile(path, staging)
+            os.replace(staging, destination)
+        entry = manifest_entry(filename, dict(zip(('sha256', 'size'), file_digest(destination))))
+        record(name, entry, directory)
+    print(f"Added {path} as model {name} ({entry['size']} bytes, sha256 {entry['sha256']})")
+    return entry
+
+def verify(names=None, directory=None):
+    """Re-hash installed models against the manifest: {name: 'ok' | 'missing' | 'size mismatch' | 'checksum mismatch'}"""
+    models = load_manifest(directory)['models']
+    report = {}
+    for name in names or sorted(models):
+        entry = models.get(name)
+        path = os.path.join(model_dir(directory), entry['filename']) if entry else None
+        if path is None or not os.path.exists(path):
+            report[name] = 'missing'
+        elif os.path.getsize(path) != entry['size']:
+            report[name] = 'size mismatch'
+        elif file_digest(path)[0] != entry['sha256']:
+            report[name] = 'checksum mismatch'
+        else:
+            report[name] = 'ok'
+    return report
+
+def resolve_model_path(name, fallback=None, directory=None):
+    """
+    Path the stages load model `name` from: the manifest's file in the model
+    directory, else fallback (the model's old place in the project root).
+    A manifest file whose size is not the recorded one (a truncated copy)
+    fails here instead of deep inside the model loader.
+    """
+    entry = load_manifest(directory)['models'].get(name)
+    if entry:
+        path = os.path.join(model_dir(directory), entry['filename'])
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            if size != entry['size']:
+                raise ValueError(f"Model {name} at {path} is {size} bytes, the manifest says {entry['size']}; "
+                                 f"reinstall it with `python model_assets.py install {name}`")
+            return path
+        if fallback is None or not os.path.exists(fallback):
+            return path
+    if fallback is None:
+        raise FileNotFoundError(f"Model {name} is not installed (run `python model_assets.py install {name}`)")
+    return fallback
+
+def main():
+    parser = argparse.ArgumentParser(description='Download, verify and locate the models the stages use.')
+    parser.add_argument('--dir', help=f'Model directory (default: ${MODEL_DIR_ENV} or {DEFAULT_MODEL_DIR})')
+    commands = parser.add_subparsers(dest='command', required=True)
+    install_parser = commands.add_parser('install', help='Download a model and record it in the manifest')
+    install_parser.add_argument('name', help=f"Model name, e.g. {', '.join(CATALOGUE)}")
+    install_parser.add_argument('--url')
+    install_parser.add_argument('--sha256', help='Expected SHA-256 of the file')
+    install_parser.add_argument('--filename')
+    install_parser.add_argument('--connections', type=int, default=CONNECTIONS)
+    install_parser.add_argument('--chunk-mb', type=int, default=CHUNK_SIZE // (1024 * 1024))
+    install_parser.add_argument('--force', action='store_true', help='Download again even if installed')
+    add_parser = commands.add_parser('add', help='Install a local model file')
+    add_parser.add_argument('name')
+    add_parser.add_argument('path')
+    verify_parser = commands.add_parser('verify', help='Re-hash installed models against the manifest')
+    verify_parser.add_argument('names', nargs='*')
+    path_parser = commands.add_parser('path', help='Print the path a model resolves to')
+    path_parser.add_argument('name')
+    commands.add_parser('list', help='Print the manifest as JSON')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'install':
+            entry = install(args.name, args.url, args.sha256, args.filename, args.dir, args.connections,
+                            args.chunk_mb * 1024 * 1024, args.force)
+            print(json.dumps(entry, indent=2))
+        elif args.command == 'add':
+            print(json.dumps(add(args.name, args.path, args.dir), indent=2))
+        elif args.command == 'verify':
+            report = verify(args.names, args.dir)
+            print(json.dumps(report, indent=2))
+            if any(result != 'ok' for result in report.values()):
+                sys.exit(1)
+        elif args.command == 'path':
+            print(resolve_model_path(args.name, directory=args.dir))
+        else:
+            print(json.dumps(load_manifest(args.dir), indent=2))
+    except Exception as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+# Prepared copies sit next to their source checkpoint:
+#   sam_vit_l_0b3195.pth -> sam_vit_l_0b3195.mmap.pt (or .safetensors)
+#   car_parts_detector.pt -> car_parts_detector.fused.pt
+# each with a .json sidecar recording the source it was made from.
+SAM_MODEL_TYPE = 'vit_l'
+PREPARED_SUFFIXES = {'mmap': '.mmap.pt', 'safetensors': '.safetensors'}
+DEFAULT_FORMAT = 'mmap'
+FUSED_SUFFIX = '.fused.pt'
+INFO_SUFFIX = '.json'
+
+def prepared_path(source, suffix):
+    return os.path.splitext(source)[0] + suffix
+
+def source_signature(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtimeNs': st.st_mtime_ns}
+
+def write_info(output, source, **fields):
+    info = dict(fields, source=os.path.basename(source), sourceSignature=source_signature(source),
+                preparedAt=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    staging = output + INFO_SUFFIX + '.incoming'
+    with open(staging, 'w') as f:
+        json.dump(info, f, indent=2)
+    os.replace(staging, output + INFO_SUFFIX)
+    return info
+
+def current_prepared(source, suffix):
+    """
+    The prepared copy of source, or None when there is none or it was made
+    from a different file. A prepared copy alone (source deleted to save
+    disk) is still used.
+    """
+    path = prepared_path(source, suffix)
+    try:
+        with open(path + INFO_SUFFIX, 'r') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(path):
+        return None
+    if os.path.exists(source) and info.get('sourceSignature') != source_signature(source):
+        return None
+    return path
+
+def find_prepared_sam(checkpoint):
+    """(path, format) of the current prepared SAM weights, or (None, None)."""
+    for fmt, suffix in PREPARED_SUFFIXES.items():
+        path = current_prepared(checkpoint, suffix)
+        if path is not None:
+            return path, fmt
+    return None, None
+
+def prepare_sam(checkpoint, fmt=DEFAULT_FORMAT, model_type=SAM_MODEL_TYPE):
+    """
+    Rewrite a SAM .pth checkpoint as a flat tensor file the loader can map:
+    torch's zip format loaded with mmap=True, or safetensors. Buffers that
+    are not in the state dict (pixel mean/std) are stored too, so the
+    loader never has to materialise a randomly initialised model.
+    """
+    if fmt not in PREPARED_SUFFIXES:
+        raise ValueError(f"Unknown format: {fmt} (available: {', '.join(PREPARED_SUFFIXES)})")
+    import torch
+    from segment_anything import sam_model_registry
+    sam = sam_model_registry[model_type](checkpoint=checkpoint)
+    tensors = {name: tensor.detach().contiguous() for name, tensor in sam.state_dict().items()}
+    for name, buffer in sam.named_buffers():
+        tensors.setdefault(name, buffer.detach().contiguous())
+
+    output = prepared_path(checkpoint, PREPARED_SUFFIXES[fmt])
+    staging = output + '.incoming'
+    if fmt == 'safetensors':
+        from safetensors.torch import save_file
+        save_file(tensors, staging, metadata={'modelType': model_type})
+    else:
+        torch.save(tensors, staging)
+    os.replace(staging, output)
+    write_info(output, checkpoint, format=fmt, modelType=model_type, tensors=len(tensors))
+    print(f"Prepared {checkpoint} -> {output} ({fmt})")
+    return output
+
+def load_weights(path, fmt):
+    """
+    Tensors backed by the file's pages instead of copies: every worker
+    mapping the same file shares one page-cache copy of the weights.
+    """
+    if fmt == 'safetensors':
+        from safetensors.torch import load_file
+        return load_file(path, device='cpu')
+    import torch
+    return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+
+def assign_tensors(model, tensors):
+    """Point the model's parameters and buffers at the loaded tensors without copying them."""
+    persistent = set(model.state_dict())
+    model.load_state_dict({name: tensors[name] for name in persistent}, strict=True, assign=True)
+    for name, tensor in tensors.items():
+        if name in persistent:
+            continue
+        module_name, _, buffer_name = name.rpartition('.')
+        module = model.get_submodule(module_name) if module_name else model
+        module.register_buffer(buffer_name, tensor, persistent=False)
+    return model
+
+def build_sam(path, fmt, model_type=SAM_MODEL_TYPE):
+    """A SAM model whose weights are mapped from a prepared file."""
+    import torch
+    from segment_anything import sam_model_registry
+    tensors = load_weights(path, fmt)
+    # The meta device skips allocating and initialising weights replaced right away
+    with torch.device('meta'):
+        sam = sam_model_registry[model_type]()
+    return assign_tensors(sam, tensors).eval()
+
+def prepare_yolo(model_path):
+    """
+    Save the detector with its Conv+BatchNorm layers already fused, so
+    loading it skips the fuse step (ultralytics checks is_fused()).
+    """
+    import torch
+    import ultralytics
+    from ultralytics import YOLO
+    model = YOLO(model_path)
+    fused = copy.deepcopy(model.model).fuse(verbose=False)
+    output = prepared_path(model_path, FUSED_SUFFIX)
+    staging = output + '.incoming'
+    # The checkpoint layout ultralytics itself writes, weights in half precision
+    torch.save({'model': fused.half(), 'train_args': dict(getattr(model.model, 'args', {}) or {}),
+                'version': ultralytics.__version__, 'date': time.strftime('%Y-%m-%dT%H:%M:%S')}, staging)
+    os.replace(staging, output)
+    write_info(output, model_path, fused=True)
+    print(f"Prepared {model_path} -> {output} (fused)")
+    return output
+
+def status(sam_checkpoint, yolo_model):
+    sam_path, sam_format = find_prepared_sam(sam_checkpoint)
+    return {
+        'sam': {'source': sam_checkpoint, 'prepared': sam_path, 'format': sam_format},
+        'yolo': {'source': yolo_model, 'prepared': current_prepared(yolo_model, FUSED_SUFFIX)}
+    }
+
+def main():
+    from sam_segmentation import sam_checkpoint_path
+    from yolo_detector import detector_model_path
+    parser = argparse.ArgumentParser(description='Prepare model checkpoints for fast, shared loading.')
+    parser.add_argument('--sam-checkpoint', default=sam_checkpoint_path())
+    parser.add_argument('--yolo-model', default=detector_model_path())
+    parser.add_argument('--format', choices=sorted(PREPARED_SUFFIXES), default=DEFAULT_FORMAT,
+                        help='Prepared SAM weight format')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('sam', help='Convert the SAM checkpoint to a mappable tensor file')
+    commands.add_parser('yolo', help='Save the YOLO model pre-fused')
+    commands.add_parser('all', help='Prepare both')
+    commands.add_parser('status', help='Print which prepared files are current as JSON')
+    args = parser.parse_args()
+
+    try:
+        if args.command in ('sam', 'all'):
+            prepare_sam(args.sam_checkpoint, args.format)
+        if args.command in ('yolo', 'all'):
+            prepare_yolo(args.yolo_model)
+        if args.command == 'status':
+            print(json.dumps(status(args.sam_checkpoint, args.yolo_model), indent=2))
+    except Exception as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
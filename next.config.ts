@@ -8,6 +8,16 @@ const nextConfig: NextConfig = {
     }
     return config;
   },
+  // Content-addressed uploads (lib/services/blobStore.ts) never change under
+  // their URL, so browsers and proxies may keep them forever
+  async headers() {
+    return [
+      {
+        source: "/blobs/:path*",
+        headers: [{ key: "Cache-Control", value: "public, max-age=31536000, immutable" }],
+      },
+    ];
+  },
 };
 
 export default nextConfig;
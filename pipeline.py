@@ -0,0 +1,229 @@
+import cv2
+import numpy as np
+import contextlib
+import json
+import os
+import sys
+import time
+from inference_backends import create_backend
+from instrumentation import record_span, serve_metrics_from_env
+from thread_budget import configure_worker
+from sam_segmentation import write_segmentation, full_size_mask
+from memory_guard import MemoryTracker, plan_segmentation, plan_stitching
+from stitching import (public_path, stitch_references, stitch_references_tiled, downscale_for_preview,
+                       save_result, TILE_BAND_HEIGHT)
+
+# Where each job's artifacts go, relative to public/
+SEGMENTS_URL_ROOT = '/segments'
+STITCHING_URL_ROOT = '/stitching_results'
+
+# Pipeline stage -> inference backend stage
+STAGE_BACKENDS = {'classify': 'classifier', 'detect': 'detector', 'segment': 'segmenter'}
+
+def load_models(stages=('classify', 'detect', 'segment'), backends=None):
+    """
+    Load the inference backends for the requested stages once; a worker
+    keeps the returned dict resident across jobs. backends maps a backend
+    stage to a registered name and defaults to the *_BACKEND environment
+    variables.
+    """
+    models = {}
+    for stage in stages:
+        key = STAGE_BACKENDS[stage]
+        models[key] = create_backend(key, (backends or {}).get(key))
+        models[key].warmup()
+    return models
+
+def backend_metadata(models):
+    return {key: backend.metadata() for key, backend in models.items() if hasattr(backend, 'metadata')}
+
+def read_job_image(image_path):
+    """
+    Job images are filesystem paths or public URLs from the UI (e.g. blob
+    URLs). Returns the decoded image and the file it came from.
+    """
+    for candidate in (image_path, public_path(image_path)):
+        image = cv2.imread(candidate)
+        if image is not None:
+            return image, candidate
+    raise ValueError(f"Failed to load image from {image_path}")
+
+def crop_mask(mask):
+    """Boolean full-frame mask -> (x, y, uint8 0/255 crop), as stitching expects."""
+    mask_uint8 = mask.astype(np.uint8) * 255
+    x, y, w, h = cv2.boundingRect(mask_uint8)
+    return x, y, np.ascontiguousarray(mask_uint8[y:y+h, x:x+w])
+
+def public_url(path):
+    """URL of a file under public/."""
+    public_root = os.path.join(os.getcwd(), 'public')
+    return '/' + os.path.relpath(os.path.abspath(path), public_root).replace(os.sep, '/')
+
+def stitch_input_parts(segmented_parts, masks, image_shape=None):
+    """
+    Segmented parts in the stitcher's format (box as x, y, w, h) with the
+    masks handed over in memory instead of re-read from the JPEGs.
+    Reduced-scale masks are brought to image_shape one at a time.
+    """
+    parts = []
+    for part, mask in zip(segmented_parts, masks):
+        if image_shape is not None:
+            mask = full_size_mask(mask, image_shape)
+        x1, y1, x2, y2 = part['bbox']
+        parts.append(dict(part, x=x1, y=y1, w=x2 - x1, h=y2 - y1, mask=crop_mask(mask)))
+    return parts
+
+def stitch_within_budget(base_img, data, budget_mb=None):
+    """
+    Composite the references onto the in-memory base, tiled or at a
+    reduced scale when a full-frame composite would not fit the memory
+    budget. Returns (stitched image, memory plan).
+    """
+    height, width = base_img.shape[:2]
+    part_pixels = sum(part['w'] * part['h'] for part in data['segmentedParts'])
+    memory_plan = plan_stitching(width, height, part_pixels, budget_mb)
+    if memory_plan['mode'] == 'full':
+        return stitch_references(base_img, data), memory_plan
+    print(f"Memory budget: {memory_plan['mode']} compositing at scale {memory_plan['scale']}")
+    scale = 1.0
+    if memory_plan['scale'] < 1.0:
+        base_img, scale = downscale_for_preview(base_img, max(1, int(round(max(height, width) * memory_plan['scale']))))
+    # The tiled compositor works in place; the caller no longer needs the base
+    return stitch_references_tiled(base_img, data, scale, TILE_BAND_HEIGHT), memory_plan
+
+def run_job(job, models):
+    """
+    Run classify -> detect -> segment -> stitch on one image in this
+    process. The image is decoded once and detections, masks and the
+    cut-out base stay in memory; only the files the UI shows are written.
+
+    job fields: imagePath, optional jobId, references ([{className,
+    imagePath}]), requireCar (default true), output and harmonize
+    (passed to the stitcher), memoryBudgetMb.
+    Returns the job result dict, with each stage's peak memory under
+    'memory' and the resolution choices under 'memoryPlan'.
+    """
+    job_id = str(job.get('jobId') or int(time.time() * 1000))
+    budget_mb = job.get('memoryBudgetMb')
+    timings = {}
+    memory = {}
+    memory_plan = {}
+    started = time.perf_counter()
+
+    def mark(stage, since):
+        elapsed = time.perf_counter() - since
+        timings[stage] = round(elapsed, 4)
+        record_span('pipeline', stage, elapsed, jobId=job_id)
+        return time.perf_counter()
+
+    image, source_path = read_job_image(job['imagePath'])
+    stage_start = mark('decode', started)
+
+    result = {'success': True, 'jobId': job_id, 'backends': backend_metadata(models),
+              'memory': memory, 'memoryPlan': memory_plan}
+    if 'classifier' in models:
+        with MemoryTracker('classify') as tracker:
+            classification = models['classifier'].predict(image)
+        memory['classify'] = tracker.report()
+        result['classification'] = classification
+        stage_start = mark('classify', stage_start)
+        if job.get('requireCar', True) and not classification['is_car']:
+            result.update({'success': False, 'error': 'Image does not appear to contain a car', 'timings': timings})
+            return result
+
+    with MemoryTracker('detect') as tracker:
+        detections = models['detector'].predict(image)
+    memory['detect'] = tracker.report()
+    result['detections'] = detections
+    stage_start = mark('detect', stage_start)
+
+    height, width = image.shape[:2]
+    memory_plan['segment'] = plan_segmentation(width, height, len(detections), budget_mb)
+    with MemoryTracker('segment') as tracker:
+        parts, masks, modified_image = models['segmenter'].predict((image, detections),
+                                                                   scale=memory_plan['segment']['scale'])
+    memory['segment'] = tracker.report()
+    stage_start = mark('segment', stage_start)
+
+    segments_dir = os.path.join(os.getcwd(), 'public', SEGMENTS_URL_ROOT.lstrip('/'), job_id)
+    os.makedirs(segments_dir, exist_ok=True)
+    segmented_parts = write_segmentation(image, parts, masks, modified_image, segments_dir, source_path)
+    for part in segmented_parts:
+        part['segmented_image_path'] = public_url(part['segmented_image_path'])
+        part['mask_path'] = public_url(part['mask_path'])
+    stitch_parts = stitch_input_parts(segmented_parts, masks, image.shape)
+    result['segmentedImageUrl'] = f"{SEGMENTS_URL_ROOT}/{job_id}/modified.jpg"
+    result['segmentedParts'] = [{key: value for key, value in part.items() if key != 'mask'} for part in stitch_parts]
+    stage_start = mark('write_segments', stage_start)
+
+    if job.get('references'):
+        data = {
+            'segmentedParts': stitch_parts,
+            'references': job['references'],
+            'outputDir': f"{STITCHING_URL_ROOT}/{job_id}",
+            'output': job.get('output', {}),
+            'harmonize': job.get('harmonize')
+        }
+        with MemoryTracker('stitch') as tracker:
+            stitched, memory_plan['stitch'] = stitch_within_budget(modified_image, data, budget_mb)
+            result['stitching'] = save_result(stitched, data, 'full')
+        memory['stitch'] = tracker.report()
+        mark('stitch', stage_start)
+
+    timings['total'] = round(time.perf_counter() - started, 4)
+    result['timings'] = timings
+    return result
+
+def handle_job(job, models):
+    """Run a job, turning failures into an error result."""
+    try:
+        return run_job(job, models)
+    except Exception as e:
+        print(f"Error in pipeline job: {str(e)}", file=sys.stderr)
+        return {'success': False, 'jobId': job.get('jobId'), 'error': str(e)}
+
+def run_worker(models):
+    """
+    Serve JSON-lines jobs on stdin with the models resident. Stage logging
+    goes to stderr so stdout only carries one result line per job.
+    """
+    serve_metrics_from_env()
+    print(json.dumps({'ready': True}), flush=True)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            print(json.dumps({'success': False, 'error': f"Invalid job: {str(e)}"}), flush=True)
+            continue
+        with contextlib.redirect_stdout(sys.stderr):
+            result = handle_job(job, models)
+        print(json.dumps(dict(result, id=job.get('id'))), flush=True)
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python pipeline.py <job_json_path> | --worker", file=sys.stderr)
+        sys.exit(1)
+
+    configure_worker('pipeline')
+    with contextlib.redirect_stdout(sys.stderr):
+        models = load_models()
+    if sys.argv[1] == '--worker':
+        run_worker(models)
+        return
+
+    with open(sys.argv[1], 'r') as f:
+        jobs = json.load(f)
+    if not isinstance(jobs, list):
+        jobs = [jobs]
+
+    results = []
+    for job in jobs:
+        with contextlib.redirect_stdout(sys.stderr):
+            results.append(handle_job(job, models))
+    print(json.dumps(results if len(results) > 1 else results[0], indent=2))
+    sys.exit(0 if all(result['success'] for result in results) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import os
+
+def pid_alive(pid):
+    """
+    Whether a process with this id is still running on this host.
+    A process we may not signal still counts as alive.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
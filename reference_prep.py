@@ -0,0 +1,191 @@
+import cv2
+import numpy as np
+import hashlib
+import os
+import sys
+import tempfile
+
+# Bump when the background-removal parameters change so cached assets are rebuilt
+REMOVAL_VERSION = 'v1'
+
+PREPARED_SUFFIX = '.rgba.png'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+# Directories under public/ that hold generated artifacts rather than references
+EXCLUDED_PUBLIC_DIRS = {
+    'segments', 'stitching_results', 'uploads', 'outputs',
+    'avatars', 'hero-images', 'landing-page'
+}
+
+# White/light background mask (HSV)
+WHITE_LOWER = np.array([0, 0, 200])
+WHITE_UPPER = np.array([180, 30, 255])
+
+# Very light gray background mask (HSV)
+LIGHT_GRAY_LOWER = np.array([0, 0, 180])
+LIGHT_GRAY_UPPER = np.array([180, 20, 220])
+
+# L channel (lightness) mask (LAB)
+L_LOWER = np.array([200, 0, 0])
+L_UPPER = np.array([255, 255, 255])
+
+# (path, mtime, size) -> content digest, so repeated lookups skip re-hashing
+_digest_cache = {}
+
+def content_digest(path):
+    """
+    SHA-256 of the file contents combined with the removal version.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    digest = _digest_cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256(REMOVAL_VERSION.encode('utf-8'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        _digest_cache[key] = digest
+    return digest
+
+def prepared_path_for(source_path, digest):
+    """
+    Location of the cached RGBA asset, stored next to the original.
+    """
+    directory, filename = os.path.split(source_path)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, f"{stem}.{digest[:16]}{PREPARED_SUFFIX}")
+
+def is_prepared_asset(path):
+    return path.endswith(PREPARED_SUFFIX)
+
+def has_transparency(image):
+    return image.ndim == 3 and image.shape[2] == 4 and np.any(image[:, :, 3] < 255)
+
+def remove_background(image):
+    """
+    Remove a light, uniform background and return a BGRA image.
+
+    Combines HSV white/light-gray masks with the LAB lightness mask, keeps
+    only the background regions connected to the image border (so bright
+    highlights inside the part survive), then cleans and feathers the edge.
+    """
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        if has_transparency(image):
+            # Already cut out, keep the existing alpha
+            return image
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+
+    white_mask = cv2.inRange(hsv, WHITE_LOWER, WHITE_UPPER)
+    light_gray_mask = cv2.inRange(hsv, LIGHT_GRAY_LOWER, LIGHT_GRAY_UPPER)
+    lightness_mask = cv2.inRange(lab, L_LOWER, L_UPPER)
+    background = white_mask | light_gray_mask | lightness_mask
+
+    # Keep only background components that touch the border
+    num_labels, labels = cv2.connectedComponents(background, connectivity=4)
+    if num_labels > 1:
+        border_labels = np.unique(np.concatenate([
+            labels[0, :], labels[-1, :], labels[:, 0], labels[:, -1]
+        ]))
+        border_labels = border_labels[border_labels != 0]
+        background = np.isin(labels, border_labels).astype(np.uint8) * 255
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    background = cv2.morphologyEx(background, cv2.MORPH_CLOSE, kernel)
+    background = cv2.morphologyEx(background, cv2.MORPH_OPEN, kernel)
+
+    foreground = cv2.bitwise_not(background)
+    foreground = cv2.GaussianBlur(foreground, (5, 5), 0)
+
+    return np.dstack([image, foreground])
+
+def find_prepared_reference(source_path):
+    """
+    Return the cached RGBA asset for a reference, or None if it is not prepared.
+    """
+    prepared_path = prepared_path_for(source_path, content_digest(source_path))
+    return prepared_path if os.path.exists(prepared_path) else None
+
+def prepare_reference(source_path, force=False):
+    """
+    Run background removal once for a reference image and cache the result
+    as an RGBA PNG next to the original. Returns the prepared asset path.
+    """
+    if is_prepared_asset(source_path):
+        return source_path
+
+    prepared_path = prepared_path_for(source_path, content_digest(source_path))
+    if os.path.exists(prepared_path) and not force:
+        return prepared_path
+
+    image = cv2.imread(source_path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Could not load reference image: {source_path}")
+
+    rgba = remove_background(image)
+
+    # Write atomically so concurrent stitch jobs never read a partial PNG.
+    # The temp name is unique per call, as threads of one process may race here.
+    directory, filename = os.path.split(prepared_path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{filename}.", suffix='.tmp.png', dir=directory or '.')
+    os.close(fd)
+    try:
+        if not cv2.imwrite(tmp_path, rgba):
+            raise ValueError(f"Could not write prepared reference: {prepared_path}")
+        os.replace(tmp_path, prepared_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # Drop assets cached for older contents of the same reference
+    directory, filename = os.path.split(source_path)
+    stem = os.path.splitext(filename)[0]
+    for sibling in os.listdir(directory or '.'):
+        sibling_path = os.path.join(directory, sibling)
+        if (sibling.startswith(f"{stem}.") and is_prepared_asset(sibling)
+                and sibling_path != prepared_path):
+            try:
+                os.remove(sibling_path)
+            except FileNotFoundError:
+                pass
+
+    return prepared_path
+
+def iter_reference_images(paths):
+    """
+    Yield reference image files from the given files and directories.
+    """
+    for path in paths:
+        if os.path.isfile(path):
+            if not is_prepared_asset(path):
+                yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            if os.path.abspath(root) == os.path.abspath(os.path.join(os.getcwd(), 'public')):
+                dirs[:] = [d for d in dirs if d not in EXCLUDED_PUBLIC_DIRS]
+            for filename in sorted(files):
+                if filename.lower().endswith(IMAGE_EXTENSIONS) and not is_prepared_asset(filename):
+                    yield os.path.join(root, filename)
+
+def main():
+    paths = sys.argv[1:] or [os.path.join(os.getcwd(), 'public')]
+    prepared = 0
+    failed = 0
+    for source_path in iter_reference_images(paths):
+        try:
+            prepared_path = prepare_reference(source_path)
+            print(f"{source_path} -> {prepared_path}")
+            prepared += 1
+        except Exception as e:
+            print(f"Error preparing {source_path}: {str(e)}", file=sys.stderr)
+            failed += 1
+    print(f"Prepared {prepared} reference images ({failed} failed)")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -3,62 +3,123 @@ import numpy as np
 import json
 import os
 import sys
-from segment_anything import SamPredictor, sam_model_registry
-import torch
+import time
+from instrumentation import span, log, record_span
+from memory_guard import MemoryTracker, plan_segmentation
+from blob_store import sniff_extension, has_exif, link_or_copy
+from shared_images import open_image, publish_encoded
+from thread_budget import configure_worker, apply_torch_threads
+from model_prep import find_prepared_sam, build_sam
+from model_assets import resolve_model_path
+from inference_backends import create_backend
 
-# Path to the SAM model
+# The SAM model in the model manifest, and its old place in the project root
+SAM_MODEL_NAME = 'sam_vit_l'
 SAM_MODEL_PATH = 'sam_vit_l_0b3195.pth'
+# Peak memory and the working-resolution plan of each image, next to its results
+STATS_FILENAME = 'segmentation_stats.json'
 
-def process_image(image_path, detections, output_dir, predictor):
-    print(f"Processing image: {image_path}")
-    
-    # Load image
-    image = cv2.imread(image_path)
-    if image is None:
-        raise ValueError(f"Failed to load image from {image_path}")
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    print(f"Image loaded successfully, shape: {image.shape}")
-    
-    # Save original image
-    original_path = os.path.join(output_dir, 'original.jpg')
-    cv2.imwrite(original_path, image)
-    
-    # Create a copy of the original image for the modified version
-    modified_image = image.copy()
+def sam_checkpoint_path():
+    return resolve_model_path(SAM_MODEL_NAME, SAM_MODEL_PATH)
+
+def load_sam_predictor(checkpoint=None):
+    """
+    Load SAM once and wrap it in a predictor; torch and segment_anything
+    are only imported here. Weights prepared by model_prep.py are mapped
+    from disk (shared by every worker) instead of unpickled into memory.
+    """
+    checkpoint = checkpoint or sam_checkpoint_path()
+    with span('segment', 'model_load'):
+        from segment_anything import SamPredictor, sam_model_registry
+        import torch
+        apply_torch_threads()
+        prepared, fmt = find_prepared_sam(checkpoint)
+        if prepared is not None:
+            print(f"Mapping prepared SAM weights from {prepared} ({fmt})...")
+            sam = build_sam(prepared, fmt)
+        else:
+            print("Loading SAM model...")
+            sam = sam_model_registry["vit_l"](checkpoint=checkpoint)
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        print(f"Using device: {device}")
+        sam.to(device=device)
+        predictor = SamPredictor(sam)
+    print("SAM model loaded successfully")
+    return predictor
+
+def warmup_predictor(predictor):
+    """Run the image encoder once so the first job does not pay for lazy initialisation."""
+    with span('segment', 'warmup'):
+        predictor.set_image(np.zeros((256, 256, 3), dtype=np.uint8))
+
+def release_device_memory():
+    """Clear CUDA memory between images if torch is loaded and a GPU is in use."""
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def full_size_mask(mask, shape):
+    """Mask at the image's resolution; reduced-scale masks are upscaled."""
+    height, width = shape[:2]
+    if mask.shape[:2] == (height, width):
+        return mask
+    return cv2.resize(mask.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST) > 0
+
+def segment_image(image, detections, predictor, scale=1.0):
+    """
+    Segment every detection on an already decoded BGR image.
+    Returns (parts, masks, modified_image): part metadata without file
+    paths, the boolean mask of each part, and the image with all parts cut out.
+
+    With scale < 1 SAM runs on a downscaled copy to bound memory; part
+    coordinates and the modified image stay at full resolution but the
+    masks are returned at the working scale (see full_size_mask).
+    """
+    with span('segment', 'preprocess', scale=scale):
+        work_image = image
+        if scale < 1.0:
+            height, width = image.shape[:2]
+            work_image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                                    interpolation=cv2.INTER_AREA)
+        image_rgb = cv2.cvtColor(work_image, cv2.COLOR_BGR2RGB)
     
-    # Set image for SAM
-    predictor.set_image(image_rgb)
+    # Set image for SAM (runs the image encoder)
+    with span('segment', 'inference', step='embed'):
+        predictor.set_image(image_rgb)
     
-    print(f"Processing {len(detections)} detections")
-    segmented_parts = []
-    combined_mask = np.zeros(image.shape[:2], dtype=bool)
+    log(f"Processing {len(detections)} detections")
+    parts = []
+    masks = []
+    combined_mask = np.zeros(work_image.shape[:2], dtype=bool)
     
     for i, detection in enumerate(detections):
-        print(f"\nProcessing detection {i+1}/{len(detections)}")
+        log(f"\nProcessing detection {i+1}/{len(detections)}")
         class_name = detection['class_name']
         center_point = np.array([detection['center_point']])
         bbox = detection['bbox']
         
-        print(f"Class: {class_name}")
-        print(f"Center point: {center_point}")
-        print(f"Bounding box: {bbox}")
+        log(f"Class: {class_name}")
+        log(f"Center point: {center_point}")
+        log(f"Bounding box: {bbox}")
         
         # Run SAM prediction
-        masks, scores, logits = predictor.predict(
-            point_coords=center_point,
-            point_labels=np.array([1]),
-            box=np.array(bbox),
-            multimask_output=True,
-        )
-        print(f"Got {len(masks)} masks, best score: {max(scores):.3f}")
+        with span('segment', 'inference', step='decode_mask'):
+            predicted_masks, scores, logits = predictor.predict(
+                point_coords=center_point * scale,
+                point_labels=np.array([1]),
+                box=np.array(bbox) * scale,
+                multimask_output=True,
+            )
+        log(f"Got {len(predicted_masks)} masks, best score: {max(scores):.3f}")
         
+        postprocess_started = time.perf_counter()
         # Choose the best mask
         best_mask_idx = np.argmax(scores)
-        mask = masks[best_mask_idx]
+        mask = predicted_masks[best_mask_idx]
         
         # Verify mask is not empty
-        mask_area = np.sum(mask)
-        print(f"Mask area: {mask_area} pixels")
+        mask_area = int(np.sum(mask) / (scale * scale))
+        log(f"Mask area: {mask_area} pixels")
         if mask_area < 100:
             print(f"Warning: Mask for {class_name} is very small, might be invalid")
             continue
@@ -71,57 +132,199 @@ def process_image(image_path, detections, output_dir, predictor):
             continue
         # Convert largest contour to list of points
         largest_contour = max(contours, key=cv2.contourArea)
-        contour_points = largest_contour.reshape(-1, 2).tolist()  # List of [x, y] coordinates
+        contour_points = largest_contour.reshape(-1, 2)
+        if scale < 1.0:
+            contour_points = np.round(contour_points / scale).astype(int)
+        contour_points = contour_points.tolist()  # List of [x, y] coordinates
         
         # Add to combined mask
         combined_mask = np.logical_or(combined_mask, mask)
         
+        parts.append({
+            "class_name": class_name,
+            "confidence": detection['confidence'],
+            "bbox": bbox,
+            "center_point": detection['center_point'],
+            "detection_index": i,
+            "mask_area": mask_area,
+            "mask_contour": contour_points  # New field for contour coordinates
+        })
+        masks.append(mask)
+        record_span('segment', 'postprocess', time.perf_counter() - postprocess_started)
+        log(f"Completed processing detection {i+1}")
+    
+    # Create modified image
+    with span('segment', 'postprocess', step='cut_out'):
+        modified_image = image.copy()
+        modified_image[full_size_mask(combined_mask, image.shape)] = 0
+    return parts, masks, modified_image
+
+def reusable_original(source_path):
+    """
+    True when the source file can stand in for original.jpg as is: a JPEG
+    without Exif, so its bytes decode to exactly the pixels segmented.
+    """
+    if not source_path or not os.path.exists(source_path):
+        return False
+    with open(source_path, 'rb') as f:
+        head = f.read(16)
+    return sniff_extension(head) == 'jpg' and not has_exif(source_path)
+
+def write_segmentation(image, parts, masks, modified_image, output_dir, source_path=None):
+    """
+    Write the files the UI reads: original, modified image, one cut-out
+    and one mask per part, and segmentation_results.json.
+    original.jpg is linked to source_path when that file already is the
+    same JPEG, instead of being encoded again.
+    Returns the segmented parts with their file paths.
+    """
+    # Save original image
+    original_path = os.path.join(output_dir, 'original.jpg')
+    if reusable_original(source_path):
+        with span('segment', 'write', file='original'):
+            link_or_copy(source_path, original_path)
+    else:
+        # Never write through a link left by an earlier run
+        if os.path.lexists(original_path):
+            os.unlink(original_path)
+        with span('segment', 'encode', file='original'):
+            cv2.imwrite(original_path, image)
+    
+    segmented_parts = []
+    for part, mask in zip(parts, masks):
+        mask = full_size_mask(mask, image.shape)
+        class_name = part['class_name']
+        i = part['detection_index']
+        
         # Create masked image for this part
         masked_image = image.copy()
         masked_image[~mask] = 255
         
         # Save individual segmented part
-        part_filename = f"{class_name}_{i}_{detection['confidence']:.2f}.jpg"
+        part_filename = f"{class_name}_{i}_{part['confidence']:.2f}.jpg"
         part_path = os.path.join(output_dir, part_filename)
-        print(f"Saving segmented part to: {part_path}")
-        cv2.imwrite(part_path, masked_image)
+        log(f"Saving segmented part to: {part_path}")
+        with span('segment', 'encode', file='part'):
+            cv2.imwrite(part_path, masked_image)
         
         # Save mask
         mask_filename = f"{class_name}_{i}_mask.jpg"
         mask_path = os.path.join(output_dir, mask_filename)
-        print(f"Saving mask to: {mask_path}")
-        cv2.imwrite(mask_path, mask_uint8)
+        log(f"Saving mask to: {mask_path}")
+        with span('segment', 'encode', file='mask'):
+            cv2.imwrite(mask_path, (mask * 255).astype(np.uint8))
         
         segmented_parts.append({
             "class_name": class_name,
-            "confidence": detection['confidence'],
-            "bbox": bbox,
-            "center_point": detection['center_point'],
+            "confidence": part['confidence'],
+            "bbox": part['bbox'],
+            "center_point": part['center_point'],
             "segmented_image_path": part_path,
             "mask_path": mask_path,
-            "mask_area": int(mask_area),
-            "mask_contour": contour_points  # New field for contour coordinates
+            "mask_area": part['mask_area'],
+            "mask_contour": part['mask_contour']
         })
-        print(f"Completed processing detection {i+1}")
-    
-    # Create modified image
-    mask_3channel = np.stack([combined_mask] * 3, axis=-1)
-    modified_image[mask_3channel] = 0
     
     # Save modified image
     modified_path = os.path.join(output_dir, 'modified.jpg')
     print(f"\nSaving modified image to: {modified_path}")
-    cv2.imwrite(modified_path, modified_image)
+    with span('segment', 'encode', file='modified'):
+        ok, encoded = cv2.imencode('.jpg', modified_image)
+        if not ok:
+            raise ValueError(f"Could not encode {modified_path}")
+        with open(modified_path, 'wb') as f:
+            f.write(encoded.tobytes())
+    # modified.jpg is the stitcher's base: hand it over already decoded
+    with span('segment', 'publish', file='modified'):
+        publish_encoded(modified_path, encoded)
     
     # Save segmentation results
     results_path = os.path.join(output_dir, 'segmentation_results.json')
     print(f"Saving segmentation results to: {results_path}")
-    with open(results_path, 'w') as f:
-        json.dump(segmented_parts, f, indent=2)
+    with span('segment', 'write'):
+        with open(results_path, 'w') as f:
+            json.dump(segmented_parts, f, indent=2)
     
     print(f"Successfully segmented {len(segmented_parts)} parts")
     return segmented_parts
 
+def process_image(image_path, detections, output_dir, segmenter, budget_mb=None):
+    """
+    Segment one image with a segmenter backend (see inference_backends)
+    and write its files. The memory budget picks the working resolution
+    before SAM runs; the plan and the measured peak memory are written to
+    segmentation_stats.json.
+    """
+    print(f"Processing image: {image_path}")
+    
+    with MemoryTracker('segment') as tracker:
+        # Load image, attaching to the detect stage's decode when it is still shared
+        with span('segment', 'decode'):
+            shared = open_image(image_path)
+        with shared:
+            image = shared.array
+            if image is None:
+                raise ValueError(f"Failed to load image from {image_path}")
+            print(f"Image loaded successfully, shape: {image.shape}")
+            
+            height, width = image.shape[:2]
+            memory_plan = plan_segmentation(width, height, len(detections), budget_mb)
+            if memory_plan['mode'] != 'full':
+                print(f"Memory budget: segmenting at scale {memory_plan['scale']} "
+                      f"(estimated {memory_plan['estimatedMb']} MB of {memory_plan['availableMb']} MB available)")
+            parts, masks, modified_image = segmenter.predict((image, detections), scale=memory_plan['scale'])
+            segmented_parts = write_segmentation(image, parts, masks, modified_image, output_dir, image_path)
+    
+    with open(os.path.join(output_dir, STATS_FILENAME), 'w') as f:
+        json.dump({'memory': tracker.report(), 'memoryPlan': memory_plan}, f, indent=2)
+    return segmented_parts
+
+def group_sam_inputs(sam_inputs):
+    """
+    Group inputs by image path to avoid processing the same image multiple times
+    """
+    image_groups = {}
+    for sam_input in sam_inputs:
+        image_path = sam_input['image_path']
+        if image_path not in image_groups:
+            image_groups[image_path] = []
+        image_groups[image_path].append({
+            'class_name': sam_input['detection_metadata']['class_name'],
+            'confidence': sam_input['detection_metadata']['confidence'],
+            'center_point': sam_input['prompts'][0]['data'],
+            'bbox': sam_input['prompts'][1]['data']
+        })
+    return image_groups
+
+def run_sam_inputs(sam_inputs, segmenter):
+    """
+    Segment every image in a SAM input list with an already loaded
+    segmenter backend. Returns the segmented parts of all images.
+    """
+    if not isinstance(sam_inputs, list):
+        sam_inputs = [sam_inputs]  # Handle single input case
+
+    image_groups = group_sam_inputs(sam_inputs)
+    print(f"Found {len(image_groups)} unique images to process")
+
+    segmented_parts = []
+    # Process each unique image
+    for image_path, detections in image_groups.items():
+        output_dir = os.path.dirname(sam_inputs[0]['output_path'])
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Save detections to a temporary JSON file
+        detections_json_path = os.path.join(output_dir, 'temp_detections.json')
+        with open(detections_json_path, 'w') as f:
+            json.dump(detections, f)
+
+        # Process the image with all its detections
+        segmented_parts.extend(process_image(image_path, detections, output_dir, segmenter))
+
+        # Clear CUDA memory after each image if available
+        release_device_memory()
+    return segmented_parts
+
 def main():
     if len(sys.argv) != 2:
         print("Usage: python sam_segmentation.py <sam_input_json_path>", file=sys.stderr)
@@ -129,55 +332,17 @@ def main():
 
     sam_input_path = sys.argv[1]
     print(f"Reading SAM input from: {sam_input_path}")
+    configure_worker('segment')
 
     try:
         # Read SAM input configuration
         with open(sam_input_path, 'r') as f:
             sam_inputs = json.load(f)
 
-        if not isinstance(sam_inputs, list):
-            sam_inputs = [sam_inputs]  # Handle single input case
-
-        # Group inputs by image path to avoid processing the same image multiple times
-        image_groups = {}
-        for sam_input in sam_inputs:
-            image_path = sam_input['image_path']
-            if image_path not in image_groups:
-                image_groups[image_path] = []
-            image_groups[image_path].append({
-                'class_name': sam_input['detection_metadata']['class_name'],
-                'confidence': sam_input['detection_metadata']['confidence'],
-                'center_point': sam_input['prompts'][0]['data'],
-                'bbox': sam_input['prompts'][1]['data']
-            })
-
-        print(f"Found {len(image_groups)} unique images to process")
-
-        # Load SAM model once
-        print("Loading SAM model...")
-        sam = sam_model_registry["vit_l"](checkpoint=SAM_MODEL_PATH)
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"Using device: {device}")
-        sam.to(device=device)
-        predictor = SamPredictor(sam)
-        print("SAM model loaded successfully")
-
-        # Process each unique image
-        for image_path, detections in image_groups.items():
-            output_dir = os.path.dirname(sam_inputs[0]['output_path'])
-            os.makedirs(output_dir, exist_ok=True)
-
-            # Save detections to a temporary JSON file
-            detections_json_path = os.path.join(output_dir, 'temp_detections.json')
-            with open(detections_json_path, 'w') as f:
-                json.dump(detections, f)
-
-            # Process the image with all its detections
-            process_image(image_path, detections, output_dir, predictor)
+        # Load the configured segmenter once (SEGMENTER_BACKEND, SAM by default)
+        segmenter = create_backend('segmenter')
 
-            # Clear CUDA memory after each image if available
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
+        run_sam_inputs(sam_inputs, segmenter)
 
         print("\nAll images processed successfully")
         sys.exit(0)
@@ -187,8 +352,7 @@ def main():
         sys.exit(1)
     finally:
         # Clean up CUDA memory if available
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        release_device_memory()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
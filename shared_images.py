@@ -0,0 +1,382 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+from blob_store import blob_digest
+from process_status import pid_alive
+
+# Decoded images live in POSIX shared memory so the detect, segment and
+# stitch processes of a job decode each file once. The registry is
+# host-wide like the segments themselves, whatever a process's cwd.
+REGISTRY_ENV = 'RCMS_SHARED_IMAGE_REGISTRY'
+REGISTRY_PATH = os.path.join(tempfile.gettempdir(), 'rcms_shared_images.sqlite3')
+# RCMS_SHARED_IMAGES=0 decodes privately with cv2.imread, as before
+SHARED_IMAGES_ENV = 'RCMS_SHARED_IMAGES'
+# Unreferenced images are kept for the next stage within this budget...
+BUDGET_ENV = 'RCMS_SHARED_IMAGE_MB'
+DEFAULT_BUDGET_MB = 1024
+# ...and for at most this long after their last use
+IDLE_TTL = 300
+SEGMENT_PREFIX = 'rcms_img_'
+
+MB = 1024 * 1024
+
+def shared_images_enabled():
+    return os.environ.get(SHARED_IMAGES_ENV, '1').lower() not in ('0', 'false', 'no')
+
+def image_key(path, flags=cv2.IMREAD_COLOR):
+    """
+    Identity of a decoded file: the blob digest for uploads in the store,
+    otherwise the file's path, inode, size and mtime, so a rewritten file
+    gets a new entry. Raises FileNotFoundError for missing files.
+    """
+    digest = blob_digest(path)
+    if digest is not None:
+        identity = f"blob:{digest}"
+    else:
+        st = os.stat(path)
+        identity = f"file:{os.path.realpath(path)}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.sha1(f"{identity}|{flags}".encode('utf-8')).hexdigest()
+
+def segment_name(key):
+    # macOS caps shared memory names at 31 characters
+    return SEGMENT_PREFIX + key[:20]
+
+def untrack(shm):
+    """
+    The registry, not the process that created or attached a segment,
+    decides when it is unlinked; keep the resource tracker from unlinking
+    it at process exit.
+    """
+    with contextlib.suppress(Exception):
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+def unlink_segment(name):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    shm.close()
+    # Processes still attached keep their mapping until they close it.
+    # unlink() also drops the resource tracker's entry from attaching.
+    shm.unlink()
+    return True
+
+# Segments whose arrays were still referenced when released; closed later
+_lingering = []
+
+def close_segment(shm):
+    try:
+        shm.close()
+    except BufferError:
+        _lingering.append(shm)
+
+def close_lingering():
+    for shm in list(_lingering):
+        try:
+            shm.close()
+            _lingering.remove(shm)
+        except BufferError:
+            pass
+
+class SharedImage:
+    """
+    A decoded image held through the registry. array is a read-only view
+    of the shared segment (a private array when sharing is off or lost a
+    race, None when the file cannot be decoded, like cv2.imread).
+    Release it, or use it as a context manager, once done with the array.
+    """
+
+    def __init__(self, array, registry=None, key=None, shm=None, holder_id=None, attached=False):
+        self.array = array
+        self.registry = registry
+        self.key = key
+        self.shm = shm
+        self.holder_id = holder_id
+        # True when another process had already decoded the image
+        self.attached = attached
+
+    @property
+    def shared(self):
+        return self.shm is not None
+
+    def release(self):
+        if self.holder_id is not None:
+            self.registry.release(self.key, self.holder_id)
+            self.holder_id = None
+        self.array = None
+        if self.shm is not None:
+            close_segment(self.shm)
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+class ImageRegistry:
+    """
+    SQLite index of the shared decoded images: segment name, shape and
+    dtype, last use, and one holder row per live reference (with the
+    holder's pid, so references of crashed processes can be dropped).
+    Segments with no holders stay until idle for IDLE_TTL or pushed out,
+    least recently used first, by the byte budget.
+
+    Use as a context manager.
+    """
+
+    def __init__(self, path=None, budget_mb=None, idle_ttl=IDLE_TTL):
+        self.path = path or os.environ.get(REGISTRY_ENV) or REGISTRY_PATH
+        if budget_mb is None:
+            budget_mb = float(os.environ.get(BUDGET_ENV, DEFAULT_BUDGET_MB))
+        self.budget = int(budget_mb * MB)
+        self.idle_ttl = idle_ttl
+        self.db = None
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS images (
+                key TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                source TEXT NOT NULL,
+                ready INTEGER NOT NULL DEFAULT 0,
+                creator_pid INTEGER NOT NULL,
+                shape TEXT,
+                dtype TEXT,
+                nbytes INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS holders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                acquired_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS holders_key ON holders (key);
+        ''')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.close()
+        self.db = None
+        return False
+
+    def _transaction(self):
+        self.db.execute('BEGIN IMMEDIATE')
+
+    def _add_holder(self, key, now):
+        self.db.execute('UPDATE images SET last_used = ? WHERE key = ?', (now, key))
+        return self.db.execute('INSERT INTO holders (key, pid, acquired_at) VALUES (?, ?, ?)',
+                               (key, os.getpid(), now)).lastrowid
+
+    def acquire(self, path, flags=cv2.IMREAD_COLOR, image=None):
+        """
+        The decoded image of a file: attached from shared memory when a
+        process already decoded it, otherwise decoded here and published.
+        A stage that just wrote the file passes the pixels it decodes to
+        as image, so nothing is decoded at all.
+        Returns a SharedImage holding one reference.
+        """
+        close_lingering()
+        try:
+            key = image_key(path, flags)
+        except FileNotFoundError:
+            return SharedImage(None)
+        name = segment_name(key)
+        now = time.time()
+        self._transaction()
+        try:
+            row = self.db.execute('SELECT ready, creator_pid, shape, dtype FROM images WHERE key = ?',
+                                  (key,)).fetchone()
+            if row is not None and row[0]:
+                try:
+                    shm = shared_memory.SharedMemory(name=name)
+                except FileNotFoundError:
+                    # Unlinked outside the registry (e.g. after a reboot)
+                    row = None
+                else:
+                    untrack(shm)
+                    holder_id = self._add_holder(key, now)
+                    self.db.execute('COMMIT')
+                    array = np.ndarray(tuple(json.loads(row[2])), dtype=np.dtype(row[3]), buffer=shm.buf)
+                    array.flags.writeable = False
+                    return SharedImage(array, self, key, shm, holder_id, attached=True)
+            if row is not None and pid_alive(row[1]):
+                # Another process is decoding it right now; do not wait for it
+                self.db.execute('COMMIT')
+                return SharedImage(cv2.imread(path, flags) if image is None else image)
+            self.db.execute(
+                'INSERT OR REPLACE INTO images (key, name, source, ready, creator_pid, created_at, last_used) '
+                'VALUES (?, ?, ?, 0, ?, ?, ?)', (key, name, os.path.abspath(path), os.getpid(), now, now))
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        return self._publish(path, flags, key, name, image)
+
+    def _publish(self, path, flags, key, name, image=None):
+        if image is None:
+            image = cv2.imread(path, flags)
+        if image is None:
+            self.db.execute('DELETE FROM images WHERE key = ?', (key,))
+            return SharedImage(None)
+        try:
+            self.sweep(reserve=image.nbytes)
+            try:
+                shm = shared_memory.SharedMemory(name=name, create=True, size=max(image.nbytes, 1))
+            except FileExistsError:
+                # Left behind by a process that died before registering it
+                unlink_segment(name)
+                shm = shared_memory.SharedMemory(name=name, create=True, size=max(image.nbytes, 1))
+        except Exception:
+            self.db.execute('DELETE FROM images WHERE key = ?', (key,))
+            raise
+        untrack(shm)
+        array = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
+        array[...] = image
+        del image
+        array.flags.writeable = False
+        now = time.time()
+        self._transaction()
+        self.db.execute('UPDATE images SET ready = 1, shape = ?, dtype = ?, nbytes = ?, last_used = ? WHERE key = ?',
+                        (json.dumps(array.shape), array.dtype.str, array.nbytes, now, key))
+        holder_id = self._add_holder(key, now)
+        self.db.execute('COMMIT')
+        return SharedImage(array, self, key, shm, holder_id)
+
+    def release(self, key, holder_id):
+        self.db.execute('DELETE FROM holders WHERE id = ?', (holder_id,))
+        self.db.execute('UPDATE images SET last_used = ? WHERE key = ?', (time.time(), key))
+        # Images left idle by earlier jobs go now rather than at the next publish
+        self.sweep()
+
+    def sweep(self, reserve=0, idle_ttl=None, now=None):
+        """
+        Drop references of dead processes, then unlink unreferenced
+        images idle past idle_ttl, then more (least recently used first)
+        until the registry plus `reserve` bytes fits the budget.
+        Returns the unlinked segment names.
+        """
+        now = time.time() if now is None else now
+        idle_ttl = self.idle_ttl if idle_ttl is None else idle_ttl
+        self._transaction()
+        try:
+            for holder_id, pid in self.db.execute('SELECT id, pid FROM holders').fetchall():
+                if not pid_alive(pid):
+                    self.db.execute('DELETE FROM holders WHERE id = ?', (holder_id,))
+            total = self.db.execute('SELECT COALESCE(SUM(nbytes), 0) FROM images').fetchone()[0] + reserve
+            unlinked = []
+            rows = self.db.execute(
+                'SELECT key, name, ready, creator_pid, nbytes, last_used FROM images '
+                'WHERE key NOT IN (SELECT key FROM holders) ORDER BY last_used').fetchall()
+            for key, name, ready, creator_pid, nbytes, last_used in rows:
+                if not ready:
+                    if pid_alive(creator_pid):
+                        continue
+                elif last_used > now - idle_ttl and total <= self.budget:
+                    continue
+                unlink_segment(name)
+                self.db.execute('DELETE FROM images WHERE key = ? AND key NOT IN (SELECT key FROM holders)', (key,))
+                total -= nbytes
+                unlinked.append(name)
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        return unlinked
+
+    def stats(self):
+        images, nbytes = self.db.execute('SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM images').fetchone()
+        return {
+            'images': images,
+            'bytes': nbytes,
+            'holders': self.db.execute('SELECT COUNT(*) FROM holders').fetchone()[0],
+            'budgetBytes': self.budget,
+            'registry': self.path
+        }
+
+# One registry connection per process (SQLite connections do not survive fork)
+_registry = None
+_registry_pid = None
+
+def default_registry():
+    global _registry, _registry_pid
+    if _registry is None or _registry_pid != os.getpid():
+        _registry = ImageRegistry().__enter__()
+        _registry_pid = os.getpid()
+    return _registry
+
+def open_image(path, flags=cv2.IMREAD_COLOR):
+    """
+    Drop-in for cv2.imread that shares the decoded pixels between
+    processes; returns a SharedImage to use as a context manager. The
+    array is read-only: copy it before drawing on it.
+    """
+    if not shared_images_enabled():
+        return SharedImage(cv2.imread(path, flags))
+    try:
+        return default_registry().acquire(path, flags)
+    except (OSError, sqlite3.Error) as e:
+        # No /dev/shm, a full one, or a locked registry: decode privately
+        print(f"Shared image registry unavailable ({e}); decoding {path} privately", file=sys.stderr)
+        return SharedImage(cv2.imread(path, flags))
+
+def publish_encoded(path, encoded, flags=cv2.IMREAD_COLOR):
+    """
+    Publish the pixels of an image a stage just wrote to path from the
+    encoded bytes, so the next stage opening path with the same flags
+    attaches instead of decoding the file. Failures are only logged.
+    """
+    if not shared_images_enabled():
+        return
+    try:
+        image = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), flags)
+        if image is not None:
+            default_registry().acquire(path, flags, image).release()
+    except (OSError, sqlite3.Error) as e:
+        print(f"Shared image registry unavailable ({e}); {path} is not published", file=sys.stderr)
+
+def sweep_idle():
+    """Unlink idle and over-budget images; for long-running processes to call between jobs."""
+    if not shared_images_enabled():
+        return []
+    try:
+        return default_registry().sweep()
+    except (OSError, sqlite3.Error) as e:
+        print(f"Shared image sweep failed: {e}", file=sys.stderr)
+        return []
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared-memory registry of decoded images.')
+    parser.add_argument('--registry', help=f'SQLite registry file (default ${REGISTRY_ENV} or {REGISTRY_PATH})')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help='Print registry totals as JSON')
+    sweep = commands.add_parser('sweep', help='Unlink idle and over-budget images')
+    sweep.add_argument('--all', action='store_true', help='Unlink every unreferenced image')
+    args = parser.parse_args()
+
+    with ImageRegistry(args.registry) as registry:
+        if args.command == 'stats':
+            print(json.dumps(registry.stats(), indent=2))
+        else:
+            unlinked = registry.sweep(idle_ttl=0 if args.all else None)
+            print(json.dumps({'unlinked': unlinked}))
+
+if __name__ == "__main__":
+    main()
@@ -3,31 +3,208 @@ import numpy as np
 import json
 import sys
 import os
+import hashlib
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from reference_prep import prepare_reference, content_digest
+from harmonize import harmonize_patch, ring_samples
+from layer_cache import LayerCache, layer_cache_dir, rects_intersect
+from instrumentation import span, log
+from memory_guard import MemoryTracker, image_dimensions, plan_stitching
+from shared_images import open_image
+from blob_store import sniff_extension
+from thread_budget import configure_worker, worker_threads
 
-def load_image(path):
+# Preview renders composite on a downscaled base for interactive feedback
+PREVIEW_MAX_SIZE = 1024
+PREVIEW_JPEG_QUALITY = 80
+
+# Output encoding defaults; the input JSON 'output' object overrides them
+DEFAULT_JPEG_QUALITY = 95
+DERIVATIVE_JPEG_QUALITY = 80
+DEFAULT_DERIVATIVES = {
+    'thumbnail': {'maxDimension': 320},
+    'preview': {'maxDimension': 1024}
+}
+
+# Cropped binary SAM masks, cached on disk and per process so the mask JPEG
+# is decoded only once
+MASK_CACHE_ROOT = os.path.join('tmp', 'mask_cache')
+_mask_cache = {}
+
+# Tiled compositing for very large bases: bands of TILE_BAND_HEIGHT rows,
+# used automatically from TILED_MIN_PIXELS or when the input asks for it
+TILE_BAND_HEIGHT = 1024
+TILED_MIN_PIXELS = 24_000_000
+BLEND_BAND_ROWS = 256
+
+# Most threads used to render and blend part layers (OpenCV and numpy release
+# the GIL); never more than the worker's thread budget
+STITCH_WORKERS = 8
+
+def public_path(path):
     if path.startswith('/'):
         path = path[1:]
-    abs_path = os.path.join(os.getcwd(), 'public', path)
-    img = cv2.imread(abs_path, cv2.IMREAD_UNCHANGED)
+    return os.path.join(os.getcwd(), 'public', path)
+
+def decode_flags(abs_path):
+    """
+    JPEGs have no alpha to keep and decode as colour, the flags the segment
+    stage publishes modified.jpg under; other formats keep their alpha.
+    """
+    try:
+        with open(abs_path, 'rb') as f:
+            head = f.read(16)
+    except OSError:
+        return cv2.IMREAD_UNCHANGED
+    return cv2.IMREAD_COLOR if sniff_extension(head) == 'jpg' else cv2.IMREAD_UNCHANGED
+
+def load_image(path, images=None):
+    """
+    Decode an image under public/. With an ExitStack as images, the pixels
+    come from the shared decoded-image registry (read-only, held until the
+    stack closes): the base the segment stage published, or the one an
+    earlier stitch of the same base decoded.
+    """
+    abs_path = public_path(path)
+    flags = decode_flags(abs_path)
+    if images is not None:
+        img = images.enter_context(open_image(abs_path, flags)).array
+    else:
+        img = cv2.imread(abs_path, flags)
     if img is None:
         raise ValueError(f"Could not load image: {abs_path}")
     if img.size == 0:
         raise ValueError(f"Loaded image is empty: {abs_path}")
     return img
 
+def load_reference_image(path):
+    """
+    Load the background-removed RGBA version of a reference image.
+    The asset is prepared once and cached by content hash, so later jobs
+    only pay for blending.
+    """
+    abs_path = public_path(path)
+    try:
+        prepared_path = prepare_reference(abs_path)
+    except Exception as e:
+        print(f"Warning: Could not prepare reference {abs_path}: {str(e)}")
+        return load_image(path)
+    img = read_prepared_reference(prepared_path)
+    if img is None or img.size == 0:
+        return load_image(path)
+    return img
+
+@lru_cache(maxsize=32)
+def read_prepared_reference(prepared_path):
+    # Prepared paths embed the content hash, so caching by path is safe and
+    # a reference shared by several instances is decoded once
+    return cv2.imread(prepared_path, cv2.IMREAD_UNCHANGED)
+
+def resolve_mask_path(mask_path):
+    """Mask paths are public URLs from the UI or filesystem paths from SAM."""
+    if not mask_path:
+        return None
+    for candidate in (public_path(mask_path), mask_path):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def load_part_mask(mask_path):
+    """
+    Load the SAM mask written by sam_segmentation.py, cropped to its box.
+    Returns (x, y, mask) with mask as uint8 0/255, or None if there is no mask.
+    """
+    abs_path = resolve_mask_path(mask_path)
+    if abs_path is None:
+        return None
+
+    stat = os.stat(abs_path)
+    key = f"{os.path.abspath(abs_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+    if key in _mask_cache:
+        return _mask_cache[key]
+
+    cache_path = os.path.join(os.getcwd(), MASK_CACHE_ROOT,
+                              hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz')
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            x, y = (int(v) for v in data['origin'])
+            cropped = (x, y, data['mask'])
+    else:
+        mask = cv2.imread(abs_path, cv2.IMREAD_GRAYSCALE)
+        if mask is None:
+            return None
+        # Masks are stored as JPEG, threshold away compression noise
+        _, mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)
+        x, y, w, h = cv2.boundingRect(mask)
+        if w == 0 or h == 0:
+            return None
+        cropped = (x, y, np.ascontiguousarray(mask[y:y+h, x:x+w]))
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, origin=np.array([x, y]), mask=cropped[2])
+        os.replace(tmp_path, cache_path)
+
+    _mask_cache[key] = cropped
+    return cropped
+
+def downscale_for_preview(img, max_size=PREVIEW_MAX_SIZE):
+    """
+    Downscale an image so its long edge is at most max_size.
+    Returns the resized image and the scale factor applied.
+    """
+    h, w = img.shape[:2]
+    scale = min(1.0, float(max_size) / max(h, w))
+    if scale >= 1.0:
+        return img, 1.0
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), scale
+
+def scale_part_info(part_info, scale):
+    """Scale a part's box, contour and mask to match a resized base image."""
+    scaled = dict(part_info)
+    scaled['scale'] = part_info.get('scale', 1.0) * scale
+    for key in ('x', 'y', 'w', 'h'):
+        scaled[key] = part_info[key] * scale
+    contour = part_info.get('contour', [])
+    if contour:
+        scaled['contour'] = np.round(np.array(contour, dtype=np.float32) * scale).astype(np.int32).tolist()
+    return scaled
+
+def part_info_from_segment(part):
+    part_info = {
+        'x': part['x'],
+        'y': part['y'],
+        'w': part['w'],
+        'h': part['h'],
+        'contour': part.get('mask_contour', []),
+        'mask_path': part.get('mask_path')
+    }
+    # In-process callers (pipeline.py) hand over the cropped mask directly
+    if part.get('mask') is not None:
+        part_info['mask'] = part['mask']
+    return part_info
+
 def get_segmented_part_info(segmentedParts, className):
     """Get the coordinates and dimensions from the segmented part."""
     for part in segmentedParts:
         if part['class_name'] == className:
-            return {
-                'x': part['x'],
-                'y': part['y'],
-                'w': part['w'],
-                'h': part['h'],
-                'contour': part.get('mask_contour', [])
-            }
+            return part_info_from_segment(part)
     return None
 
+def build_part_index(segmentedParts):
+    """
+    Index segmented parts by class name.
+    Returns {class_name: [instance_id, ...]} where instance_id is the
+    part's position in segmentedParts.
+    """
+    index = {}
+    for instance_id, part in enumerate(segmentedParts):
+        index.setdefault(part['class_name'], []).append(instance_id)
+    return index
+
 def fit_to_mask(reference_img, contour, base_img_shape):
     """
     Resize and crop reference image to fit the mask contour.
@@ -54,7 +231,7 @@ def fit_to_mask(reference_img, contour, base_img_shape):
         # Apply the contour mask to keep only the area within the contour
         if canvas.shape[2] == 4:  # RGBA
             alpha = canvas[:, :, 3] / 255.0
-            canvas = cv2.cvtColor(canvas, cv2.COLOR_RGBA2BGR)
+            canvas = cv2.cvtColor(canvas, cv2.COLOR_BGRA2BGR)
             alpha_3ch = np.stack([alpha, alpha, alpha], axis=2)
         else:
             alpha_3ch = np.stack([mask / 255.0, mask / 255.0, mask / 255.0], axis=2)
@@ -67,120 +244,508 @@ def fit_to_mask(reference_img, contour, base_img_shape):
         print(f"Error in fit_to_mask: {str(e)}")
         raise
 
-def stitch_part_with_mask(base_img, reference_img, part_info, output_dir, class_name):
+def part_region(part_info):
     """
-    Place reference image using the mask contour coordinates.
+    Locate a part on the base image.
+    Returns (x, y, w, h, mask) where mask is uint8 0/255 or None for a plain box.
     """
-    try:
-        contour = part_info.get('contour', [])
+    contour = part_info.get('contour', [])
+    part_mask = part_info.get('mask')
+    if part_mask is None:
+        part_mask = load_part_mask(part_info.get('mask_path'))
+
+    if part_mask is not None:
+        # Use the exact SAM mask, holes and all
+        x, y, mask = part_mask
+        scale = part_info.get('scale', 1.0)
+        if scale != 1.0:
+            mh, mw = mask.shape
+            x = int(round(x * scale))
+            y = int(round(y * scale))
+            size = (max(1, int(round(mw * scale))), max(1, int(round(mh * scale))))
+            mask = cv2.resize(mask, size, interpolation=cv2.INTER_AREA)
+        h, w = mask.shape
+    elif contour and len(contour) >= 3:
+        # Get bounding rect of the contour (in image coordinates)
+        contour_np = np.array(contour)
+        x, y, w, h = cv2.boundingRect(contour_np)
+        # Shift contour to bounding rect origin
+        shifted_contour = contour_np - [x, y]
+        # Create mask for the contour region
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.fillPoly(mask, [shifted_contour.astype(np.int32)], 255)
+    else:
+        # Fallback: just use bounding box
         x = int(part_info['x'])
         y = int(part_info['y'])
         w = int(part_info['w'])
         h = int(part_info['h'])
+        mask = None
+    return x, y, w, h, mask
 
-        if contour and len(contour) >= 3:
-            # Get bounding rect of the contour (in image coordinates)
-            contour_np = np.array(contour)
-            cx, cy, cw, ch = cv2.boundingRect(contour_np)
-            # Shift contour to bounding rect origin
-            shifted_contour = contour_np - [cx, cy]
-            # Create mask for the contour region
-            mask = np.zeros((ch, cw), dtype=np.uint8)
-            cv2.fillPoly(mask, [shifted_contour.astype(np.int32)], 255)
-            # Resize reference image to fit the contour bounding box
-            resized_ref = cv2.resize(reference_img, (cw, ch), interpolation=cv2.INTER_AREA)
-            # Prepare for alpha blending
-            if resized_ref.shape[2] == 4:
-                ref_rgb = cv2.cvtColor(resized_ref, cv2.COLOR_RGBA2BGR)
-                alpha = resized_ref[:, :, 3].astype(np.float32) / 255.0
-            else:
-                ref_rgb = resized_ref
-                alpha = np.ones((ch, cw), dtype=np.float32)
-            mask_f = mask.astype(np.float32) / 255.0
-            alpha = alpha * mask_f
-            region = base_img[cy:cy+ch, cx:cx+cw].astype(np.float32)
-            alpha_3ch = np.stack([alpha, alpha, alpha], axis=2)
-            blended = region * (1 - alpha_3ch) + ref_rgb.astype(np.float32) * alpha_3ch
-            blended = np.clip(blended, 0, 255).astype(np.uint8)
-            result_img = base_img.copy()
-            result_img[cy:cy+ch, cx:cx+cw] = blended
-            return result_img
+def render_part_layer(reference_img, part_info):
+    """
+    Resize the reference into the part's region and build its alpha.
+    Returns (x, y, ref_rgb, alpha) with alpha as float32 in [0, 1].
+    """
+    x, y, w, h, mask = part_region(part_info)
 
-        # Fallback: just use bounding box
-        resized_ref = cv2.resize(reference_img, (w, h), interpolation=cv2.INTER_AREA)
-        result_img = base_img.copy()
-        if resized_ref.shape[2] == 4:
-            alpha = resized_ref[:, :, 3].astype(np.float32) / 255.0
-            ref_rgb = cv2.cvtColor(resized_ref, cv2.COLOR_RGBA2BGR)
-            bbox_region = result_img[y:y+h, x:x+w].astype(np.float32)
-            ref_region = ref_rgb.astype(np.float32)
-            alpha_3ch = np.stack([alpha, alpha, alpha], axis=2)
-            blended = bbox_region * (1 - alpha_3ch) + ref_region * alpha_3ch
-            blended = np.clip(blended, 0, 255).astype(np.uint8)
-            result_img[y:y+h, x:x+w] = blended
+    # Resize reference image to fit the part region
+    resized_ref = cv2.resize(reference_img, (w, h), interpolation=cv2.INTER_AREA)
+    if resized_ref.shape[2] == 4:
+        ref_rgb = cv2.cvtColor(resized_ref, cv2.COLOR_BGRA2BGR)
+        alpha = resized_ref[:, :, 3].astype(np.float32) / 255.0
+    else:
+        ref_rgb = resized_ref
+        alpha = np.ones((h, w), dtype=np.float32)
+    if mask is not None:
+        alpha = alpha * (mask.astype(np.float32) / 255.0)
+    return x, y, ref_rgb, alpha
+
+def layer_bounds(layer, img_shape):
+    """Clip a layer's rectangle to the image, as (x0, y0, x1, y1)."""
+    x, y, _, alpha = layer
+    h, w = alpha.shape
+    return (max(x, 0), max(y, 0), min(x + w, img_shape[1]), min(y + h, img_shape[0]))
+
+def blend_layer(img, layer, roi=None):
+    """
+    Alpha-blend a part layer into img in place.
+    When roi (x0, y0, x1, y1) is given only that region is touched.
+    """
+    x, y, ref_rgb, alpha = layer
+    x0, y0, x1, y1 = layer_bounds(layer, img.shape)
+    if roi is not None:
+        x0, y0 = max(x0, roi[0]), max(y0, roi[1])
+        x1, y1 = min(x1, roi[2]), min(y1, roi[3])
+    if x0 >= x1 or y0 >= y1:
+        return img
+
+    # Blend a few rows at a time so float temporaries stay small for large parts
+    for by0 in range(y0, y1, BLEND_BAND_ROWS):
+        by1 = min(by0 + BLEND_BAND_ROWS, y1)
+        a = alpha[by0 - y:by1 - y, x0 - x:x1 - x, np.newaxis]
+        ref_region = ref_rgb[by0 - y:by1 - y, x0 - x:x1 - x].astype(np.float32)
+        region = img[by0:by1, x0:x1, :3].astype(np.float32)
+        blended = region * (1 - a) + ref_region * a
+        img[by0:by1, x0:x1, :3] = np.clip(blended, 0, 255).astype(np.uint8)
+    return img
+
+def blend_waves(rects):
+    """
+    Group layers into waves that can be blended concurrently.
+    A layer goes in the wave after the last earlier layer it overlaps, so
+    layers within a wave never overlap and stacking order is preserved.
+    """
+    wave_of = []
+    for i, rect in enumerate(rects):
+        wave = 0
+        for j in range(i):
+            if rects_intersect(rect, rects[j]):
+                wave = max(wave, wave_of[j] + 1)
+        wave_of.append(wave)
+    waves = [[] for _ in range(max(wave_of) + 1)] if wave_of else []
+    for i, wave in enumerate(wave_of):
+        waves[wave].append(i)
+    return waves
+
+def blend_layers(img, layers, executor=None):
+    """Blend layers into img in place, in parallel over non-overlapping ROIs."""
+    rects = [layer_bounds(layer, img.shape) for layer in layers]
+    for wave in blend_waves(rects):
+        if executor is None or len(wave) == 1:
+            for i in wave:
+                blend_layer(img, layers[i])
         else:
-            result_img[y:y+h, x:x+w] = resized_ref
-        return result_img
+            list(executor.map(lambda i: blend_layer(img, layers[i]), wave))
+    return img
 
+def stitch_part_with_mask(base_img, reference_img, part_info, output_dir, class_name):
+    """
+    Place reference image using the mask contour coordinates.
+    """
+    try:
+        layer = render_part_layer(reference_img, part_info)
+        return blend_layer(base_img.copy(), layer)
     except Exception as e:
         print(f"Error in stitch_part_with_mask: {str(e)}")
         raise
 
+def collect_part_jobs(data, scale=1.0):
+    """
+    Match references to segmented parts.
+    A reference applies to every instance of its class, or only to the
+    instance ids listed in its optional 'instances' field. When several
+    references target the same instance the last one wins.
+    Returns a list of (part_key, part_info, ref) in stitching order.
+    """
+    segmented_parts = data['segmentedParts']
+    part_index = build_part_index(segmented_parts)
+    assigned = {}
+    for ref in data['references']:
+        instance_ids = part_index.get(ref['className'], [])
+        targets = ref.get('instances')
+        if targets is not None:
+            targets = set(targets)
+            instance_ids = [i for i in instance_ids if i in targets]
+        if not instance_ids:
+            print(f"Warning: No segmented part found for {ref['className']}")
+            continue
+        for instance_id in instance_ids:
+            assigned[instance_id] = ref
+
+    jobs = []
+    for instance_id, ref in assigned.items():
+        segmented_part = part_info_from_segment(segmented_parts[instance_id])
+        if scale != 1.0:
+            segmented_part = scale_part_info(segmented_part, scale)
+        jobs.append((f"{ref['className']}#{instance_id}", segmented_part, ref))
+    return jobs
+
+def harmonize_method(data):
+    """Colour harmonization requested by the input: None, 'meanstd' or 'histogram'."""
+    harmonize = data.get('harmonize')
+    if not harmonize:
+        return None
+    return 'meanstd' if harmonize is True else harmonize
+
+def part_ring_samples(base_img, part_info):
+    """Base LAB pixels in a thin ring around the part, for harmonization."""
+    x, y, w, h, mask = part_region(part_info)
+    if mask is None:
+        mask = np.full((h, w), 255, dtype=np.uint8)
+    return ring_samples(base_img, x, y, mask)
+
+def render_reference_layer(part_info, ref, base_samples=None, method=None):
+    """
+    Load a reference and render its layer, or None if it cannot be loaded.
+    With a harmonization method the reference is colour-matched to base_samples.
+    """
+    log(f"\nProcessing {ref['className']}...")
+    with span('stitch', 'decode', file='reference'):
+        ref_img = load_reference_image(ref['imagePath'])
+    if ref_img is None:
+        print(f"Warning: Could not load reference image for {ref['className']}")
+        return None
+    log(f"Reference image loaded. Shape: {ref_img.shape}")
+    with span('stitch', 'preprocess'):
+        x, y, ref_rgb, alpha = render_part_layer(ref_img, part_info)
+        if method is not None and base_samples is not None:
+            ref_rgb = harmonize_patch(ref_rgb, alpha, base_samples, method)
+    return x, y, ref_rgb, alpha
+
+def prepare_references(jobs, executor):
+    """
+    Prepare each distinct reference of the jobs once, before rendering.
+    Instances sharing a reference then only read the cached asset instead
+    of all removing its background at the same time.
+    """
+    def prepare(abs_path):
+        try:
+            prepare_reference(abs_path)
+        except Exception:
+            # load_reference_image reports it and falls back to the original
+            pass
+
+    paths = dict.fromkeys(public_path(ref['imagePath']) for _, _, ref in jobs)
+    list(executor.map(prepare, paths))
+
+def layer_key(part_info, ref, method=None):
+    """Cache key of a rendered layer: part geometry, reference contents and harmonization."""
+    ref_path = public_path(ref['imagePath'])
+    ref_digest = content_digest(ref_path) if os.path.exists(ref_path) else ''
+    key = json.dumps([part_info, ref['imagePath'], ref_digest, method], sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def stitch_references(base_img, data, scale=1.0):
+    """
+    Composite every reference onto the base image.
+    Part coordinates are multiplied by scale when the base was downscaled.
+    """
+    result_img = base_img.copy()
+    jobs = collect_part_jobs(data, scale)
+    method = harmonize_method(data)
+
+    def render(job):
+        part_key, part_info, ref = job
+        samples = part_ring_samples(base_img, part_info) if method else None
+        return render_reference_layer(part_info, ref, samples, method)
+
+    with ThreadPoolExecutor(max_workers=min(STITCH_WORKERS, worker_threads())) as executor:
+        prepare_references(jobs, executor)
+        layers = executor.map(render, jobs)
+        layers = [layer for layer in layers if layer is not None]
+        blend_layers(result_img, layers, executor)
+    return result_img
+
+def stitch_references_tiled(base_img, data, scale=1.0, band_height=TILE_BAND_HEIGHT):
+    """
+    Composite in horizontal bands, in place on base_img.
+    A part's layer is rendered when the first band reaches it and released
+    after its last band, and only parts crossing the current band are
+    blended, so memory follows the band size instead of the image size.
+    """
+    img_h, img_w = base_img.shape[:2]
+    method = harmonize_method(data)
+    jobs = []
+    for part_key, part_info, ref in collect_part_jobs(data, scale):
+        x, y, w, h, _ = part_region(part_info)
+        # Sample the surroundings before any band has been blended over them
+        samples = part_ring_samples(base_img, part_info) if method else None
+        jobs.append((max(y, 0), min(y + h, img_h), part_info, ref, samples))
+
+    live = {}
+    for band_y0 in range(0, img_h, band_height):
+        band_y1 = min(band_y0 + band_height, img_h)
+        band = (0, band_y0, img_w, band_y1)
+        for i, (top, bottom, part_info, ref, samples) in enumerate(jobs):
+            if bottom <= band_y0 or top >= band_y1:
+                continue
+            if i not in live:
+                live[i] = render_reference_layer(part_info, ref, samples, method)
+            if live[i] is not None:
+                blend_layer(base_img, live[i], band)
+        for i in list(live):
+            if jobs[i][1] <= band_y1:
+                del live[i]
+    return base_img
+
+def stitch_references_cached(cache, data):
+    """
+    Composite the references through the session layer cache, so only the
+    parts whose reference or geometry changed are re-rendered and re-blended.
+    """
+    method = harmonize_method(data)
+
+    def render(part_info, ref):
+        samples = part_ring_samples(cache.base, part_info) if method else None
+        return render_reference_layer(part_info, ref, samples, method)
+
+    jobs = collect_part_jobs(data, cache.scale)
+    layers = []
+    for part_key, part_info, ref in jobs:
+        layers.append({
+            'part': part_key,
+            'key': layer_key(part_info, ref, method),
+            'render': lambda part_info=part_info, ref=ref: render(part_info, ref)
+        })
+    with ThreadPoolExecutor(max_workers=min(STITCH_WORKERS, worker_threads())) as executor:
+        prepare_references(jobs, executor)
+        composite, rendered = cache.update(layers, layer_bounds, blend_layer, executor)
+    print(f"Layer cache: re-rendered {rendered} of {len(layers)} parts")
+    return composite
+
+def load_base_image(data, mode, images=None):
+    """
+    Load the segmented base image, downscaled in preview mode.
+    Returns the image and the scale applied. See load_image for images.
+    """
+    print("Loading segmented base image...")
+    with span('stitch', 'decode', file='base'):
+        base_img = load_image(data['segmentedImage'], images)
+    print(f"Base image loaded. Shape: {base_img.shape}")
+
+    scale = 1.0
+    if mode == 'preview':
+        # Composite on a downscaled base so the operator gets instant feedback;
+        # the full-resolution render runs once the modification is confirmed
+        base_img, scale = downscale_for_preview(base_img, data.get('previewMaxSize', PREVIEW_MAX_SIZE))
+        print(f"Preview mode: base downscaled to {base_img.shape} (scale {scale:.3f})")
+    return base_img, scale
+
+def encode_settings(options, default_quality):
+    """
+    Resolve output options into (extension, cv2 imwrite params).
+    Options: format (jpeg, webp, png), quality, progressive, optimize.
+    """
+    fmt = str(options.get('format', 'jpeg')).lower()
+    quality = int(options.get('quality', default_quality))
+    if fmt in ('jpeg', 'jpg'):
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        if options.get('progressive'):
+            params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+        if options.get('optimize'):
+            params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+        return 'jpg', params
+    if fmt == 'webp':
+        return 'webp', [cv2.IMWRITE_WEBP_QUALITY, max(1, min(quality, 100))]
+    if fmt == 'png':
+        return 'png', [cv2.IMWRITE_PNG_COMPRESSION, 9 if options.get('optimize') else 3]
+    raise ValueError(f"Unsupported output format: {fmt}")
+
+def fit_within(img, max_dimension):
+    """Downscale so the long edge is at most max_dimension (no upscaling)."""
+    if not max_dimension:
+        return img
+    return downscale_for_preview(img, int(max_dimension))[0]
+
+def write_image(img, output_dir, name, options, default_quality):
+    """Encode img into output_dir and return (file name, width, height)."""
+    extension, params = encode_settings(options, default_quality)
+    filename = f"{name}.{extension}"
+    path = os.path.join(output_dir, filename)
+    print(f"Saving {name} image to: {path}")
+    with span('stitch', 'encode', file=name):
+        written = cv2.imwrite(path, img, params)
+    if not written:
+        raise ValueError(f"Could not write image: {path}")
+    return filename, img.shape[1], img.shape[0]
+
+def save_result(result_img, data, mode):
+    """
+    Write the stitched image and its derivatives from the in-memory composite.
+    Returns the output.json fields describing the written files.
+    """
+    output_dir = os.path.join(os.getcwd(), 'public', data['outputDir'].lstrip('/'))
+    os.makedirs(output_dir, exist_ok=True)
+
+    options = data.get('output', {})
+    if mode == 'preview':
+        result_name = 'preview'
+        default_quality = PREVIEW_JPEG_QUALITY
+    else:
+        result_name = 'result'
+        default_quality = DEFAULT_JPEG_QUALITY
+
+    result_img = fit_within(result_img, options.get('maxDimension'))
+    filename, width, height = write_image(result_img, output_dir, result_name, options, default_quality)
+    output_data = {
+        'stitchedImageUrl': f"{data['outputDir']}/{filename}",
+        'width': width,
+        'height': height,
+        'derivatives': {}
+    }
+
+    # Derivatives are only needed for renders that get saved
+    if mode != 'preview':
+        derivatives = options.get('derivatives', DEFAULT_DERIVATIVES)
+        # Largest first, so each derivative is downscaled from the previous one
+        source = result_img
+        for name, settings in sorted(derivatives.items(), key=lambda item: -item[1]['maxDimension']):
+            source = fit_within(source, settings['maxDimension'])
+            if source.shape == result_img.shape:
+                # Already small enough, point at the main image
+                output_data['derivatives'][name] = {
+                    'url': output_data['stitchedImageUrl'],
+                    'width': output_data['width'],
+                    'height': output_data['height']
+                }
+                continue
+            # Derivatives share the encoding but keep their own quality
+            derivative_options = {k: options[k] for k in ('format', 'progressive', 'optimize') if k in options}
+            derivative_options.update(settings)
+            filename, width, height = write_image(source, output_dir, name, derivative_options,
+                                                  DERIVATIVE_JPEG_QUALITY)
+            output_data['derivatives'][name] = {
+                'url': f"{data['outputDir']}/{filename}",
+                'width': width,
+                'height': height
+            }
+    return output_data
+
+def stitch_memory_plan(data, mode):
+    """
+    Pick full, tiled or reduced-resolution compositing for a full render
+    from the base image's header, before any pixels are decoded. Preview
+    renders are already downscaled and return None, as do unreadable headers.
+    """
+    if mode == 'preview':
+        return None
+    dimensions = image_dimensions(public_path(data['segmentedImage']))
+    if dimensions is None:
+        return None
+    part_pixels = sum(part['w'] * part['h'] for part in data['segmentedParts'])
+    return plan_stitching(dimensions[0], dimensions[1], part_pixels, data.get('memoryBudgetMb'),
+                          band_height=data.get('tileBandHeight', TILE_BAND_HEIGHT))
+
+def wants_tiling(data, mode, memory_plan):
+    """
+    Whether a render composites band by band: asked for, needed by the
+    memory plan, or a full-resolution base of TILED_MIN_PIXELS or more.
+    Decided from the header, so the layer cache (which renders whole
+    layers) is skipped before any pixels are decoded.
+    """
+    if data.get('tiled') or (memory_plan is not None and memory_plan['mode'] != 'full'):
+        return True
+    if mode == 'preview':
+        return False
+    dimensions = image_dimensions(public_path(data['segmentedImage']))
+    return dimensions is not None and dimensions[0] * dimensions[1] >= TILED_MIN_PIXELS
+
+def run_stitch(data):
+    """
+    Stitch one request (the input.json contents) and write its output.json.
+    Returns the output.json contents.
+    """
+    mode = data.get('mode', 'full')
+    with MemoryTracker('stitch') as tracker, contextlib.ExitStack() as images:
+        memory_plan = stitch_memory_plan(data, mode)
+        constrained = memory_plan is not None and memory_plan['mode'] != 'full'
+        if constrained:
+            print(f"Memory budget: {memory_plan['mode']} compositing at scale {memory_plan['scale']} "
+                  f"(estimated {memory_plan['estimatedMb']} MB of {memory_plan['availableMb']} MB available)")
+        tiled = wants_tiling(data, mode, memory_plan)
+        if data.get('useLayerCache', True) and not tiled:
+            variant = f"preview-{data.get('previewMaxSize', PREVIEW_MAX_SIZE)}" if mode == 'preview' else 'full'
+            with LayerCache(layer_cache_dir(public_path(data['segmentedImage']), variant)) as cache:
+                if not cache.has_base():
+                    base_img, scale = load_base_image(data, mode, images)
+                    cache.set_base(base_img, scale)
+                    # Work from the file-backed copy from here on
+                    del base_img
+                with span('stitch', 'composite', layerCache=True):
+                    result_img = stitch_references_cached(cache, data)
+                output_files = save_result(result_img, data, mode)
+        else:
+            base_img, scale = load_base_image(data, mode, images)
+            if constrained and memory_plan['scale'] < 1.0:
+                with span('stitch', 'preprocess', step='budget_downscale'):
+                    base_img, reduced = downscale_for_preview(
+                        base_img, max(1, int(round(max(base_img.shape[:2]) * memory_plan['scale']))))
+                scale *= reduced
+            if tiled or base_img.shape[0] * base_img.shape[1] >= TILED_MIN_PIXELS:
+                print(f"Tiled compositing in bands of {data.get('tileBandHeight', TILE_BAND_HEIGHT)} rows")
+                if not base_img.flags.writeable:
+                    # Tiled compositing works in place; never on the shared pixels
+                    base_img = base_img.copy()
+                with span('stitch', 'composite', tiled=True):
+                    result_img = stitch_references_tiled(base_img, data, scale,
+                                                         data.get('tileBandHeight', TILE_BAND_HEIGHT))
+            else:
+                with span('stitch', 'composite'):
+                    result_img = stitch_references(base_img, data, scale)
+            output_files = save_result(result_img, data, mode)
+    
+    # Create output.json
+    output_dir = os.path.join(os.getcwd(), 'public', data['outputDir'].lstrip('/'))
+    output_data = {
+        'success': True,
+        'mode': mode,
+        **output_files,
+        'message': 'Reference images placed using mask contours',
+        'memory': tracker.report(),
+        'memoryPlan': memory_plan
+    }
+    
+    output_json_path = os.path.join(output_dir, 'output.json')
+    with span('stitch', 'write'):
+        with open(output_json_path, 'w') as f:
+            json.dump(output_data, f, indent=2)
+    
+    print("Stitching completed successfully!")
+    print(f"Output saved to: {output_json_path}")
+    return output_data
+
 def main():
     try:
         if len(sys.argv) != 2:
             raise ValueError("Input JSON path required")
+        configure_worker('stitch')
         
         with open(sys.argv[1], 'r') as f:
             data = json.load(f)
         
-        # Load base image
-        print("Loading segmented base image...")
-        base_img = load_image(data['segmentedImage'])
-        print(f"Base image loaded. Shape: {base_img.shape}")
-        
-        # Process each reference image
-        for ref in data['references']:
-            print(f"\nProcessing {ref['className']}...")
-            
-            # Find matching segmented part
-            segmented_part = get_segmented_part_info(data['segmentedParts'], ref['className'])
-            if not segmented_part:
-                print(f"Warning: No segmented part found for {ref['className']}")
-                continue
-            
-            # Load reference image
-            ref_img = load_image(ref['imagePath'])
-            if ref_img is None:
-                print(f"Warning: Could not load reference image for {ref['className']}")
-                continue
-            
-            print(f"Reference image loaded. Shape: {ref_img.shape}")
-            
-            # Stitch using mask contour
-            base_img = stitch_part_with_mask(base_img, ref_img, segmented_part, data['outputDir'].lstrip('/'), ref['className'])
-        
-        # Save the final stitched image
-        output_dir = os.path.join(os.getcwd(), 'public', data['outputDir'].lstrip('/'))
-        os.makedirs(output_dir, exist_ok=True)
-        
-        result_path = os.path.join(output_dir, 'result.jpg')
-        print(f"\nSaving stitched image to: {result_path}")
-        cv2.imwrite(result_path, base_img)
-        
-        # Create output.json
-        output_data = {
-            'success': True,
-            'stitchedImageUrl': f"{data['outputDir']}/result.jpg",
-            'message': 'Reference images placed using mask contours'
-        }
-        
-        output_json_path = os.path.join(output_dir, 'output.json')
-        with open(output_json_path, 'w') as f:
-            json.dump(output_data, f, indent=2)
-        
-        print("Stitching completed successfully!")
-        print(f"Output saved to: {output_json_path}")
+        run_stitch(data)
         
     except Exception as e:
         print(f"Error in main: {str(e)}")
@@ -193,4 +758,4 @@ def main():
         sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
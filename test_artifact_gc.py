@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Test script for the artifact index and garbage collector.
+"""
+
+import json
+import os
+import tempfile
+import time
+from artifact_gc import ArtifactIndex, pinned_paths, PIN_JOURNAL_PATH
+from blob_store import put_bytes
+
+DAY = 86400
+
+def in_temp_cwd(test):
+    def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                test()
+            finally:
+                os.chdir(cwd)
+    run.__name__ = test.__name__
+    return run
+
+def make_job(root, name, size, age):
+    """A job directory of `size` bytes last touched `age` seconds ago."""
+    directory = os.path.join('public', root, name)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'result.jpg')
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    stamp = time.time() - age
+    os.utime(path, (stamp, stamp))
+    os.utime(directory, (stamp, stamp))
+    return directory
+
+@in_temp_cwd
+def test_scan_indexes_job_directories_and_blobs():
+    make_job('segments', '1', 100, DAY)
+    make_job('stitching_results', 'abc', 50, DAY)
+    blob = put_bytes(b'\xff\xd8\xff' + b'0' * 61)
+    with ArtifactIndex() as index:
+        counts = index.scan()
+        stats = index.stats()
+    assert counts['added'] == 4
+    assert stats['roots'][os.path.join('public', 'segments')] == {'artifacts': 1, 'bytes': 100}
+    # The blob and its public hardlink share one copy of the data
+    blob_bytes = stats['roots'][os.path.join('uploads', 'blobs')]['bytes']
+    public_bytes = stats['roots'][os.path.join('public', 'blobs')]['bytes']
+    assert blob_bytes + public_bytes == blob['size']
+
+@in_temp_cwd
+def test_scan_only_relists_changed_directories():
+    make_job('segments', '1', 10, DAY)
+    with ArtifactIndex() as index:
+        index.scan()
+        assert index.scan()['listed'] == 0
+        make_job('segments', '2', 10, 0)
+        counts = index.scan()
+        assert counts['added'] == 1
+        assert counts['listed'] == 1
+        os.unlink(os.path.join('public', 'segments', '1', 'result.jpg'))
+        os.rmdir(os.path.join('public', 'segments', '1'))
+        assert index.scan()['removed'] == 1
+        assert index.stats()['totalBytes'] == 10
+
+@in_temp_cwd
+def test_collect_evicts_least_recently_used_over_budget():
+    oldest = make_job('segments', 'oldest', 100, 3 * DAY)
+    older = make_job('segments', 'older', 100, 2 * DAY)
+    recent = make_job('segments', 'recent', 100, 10)
+    with ArtifactIndex() as index:
+        index.scan()
+        evicted = index.collect(budget=150, max_age=30 * DAY)
+        # The recent job is inside the grace period even though the total is still over
+        assert [item['path'] for item in evicted] == [oldest, older]
+        assert all(item['reason'] == 'budget' for item in evicted)
+    assert not os.path.exists(oldest) and not os.path.exists(older)
+    assert os.path.exists(recent)
+
+@in_temp_cwd
+def test_collect_evicts_expired_artifacts_under_budget_and_honours_pins():
+    expired = make_job('segments', 'expired', 10, 40 * DAY)
+    saved = make_job('stitching_results', 'saved', 10, 40 * DAY)
+    with ArtifactIndex() as index:
+        index.scan()
+        index.pin(['http://localhost:3000/stitching_results/saved/result.jpg'])
+        dry = index.collect(budget=10 ** 9, max_age=30 * DAY, dry_run=True)
+        assert os.path.exists(expired)
+        evicted = index.collect(budget=10 ** 9, max_age=30 * DAY)
+    assert dry == evicted
+    assert [(item['path'], item['reason']) for item in evicted] == [(expired, 'age')]
+    assert os.path.exists(saved)
+
+@in_temp_cwd
+def test_collect_skips_artifacts_used_since_indexing():
+    job = make_job('segments', 'reused', 10, 40 * DAY)
+    with ArtifactIndex() as index:
+        index.scan()
+        os.utime(os.path.join(job, 'result.jpg'))
+        assert index.collect(budget=0, max_age=30 * DAY) == []
+    assert os.path.exists(job)
+
+@in_temp_cwd
+def test_pin_journal_is_applied_incrementally():
+    os.makedirs('tmp')
+    with open(PIN_JOURNAL_PATH, 'w') as f:
+        f.write(json.dumps({'action': 'pin', 'urls': ['/segments/1/original.jpg']}) + '\n')
+    with ArtifactIndex() as index:
+        assert index.ingest_pin_journal() == 1
+        assert index.ingest_pin_journal() == 0
+        with open(PIN_JOURNAL_PATH, 'a') as f:
+            f.write(json.dumps({'action': 'unpin', 'urls': ['/segments/1/original.jpg']}) + '\n')
+            f.write('{"action": "pin", "ur')
+        assert index.ingest_pin_journal() == 1
+        assert index.stats()['pins'] == 0
+
+def test_pinned_paths_map_urls_to_artifacts():
+    digest = 'ab' * 32
+    assert pinned_paths('/segments/1749973514285/modified.jpg') == [os.path.join('public', 'segments', '1749973514285')]
+    assert pinned_paths(f'https://example.com/blobs/ab/ab/{digest}.jpg') == [
+        os.path.join('public', 'blobs', 'ab', 'ab', f'{digest}.jpg'),
+        os.path.join('uploads', 'blobs', 'ab', 'ab', f'{digest}.jpg')
+    ]
+    assert pinned_paths('/next.svg') == []
+    assert pinned_paths('/segments/../../etc') == [os.path.join('public', 'segments', 'etc')]
+
+if __name__ == "__main__":
+    test_scan_indexes_job_directories_and_blobs()
+    test_scan_only_relists_changed_directories()
+    test_collect_evicts_least_recently_used_over_budget()
+    test_collect_evicts_expired_artifacts_under_budget_and_honours_pins()
+    test_collect_skips_artifacts_used_since_indexing()
+    test_pin_journal_is_applied_incrementally()
+    test_pinned_paths_map_urls_to_artifacts()
+    print("Artifact GC tests passed")
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Test script for the stage benchmark suite and its baseline comparison.
+"""
+
+import numpy as np
+from benchmark_stages import (compare_to_baseline, run_benchmarks, synthetic_image, candidate_splits,
+                              run_split_benchmark)
+
+def test_synthetic_inputs_are_deterministic():
+    first = synthetic_image(0.05)
+    assert np.array_equal(first, synthetic_image(0.05))
+    assert abs(first.shape[0] * first.shape[1] - 50000) < 500
+
+def test_small_matrix_reports_percentiles():
+    report = run_benchmarks(sizes=[0.05], part_counts=[2], runs=2,
+                            only=['jpeg_decode', 'stitch_references', 'sam_postprocess'])
+    assert set(report['results']) == {'jpeg_decode/0.05mp', 'stitch_references/0.05mp/2parts',
+                                      'sam_postprocess/0.05mp/2parts'}
+    for result in report['results'].values():
+        assert 'error' not in result, result
+        assert result['runs'] == 2 and result['p50Ms'] <= result['p99Ms']
+        assert result['peakRssMb'] > 0
+
+def test_baseline_comparison_flags_regressions():
+    baseline = {'results': {'a': {'p50Ms': 10.0, 'peakRssMb': 100.0},
+                            'b': {'p50Ms': 10.0, 'peakRssMb': 100.0}}}
+    report = {'results': {'a': {'p50Ms': 11.0, 'peakRssMb': 100.0},
+                          'b': {'p50Ms': 15.0, 'peakRssMb': 130.0},
+                          'c': {'p50Ms': 1.0, 'peakRssMb': 1.0}}}
+    regressions = compare_to_baseline(report, baseline, tolerance=0.2)
+    assert [(r['case'], r['metric']) for r in regressions] == [('b', 'p50Ms'), ('b', 'peakRssMb')]
+
+def test_candidate_splits_fill_the_cores():
+    assert candidate_splits(8) == [(1, 8), (2, 4), (4, 2), (8, 1)]
+    assert candidate_splits(6) == [(1, 6), (2, 3), (4, 1), (6, 1)]
+
+def test_split_benchmark_reports_throughput_per_split():
+    report = run_split_benchmark('jpeg_decode/1mp', seconds=0.2, splits=[(1, 1), (2, 1)])
+    assert set(report['results']) == {'1x1', '2x1'}
+    for result in report['results'].values():
+        assert 'error' not in result, result
+        assert result['itemsPerSecond'] > 0
+    assert report['best'] in report['results'].values()
+
+if __name__ == "__main__":
+    test_synthetic_inputs_are_deterministic()
+    test_small_matrix_reports_percentiles()
+    test_baseline_comparison_flags_regressions()
+    test_candidate_splits_fill_the_cores()
+    test_split_benchmark_reports_throughput_per_split()
+    print("Benchmark suite tests passed")
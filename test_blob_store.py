@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Test script for the content-addressed upload store.
+"""
+
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import cv2
+import numpy as np
+from blob_store import put_bytes, put_file, blob_digest, blob_path, link_or_copy
+from classification_cache import file_sha256
+from sam_segmentation import write_segmentation
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blob_store.py')
+
+def encoded(extension, value=100):
+    return cv2.imencode(f".{extension}", np.full((16, 24, 3), value, dtype=np.uint8))[1].tobytes()
+
+def in_temp_cwd(test):
+    def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                test()
+            finally:
+                os.chdir(cwd)
+    run.__name__ = test.__name__
+    return run
+
+@in_temp_cwd
+def test_identical_uploads_are_stored_once():
+    data = encoded('jpg')
+    digest = hashlib.sha256(data).hexdigest()
+    first = put_bytes(data)
+    second = put_bytes(data)
+
+    assert first['sha256'] == digest and first['extension'] == 'jpg'
+    assert first['path'] == os.path.join('uploads', 'blobs', digest[:2], digest[2:4], f"{digest}.jpg")
+    assert first['url'] == f"/blobs/{digest[:2]}/{digest[2:4]}/{digest}.jpg"
+    assert not first['deduplicated'] and second['deduplicated']
+    public = os.path.join('public', first['url'].lstrip('/'))
+    assert os.path.samefile(public, first['path']), "public view is a hardlink"
+    assert os.stat(first['path']).st_nlink == 2
+    with open(public, 'rb') as f:
+        assert f.read() == data
+    # No staging files left behind
+    assert os.listdir(os.path.dirname(first['path'])) == [f"{digest}.jpg"]
+
+@in_temp_cwd
+def test_put_file_sniffs_format_and_can_move():
+    with open('upload.dat', 'wb') as f:
+        f.write(encoded('png'))
+    record = put_file('upload.dat', move=True, public=False)
+    assert record['extension'] == 'png'
+    assert not os.path.exists('upload.dat')
+    assert not os.path.exists(os.path.join('public', 'blobs'))
+
+    with open('again.png', 'wb') as f:
+        f.write(encoded('png'))
+    assert put_file('again.png')['deduplicated']
+    assert os.path.exists('again.png'), "without move the source stays"
+
+@in_temp_cwd
+def test_blob_digest_skips_hashing_for_stored_files():
+    record = put_bytes(encoded('jpg', 30))
+    assert blob_digest(record['path']) == record['sha256']
+    assert blob_digest(os.path.join('public', record['url'].lstrip('/'))) == record['sha256']
+    assert file_sha256(record['path']) == record['sha256']
+
+    # A digest-like name outside the store is still hashed
+    impostor = os.path.join('elsewhere', os.path.basename(record['path']))
+    os.makedirs('elsewhere')
+    with open(impostor, 'wb') as f:
+        f.write(b'different')
+    assert blob_digest(impostor) is None
+    assert file_sha256(impostor) == hashlib.sha256(b'different').hexdigest()
+
+@in_temp_cwd
+def test_segmentation_links_original_from_the_blob():
+    image_bytes = encoded('jpg', 80)
+    record = put_bytes(image_bytes)
+    image = cv2.imread(record['path'])
+    os.makedirs('out')
+    write_segmentation(image, [], [], image.copy(), 'out', record['path'])
+    assert os.path.samefile(os.path.join('out', 'original.jpg'), record['path'])
+
+    # A non-JPEG source is re-encoded, without touching an earlier link's target
+    png = put_bytes(encoded('png', 80))
+    write_segmentation(image, [], [], image.copy(), 'out', png['path'])
+    assert not os.path.samefile(os.path.join('out', 'original.jpg'), record['path'])
+    with open(record['path'], 'rb') as f:
+        assert f.read() == image_bytes
+
+@in_temp_cwd
+def test_link_or_copy_replaces_existing_file():
+    with open('a', 'w') as f:
+        f.write('new')
+    with open('b', 'w') as f:
+        f.write('old')
+    assert link_or_copy('a', 'b') in ('hardlink', 'reflink', 'copy')
+    with open('b') as f:
+        assert f.read() == 'new'
+
+@in_temp_cwd
+def test_cli_put_prints_record():
+    with open('photo.jpg', 'wb') as f:
+        f.write(encoded('jpg', 5))
+    output = subprocess.run([sys.executable, SCRIPT, 'put', 'photo.jpg'], capture_output=True, text=True, check=True)
+    assert '"deduplicated": false' in output.stdout
+    digest = hashlib.sha256(encoded('jpg', 5)).hexdigest()
+    assert os.path.exists(blob_path(digest, 'jpg'))
+
+if __name__ == "__main__":
+    test_identical_uploads_are_stored_once()
+    test_put_file_sniffs_format_and_can_move()
+    test_blob_digest_skips_hashing_for_stored_files()
+    test_segmentation_links_original_from_the_blob()
+    test_link_or_copy_replaces_existing_file()
+    test_cli_put_prints_record()
+    print("Blob store tests passed")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Test script for the car classifier backends and the parity check.
+"""
+
+import os
+import sys
+import tempfile
+import numpy as np
+from car_backends import check_parity, load_classifier, resolve_backend
+
+class MeanModel:
+    """Reference model: probability is the mean of the input."""
+    def predict(self, batch, batch_size=None, verbose=0):
+        return batch.mean(axis=(1, 2, 3)).reshape(-1, 1)
+
+def write_mean_onnx_model(path):
+    import onnx
+    from onnx import TensorProto, helper
+    graph = helper.make_graph(
+        [helper.make_node('ReduceMean', ['input'], ['mean'], axes=[1, 2, 3], keepdims=0),
+         helper.make_node('Unsqueeze', ['mean', 'axes'], ['output'])],
+        'mean',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, [None, 224, 224, 3])],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, [None, 1])],
+        [helper.make_tensor('axes', TensorProto.INT64, [1], [1])]
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)], ir_version=8)
+    onnx.save(model, path)
+
+def test_converted_models_are_preferred():
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            open('car_classifier_model.h5', 'wb').close()
+            assert resolve_backend() == ('keras', 'car_classifier_model.h5')
+            open('car_classifier_model.tflite', 'wb').close()
+            assert resolve_backend() == ('tflite', 'car_classifier_model.tflite')
+            open('car_classifier_model.onnx', 'wb').close()
+            assert resolve_backend() == ('onnx', 'car_classifier_model.onnx')
+            assert resolve_backend('keras') == ('keras', 'car_classifier_model.h5')
+            assert resolve_backend(model_path='models/other.tflite') == ('tflite', 'models/other.tflite')
+            assert 'tensorflow' not in sys.modules
+        finally:
+            os.chdir(cwd)
+
+def test_onnx_backend_matches_reference():
+    try:
+        import onnx, onnxruntime
+    except ImportError:
+        print("onnx/onnxruntime not installed, skipping ONNX backend test")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'mean.onnx')
+        write_mean_onnx_model(path)
+        classifier = load_classifier(model_path=path)
+        assert classifier.backend == 'onnx'
+
+        inputs = np.random.default_rng(0).random((5, 224, 224, 3), dtype=np.float32)
+        assert classifier.predict(inputs).shape == (5, 1)
+        report = check_parity(MeanModel(), classifier, inputs)
+        assert report['passed'] and report['labelMismatches'] == 0
+        assert 'tensorflow' not in sys.modules
+
+if __name__ == "__main__":
+    test_converted_models_are_preferred()
+    test_onnx_backend_matches_reference()
+    print("Car backend tests passed")
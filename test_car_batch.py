@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Test script for batched folder classification in car.py.
+"""
+
+import os
+import tempfile
+import cv2
+import numpy as np
+from car import classify_batches, classify_car_with_model, iter_image_paths
+
+class StubModel:
+    """Scores an image by its mean red value and records batch shapes."""
+    def __init__(self):
+        self.shapes = []
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        self.shapes.append(batch.shape)
+        return batch[..., 0].mean(axis=(1, 2)).reshape(-1, 1)
+
+def write_images(folder, count):
+    paths = []
+    for i in range(count):
+        img = np.zeros((60 + i, 90, 3), dtype=np.uint8)
+        img[:, :, 2] = 20 * i
+        path = os.path.join(folder, f"img_{i:02d}.jpg")
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+def test_batches_match_single_image_results():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_images(tmp, 11)
+        broken = os.path.join(tmp, 'img_05_broken.jpg')
+        with open(broken, 'wb') as f:
+            f.write(b'not an image')
+
+        model = StubModel()
+        results = list(classify_batches(iter_image_paths(tmp), model, batch_size=4, workers=3))
+
+        assert [r['path'] for r in results] == sorted(paths + [broken])
+        assert all(shape == (4, 224, 224, 3) for shape in model.shapes)
+        assert len(model.shapes) == 3
+        for r in results:
+            if r['path'] == broken:
+                assert 'error' in r
+            else:
+                assert r['result'] == classify_car_with_model(r['path'], StubModel())
+
+def test_paths_are_consumed_lazily():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_images(tmp, 12)
+        consumed = []
+
+        def stream():
+            for path in paths:
+                consumed.append(path)
+                yield path
+
+        results = classify_batches(stream(), StubModel(), batch_size=2, workers=2)
+        next(results)
+        assert len(consumed) < len(paths)
+        results.close()
+
+if __name__ == "__main__":
+    test_batches_match_single_image_results()
+    test_paths_are_consumed_lazily()
+    print("Car batch tests passed")
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Test script for the downscaled heuristic car feature extractor.
+"""
+
+import os
+import tempfile
+import cv2
+import numpy as np
+from car import HEURISTIC_FEATURES, heuristic_car_features, heuristic_car_features_batch, read_reduced_gray, simple_car_detection
+
+def test_large_images_are_decoded_reduced():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'large.jpg')
+        cv2.imwrite(path, np.random.default_rng(0).integers(0, 255, (2400, 4000, 3), dtype=np.uint8))
+        gray = read_reduced_gray(path, max_size=256)
+        assert max(gray.shape) == 256
+        assert abs(gray.shape[1] / gray.shape[0] - 4000 / 2400) < 0.02
+
+def test_batch_features_match_single_image():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i, (h, w) in enumerate([(300, 600), (500, 500), (80, 200)]):
+            img = np.full((h, w, 3), 40 * (i + 1), dtype=np.uint8)
+            cv2.rectangle(img, (w // 4, h // 4), (w // 2, h // 2), (255, 255, 255), -1)
+            paths.append(os.path.join(tmp, f"{i}.png"))
+            cv2.imwrite(paths[-1], img)
+        paths.append(os.path.join(tmp, 'missing.png'))
+
+        results = heuristic_car_features_batch(paths, workers=2)
+        assert 'error' in results[-1]
+        for path, result in zip(paths, results[:-1]):
+            assert result == heuristic_car_features(path)
+            assert tuple(result['features']) == HEURISTIC_FEATURES
+            assert 0 <= result['score'] <= 4
+            assert simple_car_detection(path).endswith(f"(confidence: {result['confidence']:.2f})")
+        assert results[0]['features']['aspect_ratio'] == 2.0
+
+if __name__ == "__main__":
+    test_large_images_are_decoded_reduced()
+    test_batch_features_match_single_image()
+    print("Car heuristic tests passed")
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Test script for the SQLite classification result cache.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from classification_cache import ClassificationCache
+from car import HEURISTIC_MODEL_KEY, classify_image_cached
+
+class StubModel:
+    backend = 'onnx'
+    model_path = None
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        return np.array([[0.9]], dtype=np.float32)
+
+def test_hit_skips_model_load():
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = os.path.join(tmp, 'car.jpg')
+        cv2.imwrite(image_path, np.full((60, 100, 3), 120, dtype=np.uint8))
+        model = StubModel()
+        model.model_path = os.path.join(tmp, 'model.onnx')
+        with open(model.model_path, 'wb') as f:
+            f.write(b'weights')
+        loads = []
+
+        def get_model():
+            loads.append(1)
+            return model
+
+        with ClassificationCache(os.path.join(tmp, 'cache.sqlite3')) as cache:
+            model_key = cache.model_key(model.backend, model.model_path)
+            assert model_key.startswith('onnx:') and model_key == cache.model_key('onnx', model.model_path)
+
+            first = classify_image_cached(image_path, cache, model_key, get_model)
+            second = classify_image_cached(image_path, cache, model_key, get_model)
+            assert loads == [1]
+            assert not first['cached'] and second['cached']
+            assert second['probability'] == first['probability'] == np.float32(0.9)
+            assert second['backend'] == 'onnx'
+            assert 'tensorflow' not in sys.modules
+
+def test_heuristic_fallback_is_not_stored_under_model_key():
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = os.path.join(tmp, 'car.jpg')
+        cv2.imwrite(image_path, np.full((60, 100, 3), 120, dtype=np.uint8))
+        with ClassificationCache(os.path.join(tmp, 'cache.sqlite3')) as cache:
+            result = classify_image_cached(image_path, cache, 'onnx:abc', lambda: None)
+            assert result['backend'] == 'heuristic'
+            again = classify_image_cached(image_path, cache, HEURISTIC_MODEL_KEY, lambda: None)
+            assert again['cached']
+            assert not classify_image_cached(image_path, cache, 'onnx:abc', lambda: None)['cached']
+
+def test_expired_results_are_evicted():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.sqlite3')
+        with ClassificationCache(path, ttl=60) as cache:
+            cache.put('img', 'model', {'result': 'x'})
+            assert cache.get('img', 'model') == {'result': 'x'}
+            cache.db.execute('UPDATE results SET created_at = ?', (time.time() - 120,))
+            assert cache.get('img', 'model') is None
+            assert cache.evict_expired() == 1
+
+if __name__ == "__main__":
+    test_hit_skips_model_load()
+    test_heuristic_fallback_is_not_stored_under_model_key()
+    test_expired_results_are_evicted()
+    print("Classification cache tests passed")
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Test script for LUT-based colour harmonization of references.
+"""
+
+import cv2
+import numpy as np
+from harmonize import harmonize_patch, mean_std_lut, ring_samples
+
+def make_scene():
+    rng = np.random.default_rng(0)
+    base_img = np.clip(rng.normal((150, 90, 60), 8, (300, 400, 3)), 0, 255).astype(np.uint8)
+    mask = np.zeros((100, 120), dtype=np.uint8)
+    cv2.ellipse(mask, (60, 50), (55, 45), 0, 0, 360, 255, -1)
+    # The part itself is cut out of the base, as in modified.jpg
+    base_img[100:200, 140:260][mask > 0] = 0
+    return base_img, mask
+
+def test_ring_excludes_part_and_holes():
+    base_img, mask = make_scene()
+    samples = ring_samples(base_img, 140, 100, mask)
+    assert len(samples) > 500
+    assert samples[:, 0].min() > 20, "cut-out pixels must not be sampled"
+
+def test_harmonized_patch_matches_surroundings():
+    base_img, mask = make_scene()
+    samples = ring_samples(base_img, 140, 100, mask)
+    ref_rgb = np.clip(np.random.default_rng(1).normal((40, 40, 200), 20, (100, 120, 3)), 0, 255).astype(np.uint8)
+    alpha = (mask > 0).astype(np.float32)
+
+    for method in ('meanstd', 'histogram'):
+        harmonized = harmonize_patch(ref_rgb, alpha, samples, method)
+        assert harmonized.shape == ref_rgb.shape
+        target = cv2.cvtColor(base_img[:50, :50], cv2.COLOR_BGR2LAB).reshape(-1, 3).mean(axis=0)
+        result = cv2.cvtColor(harmonized, cv2.COLOR_BGR2LAB)[mask > 0].mean(axis=0)
+        assert np.abs(result - target).max() < 12, (method, result, target)
+
+def test_too_few_samples_leaves_patch_unchanged():
+    ref_rgb = np.full((10, 10, 3), 77, dtype=np.uint8)
+    alpha = np.ones((10, 10), dtype=np.float32)
+    samples = np.zeros((3, 3), dtype=np.uint8)
+    assert harmonize_patch(ref_rgb, alpha, samples) is ref_rgb
+
+def test_lut_rounds_to_the_nearest_level():
+    rng = np.random.default_rng(1)
+    source = rng.integers(20, 230, (800, 3)).astype(np.uint8)
+    # Three quarters of the target one level brighter: a shift of ~0.75
+    target = source.copy()
+    target[:600] += 1
+    lut = mean_std_lut(source, target).astype(np.float64)
+    values = np.arange(256, dtype=np.float64)
+    for c in range(3):
+        gain = target[:, c].std() / source[:, c].std()
+        exact = np.clip((values - source[:, c].mean()) * gain + target[:, c].mean(), 0, 255)
+        assert np.abs(lut[:, c] - exact).max() <= 0.5 + 1e-3
+
+if __name__ == "__main__":
+    test_ring_excludes_part_and_holes()
+    test_harmonized_patch_matches_surroundings()
+    test_too_few_samples_leaves_patch_unchanged()
+    test_lut_rounds_to_the_nearest_level()
+    print("Harmonization tests passed")
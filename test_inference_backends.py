@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Test script for the pluggable inference backends and their registry.
+"""
+
+import os
+import numpy as np
+import inference_backends
+from inference_backends import (InferenceBackend, available_backends, configured_backend,
+                                create_backend, register_backend, STUB_PART_CLASSES)
+
+def test_registry_lists_framework_and_stub_backends():
+    assert available_backends('classifier') == ['auto', 'heuristic', 'stub']
+    assert available_backends('detector') == ['stub', 'ultralytics']
+    assert available_backends('segmenter') == ['sam', 'stub']
+
+def test_configured_backend_prefers_config_then_environment():
+    previous = os.environ.pop('DETECTOR_BACKEND', None)
+    try:
+        assert configured_backend('detector') == 'ultralytics'
+        os.environ['DETECTOR_BACKEND'] = 'stub'
+        assert configured_backend('detector') == 'stub'
+        assert create_backend('detector').name == 'stub'
+        assert configured_backend('detector', {'detector': 'ultralytics'}) == 'ultralytics'
+    finally:
+        os.environ.pop('DETECTOR_BACKEND', None)
+        if previous is not None:
+            os.environ['DETECTOR_BACKEND'] = previous
+
+def test_unknown_backend_is_rejected():
+    try:
+        create_backend('segmenter', 'missing')
+    except ValueError as e:
+        assert 'available: sam, stub' in str(e)
+    else:
+        raise AssertionError("expected ValueError")
+
+def test_stub_backends_are_deterministic():
+    images = [np.full((120, 160, 3), value, dtype=np.uint8) for value in (20, 200)]
+    classifier = create_backend('classifier', 'stub')
+    first = classifier.predict_batch(images)
+    assert first == classifier.predict_batch(images)
+    assert [result['is_car'] for result in first] == [False, True]
+
+    detector = create_backend('detector', 'stub', parts=4)
+    detections = detector.predict_batch(images)
+    assert detections[0] == detections[1]
+    assert [d['class_name'] for d in detections[0]] == list(STUB_PART_CLASSES[:4])
+
+    segmenter = create_backend('segmenter', 'stub')
+    parts, masks, modified = segmenter.predict((images[1], detections[1]))
+    assert len(parts) == len(masks) == 4
+    assert modified.shape == images[1].shape
+    assert not masks[0][0, 0] and masks[0][30, 40]
+
+def test_heuristic_classifier_needs_no_model():
+    classifier = create_backend('classifier', 'heuristic')
+    classifier.warmup()
+    result = classifier.predict(np.zeros((100, 100, 3), dtype=np.uint8))
+    assert set(result) >= {'is_car', 'confidence'}
+    assert classifier.metadata()['model'] == 'heuristic'
+
+def test_registered_backend_gets_stage_and_name():
+    @register_backend('classifier', 'test-constant')
+    class ConstantBackend(InferenceBackend):
+        def predict_batch(self, items):
+            return [1.0] * len(items)
+
+    try:
+        backend = create_backend('classifier', 'test-constant')
+        assert backend.predict('image') == 1.0
+        assert backend.metadata() == {'stage': 'classifier', 'backend': 'test-constant'}
+    finally:
+        inference_backends._registry['classifier'].pop('test-constant')
+
+if __name__ == "__main__":
+    test_registry_lists_framework_and_stub_backends()
+    test_configured_backend_prefers_config_then_environment()
+    test_unknown_backend_is_rejected()
+    test_stub_backends_are_deterministic()
+    test_heuristic_classifier_needs_no_model()
+    test_registered_backend_gets_stage_and_name()
+    print("Inference backend tests passed")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared timing spans, metrics export and quiet mode.
+"""
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import urllib.request
+import instrumentation
+from instrumentation import (span, record_span, log, prometheus_text, serve_metrics,
+                             set_quiet, set_spans_target, snapshot, reset)
+
+def test_spans_are_written_as_json_lines():
+    reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'spans', 'spans.jsonl')
+        set_spans_target(path)
+        try:
+            with span('detect', 'inference', batch=2):
+                pass
+            record_span('segment', 'encode', 0.25, file='mask')
+        finally:
+            set_spans_target(None)
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+    assert [(line['stage'], line['phase']) for line in lines] == [('detect', 'inference'), ('segment', 'encode')]
+    assert lines[0]['batch'] == 2 and lines[0]['durationMs'] >= 0
+    assert lines[1]['durationMs'] == 250.0 and lines[1]['file'] == 'mask'
+    assert lines[1]['pid'] == os.getpid()
+
+def test_span_is_recorded_when_the_block_raises():
+    reset()
+    try:
+        with span('classify', 'decode'):
+            raise ValueError("bad image")
+    except ValueError:
+        pass
+    assert snapshot()[('classify', 'decode')]['count'] == 1
+
+def test_prometheus_text_has_cumulative_buckets():
+    reset()
+    for seconds in (0.003, 0.2, 100.0):
+        record_span('stitch', 'composite', seconds)
+    text = prometheus_text()
+    assert '# TYPE rcms_stage_phase_duration_seconds histogram' in text
+    labels = 'stage="stitch",phase="composite"'
+    assert f'rcms_stage_phase_duration_seconds_bucket{{{labels},le="0.005"}} 1' in text
+    assert f'rcms_stage_phase_duration_seconds_bucket{{{labels},le="0.25"}} 2' in text
+    assert f'rcms_stage_phase_duration_seconds_bucket{{{labels},le="60.0"}} 2' in text
+    assert f'rcms_stage_phase_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in text
+    assert f'rcms_stage_phase_duration_seconds_count{{{labels}}} 3' in text
+    assert f'rcms_stage_phase_duration_seconds_sum{{{labels}}} 100.203000' in text
+
+def test_metrics_are_served_over_http():
+    reset()
+    record_span('detect', 'model_load', 1.5)
+    with contextlib.redirect_stderr(io.StringIO()):
+        server = serve_metrics(0)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            body = response.read().decode('utf-8')
+            assert response.headers['Content-Type'].startswith('text/plain')
+        assert 'stage="detect",phase="model_load"' in body
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_quiet_mode_drops_log_lines():
+    previous = instrumentation.is_quiet()
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out):
+            set_quiet(False)
+            log("kept")
+            set_quiet(True)
+            log("dropped")
+    finally:
+        set_quiet(previous)
+    assert out.getvalue() == "kept\n"
+
+if __name__ == "__main__":
+    test_spans_are_written_as_json_lines()
+    test_span_is_recorded_when_the_block_raises()
+    test_prometheus_text_has_cumulative_buckets()
+    test_metrics_are_served_over_http()
+    test_quiet_mode_drops_log_lines()
+    print("Instrumentation tests passed")
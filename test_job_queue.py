@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test script for the SQLite job queue and its workers.
+"""
+
+import json
+import os
+import tempfile
+import cv2
+import numpy as np
+import job_queue
+from job_queue import JobQueue, QueueFullError, run_worker, handle_classify, handle_detect, handle_segment
+from inference_backends import BACKEND_ENV_VARS, STUB_PART_CLASSES
+
+def test_priority_limits_and_backpressure():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'queue.sqlite3')
+        with JobQueue(path, stage_limits={'segment': 1}, max_pending={'segment': 3}) as queue:
+            low = queue.enqueue('segment', {'n': 1})
+            high = queue.enqueue('segment', {'n': 2}, priority=5)
+            queue.enqueue('segment', {'n': 3})
+            try:
+                queue.enqueue('segment', {'n': 4})
+                assert False, "fourth job should be rejected"
+            except QueueFullError:
+                pass
+
+            assert queue.claim('segment')[:2] == (high, {'n': 2})
+            assert queue.claim('segment') is None, "stage limit of 1 is reached"
+            queue.complete(high, {'ok': True})
+            assert queue.claim('segment')[0] == low
+            assert queue.get(high)['result'] == {'ok': True}
+            assert queue.stats()['segment'] == {'done': 1, 'running': 1, 'queued': 1}
+
+def test_failed_jobs_retry_then_fail():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'queue.sqlite3')
+        backoff = job_queue.RETRY_BACKOFF
+        job_queue.RETRY_BACKOFF = 0
+        try:
+            calls = []
+
+            def flaky(payload, models):
+                calls.append(payload)
+                if len(calls) < 2:
+                    raise RuntimeError('transient')
+                return {'value': payload['value'] * 2}
+
+            def broken(payload, models):
+                raise RuntimeError('always')
+
+            with JobQueue(path) as queue:
+                ok_id = queue.enqueue('stitch', {'value': 21})
+                bad_id = queue.enqueue('classify', {}, max_attempts=2)
+
+            run_worker('stitch', path, handlers={'stitch': flaky}, max_jobs=5)
+            run_worker('classify', path, handlers={'classify': broken}, max_jobs=5)
+
+            with JobQueue(path) as queue:
+                ok = queue.get(ok_id)
+                assert ok['status'] == 'done' and ok['attempts'] == 2
+                assert ok['result'] == {'value': 42}
+                bad = queue.get(bad_id)
+                assert bad['status'] == 'failed' and bad['attempts'] == 2
+                assert 'always' in bad['error']
+        finally:
+            job_queue.RETRY_BACKOFF = backoff
+
+def test_jobs_of_dead_workers_are_requeued():
+    with tempfile.TemporaryDirectory() as tmp:
+        with JobQueue(os.path.join(tmp, 'queue.sqlite3')) as queue:
+            job_id = queue.enqueue('detect', {})
+            queue.claim('detect', worker_pid=2 ** 22 + 12345)
+            assert queue.requeue_stale() == 1
+            assert queue.get(job_id)['status'] == 'queued'
+
+def test_stage_handlers_run_the_configured_backends():
+    saved = {name: os.environ.get(name) for name in BACKEND_ENV_VARS.values()}
+    for name in BACKEND_ENV_VARS.values():
+        os.environ[name] = 'stub'
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            image_path = os.path.join(tmp, 'car.png')
+            cv2.imwrite(image_path, np.full((120, 160, 3), 200, dtype=np.uint8))
+            models = {}
+            assert handle_classify({'image_path': image_path}, models)['backend'] == 'stub'
+
+            json_path = os.path.join(tmp, 'detections.json')
+            annotated_path = os.path.join(tmp, 'annotated.jpg')
+            output = handle_detect({'image_path': image_path, 'json_output_path': json_path,
+                                    'output_path': annotated_path}, models)
+            assert [d['class_name'] for d in output['detections']] == list(STUB_PART_CLASSES)
+            assert output['metadata']['model_info']['num_classes'] == len(STUB_PART_CLASSES)
+            with open(json_path) as f:
+                assert json.load(f)['detections'] == output['detections']
+            assert cv2.imread(annotated_path).shape == (120, 160, 3)
+            assert set(models) == {'classifier', 'detector'}
+
+            detection = output['detections'][0]
+            parts = handle_segment([{
+                'image_path': image_path,
+                'output_path': os.path.join(tmp, 'segments', 'result.json'),
+                'detection_metadata': {'class_name': detection['class_name'], 'confidence': detection['confidence']},
+                'prompts': [{'type': 'point', 'data': detection['center_point']},
+                            {'type': 'box', 'data': detection['bbox']}]
+            }], models)
+            assert len(parts) == 1 and parts[0]['mask_area'] > 0
+            assert os.path.exists(os.path.join(tmp, 'segments', 'modified.jpg'))
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+if __name__ == "__main__":
+    test_priority_limits_and_backpressure()
+    test_failed_jobs_retry_then_fail()
+    test_jobs_of_dead_workers_are_requeued()
+    test_stage_handlers_run_the_configured_backends()
+    print("Job queue tests passed")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Test script for incremental re-stitching through the session layer cache.
+"""
+
+import tempfile
+import numpy as np
+from layer_cache import LayerCache
+from stitching import blend_layer, layer_bounds
+
+def make_layer(x, y, w, h, value):
+    ref_rgb = np.full((h, w, 3), value, dtype=np.uint8)
+    alpha = np.full((h, w), 0.5, dtype=np.float32)
+    return x, y, ref_rgb, alpha
+
+def composite_from_scratch(base_img, layers):
+    result = base_img.copy()
+    for layer in layers:
+        blend_layer(result, layer)
+    return result
+
+def requested(parts):
+    return [
+        {'part': name, 'key': f"{name}-{value}", 'render': lambda spec=spec: make_layer(*spec)}
+        for name, value, spec in parts
+    ]
+
+def test_only_changed_layers_are_rendered():
+    base_img = np.full((200, 300, 3), 100, dtype=np.uint8)
+    hood = ('hood', 10, (20, 20, 100, 80, 10))
+    bumper = ('bumper', 200, (90, 60, 120, 80, 200))  # overlaps the hood
+    mirror = ('mirror', 50, (250, 150, 40, 40, 50))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with LayerCache(tmp) as cache:
+            cache.set_base(base_img)
+            composite, rendered = cache.update(requested([hood, bumper, mirror]), layer_bounds, blend_layer)
+            assert rendered == 3
+            expected = composite_from_scratch(base_img, [make_layer(*p[2]) for p in (hood, bumper, mirror)])
+            assert np.array_equal(composite, expected)
+
+        # A new session over the same cache swaps only the hood reference
+        new_hood = ('hood', 240, (20, 20, 100, 80, 240))
+        with LayerCache(tmp) as cache:
+            assert cache.has_base()
+            composite, rendered = cache.update(requested([new_hood, bumper, mirror]), layer_bounds, blend_layer)
+            assert rendered == 1
+            expected = composite_from_scratch(base_img, [make_layer(*p[2]) for p in (new_hood, bumper, mirror)])
+            assert np.array_equal(composite, expected)
+
+        # Dropping a part restores the base underneath it
+        with LayerCache(tmp) as cache:
+            composite, rendered = cache.update(requested([new_hood, bumper]), layer_bounds, blend_layer)
+            assert rendered == 0
+            expected = composite_from_scratch(base_img, [make_layer(*p[2]) for p in (new_hood, bumper)])
+            assert np.array_equal(composite, expected)
+
+if __name__ == "__main__":
+    test_only_changed_layers_are_rendered()
+    print("Layer cache tests passed")
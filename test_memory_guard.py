@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test script for per-stage peak memory tracking and the memory budget planner.
+"""
+
+import json
+import os
+import tempfile
+import cv2
+import numpy as np
+from memory_guard import (MemoryTracker, image_dimensions, plan_segmentation, plan_stitching,
+                          estimate_segment_mb, MIN_WORKING_SCALE)
+from sam_segmentation import segment_image, full_size_mask
+from inference_backends import StubSamPredictor
+from stitching import run_stitch
+
+def test_image_dimensions_read_headers_only():
+    with tempfile.TemporaryDirectory() as tmp:
+        image = np.zeros((37, 53, 3), dtype=np.uint8)
+        for extension in ('jpg', 'png', 'webp'):
+            path = os.path.join(tmp, f"image.{extension}")
+            cv2.imwrite(path, image)
+            assert image_dimensions(path) == (53, 37), extension
+        path = os.path.join(tmp, 'image.txt')
+        with open(path, 'w') as f:
+            f.write('not an image')
+        assert image_dimensions(path) is None
+
+def test_segmentation_plan_reduces_scale_to_fit():
+    assert plan_segmentation(4000, 3000, 10, budget_mb=4096, baseline_mb=0)['mode'] == 'full'
+
+    plan = plan_segmentation(4000, 3000, 10, budget_mb=100, baseline_mb=0)
+    assert plan['mode'] == 'reduced'
+    assert MIN_WORKING_SCALE < plan['scale'] < 1.0
+    assert plan['estimatedMb'] <= 100
+    assert plan['estimatedMb'] == round(estimate_segment_mb(4000, 3000, 10, plan['scale']), 1)
+
+    # Loaded models count against the budget
+    assert plan_segmentation(4000, 3000, 10, budget_mb=1000, baseline_mb=900)['mode'] == 'reduced'
+    assert plan_segmentation(4000, 3000, 10, budget_mb=1, baseline_mb=0)['scale'] == MIN_WORKING_SCALE
+
+def test_stitching_plan_prefers_tiles_before_reducing():
+    assert plan_stitching(4000, 3000, 2_000_000, budget_mb=4096, baseline_mb=0)['mode'] == 'full'
+    assert plan_stitching(4000, 3000, 2_000_000, budget_mb=90, baseline_mb=0)['mode'] == 'tiled'
+    plan = plan_stitching(4000, 3000, 2_000_000, budget_mb=40, baseline_mb=0)
+    assert plan['mode'] == 'reduced' and plan['scale'] < 1.0
+
+def test_tracker_reports_peak_and_largest_allocation():
+    with MemoryTracker('test') as tracker:
+        buffer = np.ones((20, 1024, 1024), dtype=np.uint8)
+        del buffer
+    report = tracker.report()
+    assert report['stage'] == 'test'
+    assert report['tracedPeakMb'] >= 19
+    assert report['peakRssMb'] >= report['startRssMb']
+    assert set(report) >= {'peakRssDeltaMb', 'largestAllocations'}
+
+    with MemoryTracker('test', trace=False) as tracker:
+        pass
+    assert 'tracedPeakMb' not in tracker.report()
+
+def test_reduced_scale_segmentation_keeps_full_resolution_outputs():
+    image = np.full((400, 600, 3), 128, dtype=np.uint8)
+    detections = [{'class_name': 'Hood', 'confidence': 0.9, 'bbox': [100.0, 80.0, 300.0, 240.0],
+                   'center_point': [200, 160]}]
+    full_parts, full_masks, full_modified = segment_image(image, detections, StubSamPredictor())
+    parts, masks, modified = segment_image(image, detections, StubSamPredictor(), scale=0.5)
+
+    assert masks[0].shape == (200, 300)
+    assert modified.shape == image.shape
+    assert parts[0]['bbox'] == detections[0]['bbox']
+    assert abs(parts[0]['mask_area'] - full_parts[0]['mask_area']) / full_parts[0]['mask_area'] < 0.05
+    restored = full_size_mask(masks[0], image.shape)
+    assert restored.shape == full_masks[0].shape
+    assert np.mean(restored != full_masks[0]) < 0.01
+    xs = [x for x, y in parts[0]['mask_contour']]
+    assert min(xs) >= 95 and max(xs) <= 305
+
+def test_stitch_under_a_tight_budget_renders_reduced():
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            os.makedirs(os.path.join('public', 'refs'))
+            ref = np.zeros((40, 60, 4), dtype=np.uint8)
+            ref[:, :, 1] = 200
+            ref[:, :, 3] = 255
+            cv2.imwrite(os.path.join('public', 'refs', 'part.png'), ref)
+            cv2.imwrite(os.path.join('public', 'base.jpg'), np.full((1000, 1600, 3), 90, dtype=np.uint8))
+
+            data = {
+                'segmentedImage': '/base.jpg',
+                'segmentedParts': [{'class_name': 'Hood', 'x': 100, 'y': 100, 'w': 600, 'h': 400}],
+                'references': [{'className': 'Hood', 'imagePath': '/refs/part.png'}],
+                'outputDir': '/out',
+                'output': {'derivatives': {}}
+            }
+            full = run_stitch(dict(data, outputDir='/full', memoryBudgetMb=1e6))
+            assert full['memoryPlan']['mode'] == 'full'
+            assert (full['width'], full['height']) == (1600, 1000)
+
+            # Whatever the process already holds, no budget leaves room for full resolution
+            reduced = run_stitch(dict(data, memoryBudgetMb=0))
+            assert reduced['memoryPlan']['mode'] == 'reduced'
+            assert reduced['width'] == round(1600 * reduced['memoryPlan']['scale'])
+            assert reduced['memory']['stage'] == 'stitch' and reduced['memory']['peakRssMb'] > 0
+            with open(os.path.join('public', 'out', 'output.json')) as f:
+                assert json.load(f)['memoryPlan']['mode'] == 'reduced'
+            stitched = cv2.imread(os.path.join('public', 'out', 'result.jpg'))
+            assert stitched[int(300 * reduced['memoryPlan']['scale']), int(400 * reduced['memoryPlan']['scale']), 1] > 150
+        finally:
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    test_image_dimensions_read_headers_only()
+    test_segmentation_plan_reduces_scale_to_fit()
+    test_stitching_plan_prefers_tiles_before_reducing()
+    test_tracker_reports_peak_and_largest_allocation()
+    test_reduced_scale_segmentation_keeps_full_resolution_outputs()
+    test_stitch_under_a_tight_budget_renders_reduced()
+    print("Memory guard tests passed")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Test script for the model manager, against a local HTTP server standing in
+for the model host.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import model_assets
+from model_assets import install, add, verify, resolve_model_path, load_manifest, PART_SUFFIX
+
+PAYLOAD = os.urandom(300 * 1024 + 17)
+DIGEST = hashlib.sha256(PAYLOAD).hexdigest()
+CHUNK = 64 * 1024
+
+class ModelHost(BaseHTTPRequestHandler):
+    """Serves server.payload, honouring Range/If-Range when server.ranges is set."""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.headers.get('Range'))
+            failing = server.fail_after is not None and len(server.requests) > server.fail_after
+        if failing:
+            self.send_error(503)
+            return
+        etag = '"' + hashlib.sha256(server.payload).hexdigest()[:16] + '"'
+        requested = self.headers.get('Range')
+        if server.ranges and requested and self.headers.get('If-Range', etag) == etag:
+            start, _, end = requested[len('bytes='):].partition('-')
+            start, end = int(start), min(int(end), len(server.payload) - 1)
+            body = server.payload[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(server.payload)}')
+        else:
+            body = server.payload
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def with_host(ranges=True):
+    def decorate(test):
+        def run():
+            server = ThreadingHTTPServer(('127.0.0.1', 0), ModelHost)
+            server.payload, server.ranges, server.fail_after = PAYLOAD, ranges, None
+            server.requests, server.lock = [], threading.Lock()
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            retries = model_assets.RETRIES
+            model_assets.RETRIES = 1
+            try:
+                with tempfile.TemporaryDirectory() as tmp:
+                    test(server, f'http://127.0.0.1:{server.server_address[1]}/sam_test.pth', tmp)
+            finally:
+                model_assets.RETRIES = retries
+                server.shutdown()
+                server.server_close()
+        run.__name__ = test.__name__
+        return run
+    return decorate
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+@with_host()
+def test_parallel_ranges_install_and_record_the_model(server, url, tmp):
+    entry = install('sam_test', url, DIGEST, directory=tmp, chunk_size=CHUNK)
+    path = os.path.join(tmp, 'sam_test.pth')
+    assert read(path) == PAYLOAD
+    assert entry['sha256'] == DIGEST and entry['size'] == len(PAYLOAD)
+    assert load_manifest(tmp)['models']['sam_test']['filename'] == 'sam_test.pth'
+    # The probe and one request per chunk
+    assert len(server.requests) == 1 + 5
+    assert sorted(os.listdir(tmp)) == ['manifest.json', 'manifest.json.lock', 'sam_test.pth', 'sam_test.pth.lock']
+    # Installed and still matching: nothing is downloaded
+    install('sam_test', directory=tmp, chunk_size=CHUNK)
+    assert len(server.requests) == 6
+
+@with_host()
+def test_interrupted_download_resumes_missing_chunks(server, url, tmp):
+    server.fail_after = 3
+    try:
+        install('sam_test', url, DIGEST, directory=tmp, chunk_size=CHUNK, connections=1)
+        assert False, "the download should have failed"
+    except OSError:
+        pass
+    assert not os.path.exists(os.path.join(tmp, 'sam_test.pth'))
+    assert os.path.exists(os.path.join(tmp, 'sam_test.pth' + PART_SUFFIX))
+    server.fail_after = None
+    server.requests.clear()
+    install('sam_test', url, DIGEST, directory=tmp, chunk_size=CHUNK, connections=1)
+    # Two chunks were already on disk
+    assert len(server.requests) == 1 + 3
+    assert read(os.path.join(tmp, 'sam_test.pth')) == PAYLOAD
+    assert not os.path.exists(os.path.join(tmp, 'sam_test.pth' + PART_SUFFIX))
+
+@with_host()
+def test_checksum_mismatch_installs_nothing(server, url, tmp):
+    try:
+        install('sam_test', url, '0' * 64, directory=tmp, chunk_size=CHUNK)
+        assert False, "the checksum should not have matched"
+    except ValueError as e:
+        assert 'Checksum mismatch' in str(e)
+    assert sorted(name for name in os.listdir(tmp) if not name.endswith('.lock')) == []
+
+@with_host(ranges=False)
+def test_servers_without_ranges_get_one_request(server, url, tmp):
+    entry = install('sam_test', url, directory=tmp, chunk_size=CHUNK)
+    assert entry['sha256'] == DIGEST
+    assert len(server.requests) == 2
+
+@with_host()
+def test_catalogue_checksum_rejects_a_substituted_file(server, url, tmp):
+    # Right length, wrong contents: only the published checksum can tell
+    server.payload = bytes(len(PAYLOAD))
+    model_assets.CATALOGUE['sam_test'] = {'filename': 'sam_test.pth', 'url': url, 'sha256': DIGEST}
+    # A digest recorded on an earlier install does not override the published one
+    model_assets.record('sam_test', {'filename': 'sam_test.pth', 'url': url,
+                                     'sha256': hashlib.sha256(server.payload).hexdigest()}, tmp)
+    try:
+        install('sam_test', directory=tmp, chunk_size=CHUNK)
+        assert False, "the substituted file should not have installed"
+    except ValueError as e:
+        assert 'Checksum mismatch' in str(e)
+    finally:
+        del model_assets.CATALOGUE['sam_test']
+    assert not os.path.exists(os.path.join(tmp, 'sam_test.pth'))
+
+def test_catalogue_models_have_published_checksums():
+    for name, entry in model_assets.CATALOGUE.items():
+        assert len(entry['sha256']) == 64 and int(entry['sha256'], 16) >= 0, name
+
+def test_resolve_prefers_manifest_and_rejects_truncated_files():
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, 'legacy.pt')
+        with open(legacy, 'wb') as f:
+            f.write(PAYLOAD)
+        models = os.path.join(tmp, 'models')
+        assert resolve_model_path('detector', legacy, models) == legacy
+        add('detector', legacy, models)
+        installed = os.path.join(models, 'legacy.pt')
+        assert resolve_model_path('detector', legacy, models) == installed
+        assert verify(directory=models) == {'detector': 'ok'}
+        with open(installed, 'r+b') as f:
+            f.truncate(1000)
+        try:
+            resolve_model_path('detector', legacy, models)
+            assert False, "a truncated model should not resolve"
+        except ValueError:
+            pass
+        assert verify(['detector', 'other'], models) == {'detector': 'size mismatch', 'other': 'missing'}
+
+if __name__ == "__main__":
+    test_parallel_ranges_install_and_record_the_model()
+    test_interrupted_download_resumes_missing_chunks()
+    test_checksum_mismatch_installs_nothing()
+    test_servers_without_ranges_get_one_request()
+    test_catalogue_checksum_rejects_a_substituted_file()
+    test_catalogue_models_have_published_checksums()
+    test_resolve_prefers_manifest_and_rejects_truncated_files()
+    print("Model asset tests passed")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Test script for prepared models: which prepared copy is current, and
+building SAM from mapped weights.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import types
+from model_prep import (build_sam, current_prepared, find_prepared_sam, prepare_sam, prepared_path, write_info,
+                        FUSED_SUFFIX, PREPARED_SUFFIXES)
+
+def write(path, data=b'weights'):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def test_prepared_copy_is_used_only_while_the_source_matches():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'car_parts_detector.pt')
+        write(source)
+        assert current_prepared(source, FUSED_SUFFIX) is None
+        output = prepared_path(source, FUSED_SUFFIX)
+        assert output == os.path.join(tmp, 'car_parts_detector.fused.pt')
+        write(output, b'fused')
+        write_info(output, source, fused=True)
+        assert current_prepared(source, FUSED_SUFFIX) == output
+
+        # A replaced checkpoint makes the prepared copy stale
+        time.sleep(0.01)
+        write(source, b'retrained weights')
+        assert current_prepared(source, FUSED_SUFFIX) is None
+
+def test_prepared_copy_alone_is_enough():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'sam_vit_l_0b3195.pth')
+        write(source)
+        output = prepared_path(source, PREPARED_SUFFIXES['safetensors'])
+        write(output)
+        write_info(output, source, format='safetensors')
+        os.unlink(source)
+        assert find_prepared_sam(source) == (output, 'safetensors')
+
+def test_missing_prepared_file_is_ignored():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'sam_vit_l_0b3195.pth')
+        write(source)
+        output = prepared_path(source, PREPARED_SUFFIXES['mmap'])
+        write(output)
+        write_info(output, source, format='mmap')
+        assert find_prepared_sam(source) == (output, 'mmap')
+        os.unlink(output)
+        assert find_prepared_sam(source) == (None, None)
+
+def fake_segment_anything(torch):
+    """A segment_anything stand-in whose registry builds a tiny SAM-shaped model."""
+    class TinySam(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.image_encoder = torch.nn.Linear(4, 3)
+            self.mask_decoder = torch.nn.Sequential(torch.nn.Linear(3, 2), torch.nn.LayerNorm(2))
+            # Like SAM's normalisation constants: buffers outside the state dict
+            self.register_buffer('pixel_mean', torch.tensor([123.675, 116.28, 103.53]), persistent=False)
+            self.register_buffer('pixel_std', torch.tensor([58.395, 57.12, 57.375]), persistent=False)
+
+        def forward(self, x):
+            return self.mask_decoder(self.image_encoder(x) - self.pixel_mean)
+
+    def build(checkpoint=None):
+        model = TinySam()
+        if checkpoint is not None:
+            model.load_state_dict(torch.load(checkpoint, weights_only=True))
+        return model
+
+    module = types.ModuleType('segment_anything')
+    module.sam_model_registry = {'vit_l': build}
+    return module
+
+def test_build_sam_maps_weights_and_unsaved_buffers():
+    try:
+        import torch
+    except ImportError:
+        print("torch not installed, skipping prepared SAM build test")
+        return
+    fake = fake_segment_anything(torch)
+    saved = sys.modules.get('segment_anything')
+    sys.modules['segment_anything'] = fake
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = fake.sam_model_registry['vit_l']()
+            checkpoint = os.path.join(tmp, 'sam_vit_l_0b3195.pth')
+            torch.save(source.state_dict(), checkpoint)
+            assert 'pixel_mean' not in source.state_dict()
+
+            output = prepare_sam(checkpoint, 'mmap')
+            assert find_prepared_sam(checkpoint) == (output, 'mmap')
+            sam = build_sam(output, 'mmap')
+
+            tensors = dict(sam.named_parameters(), **dict(sam.named_buffers()))
+            assert set(tensors) == set(dict(source.named_parameters(), **dict(source.named_buffers())))
+            assert not any(tensor.is_meta for tensor in tensors.values())
+            for name, tensor in dict(source.named_parameters(), **dict(source.named_buffers())).items():
+                assert torch.equal(tensors[name], tensor), name
+            assert not sam.training
+            x = torch.ones(2, 4)
+            with torch.no_grad():
+                assert torch.allclose(sam(x), source.eval()(x))
+    finally:
+        if saved is None:
+            del sys.modules['segment_anything']
+        else:
+            sys.modules['segment_anything'] = saved
+
+if __name__ == "__main__":
+    test_prepared_copy_is_used_only_while_the_source_matches()
+    test_prepared_copy_alone_is_enough()
+    test_missing_prepared_file_is_ignored()
+    test_build_sam_maps_weights_and_unsaved_buffers()
+    print("Model preparation tests passed")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Test script for indexed multi-instance part matching.
+"""
+
+import os
+import tempfile
+import cv2
+import numpy as np
+import stitching
+from stitching import blend_layer, blend_layers, blend_waves, collect_part_jobs, stitch_references
+
+def make_part(class_name, x, y):
+    return {
+        'class_name': class_name, 'x': x, 'y': y, 'w': 20, 'h': 20,
+        'mask_contour': [], 'mask_path': None
+    }
+
+def test_reference_applies_to_every_instance():
+    data = {
+        'segmentedParts': [
+            make_part('Wheel', 0, 0), make_part('Hood', 50, 0),
+            make_part('Wheel', 100, 0), make_part('Wheel', 150, 0)
+        ],
+        'references': [
+            {'className': 'Wheel', 'imagePath': '/Wheel/1.png'},
+            {'className': 'Hood', 'imagePath': '/Hood/1.png'},
+            {'className': 'Wheel', 'imagePath': '/Wheel/2.png', 'instances': [3]},
+            {'className': 'Mirror', 'imagePath': '/Mirror/1.png'}
+        ]
+    }
+    jobs = collect_part_jobs(data)
+    assert [key for key, _, _ in jobs] == ['Wheel#0', 'Wheel#2', 'Wheel#3', 'Hood#1']
+    refs = {key: ref['imagePath'] for key, _, ref in jobs}
+    assert refs['Wheel#0'] == '/Wheel/1.png'
+    assert refs['Wheel#3'] == '/Wheel/2.png'
+
+def test_blend_waves_keep_overlaps_ordered():
+    rects = [(0, 0, 10, 10), (20, 0, 30, 10), (5, 5, 25, 15), (40, 0, 50, 10)]
+    assert blend_waves(rects) == [[0, 1, 3], [2]]
+
+def test_parallel_blend_matches_sequential():
+    from concurrent.futures import ThreadPoolExecutor
+    base_img = np.full((60, 120, 3), 100, dtype=np.uint8)
+    layers = []
+    for i, x in enumerate([0, 15, 40, 70, 90]):
+        ref_rgb = np.full((30, 25, 3), 40 * i, dtype=np.uint8)
+        alpha = np.full((30, 25), 0.6, dtype=np.float32)
+        layers.append((x, 10 + i, ref_rgb, alpha))
+
+    expected = base_img.copy()
+    for layer in layers:
+        blend_layer(expected, layer)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        result = blend_layers(base_img.copy(), layers, executor)
+    assert np.array_equal(result, expected)
+
+def test_instances_sharing_an_unprepared_reference_match():
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            os.makedirs(os.path.join('public', 'Wheel'))
+            # Dark wheel on a white studio background, not prepared yet
+            ref = np.full((800, 800, 3), 255, dtype=np.uint8)
+            cv2.circle(ref, (400, 400), 240, (30, 30, 30), -1)
+            cv2.imwrite(os.path.join('public', 'Wheel', 'shared.png'), ref)
+            data = {
+                'segmentedParts': [make_part('Wheel', x, 0) for x in (0, 30, 60, 90)],
+                'references': [{'className': 'Wheel', 'imagePath': '/Wheel/shared.png'}]
+            }
+            base_img = np.full((40, 120, 3), 150, dtype=np.uint8)
+            # Render the instances in parallel even on a single-core machine
+            worker_threads = stitching.worker_threads
+            stitching.worker_threads = lambda: 4
+            try:
+                result = stitch_references(base_img, data)
+            finally:
+                stitching.worker_threads = worker_threads
+            first = result[0:20, 0:20]
+            for x in (30, 60, 90):
+                assert np.array_equal(result[0:20, x:x + 20], first)
+            # The white background was removed, not composited over the base
+            assert first[0, 0].tolist() == [150, 150, 150]
+            assert not np.array_equal(first, base_img[0:20, 0:20])
+            # One prepared asset and no temp files left behind
+            names = sorted(os.listdir(os.path.join('public', 'Wheel')))
+            assert len(names) == 2 and names[0].endswith('.rgba.png') and names[1] == 'shared.png'
+        finally:
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    test_reference_applies_to_every_instance()
+    test_blend_waves_keep_overlaps_ordered()
+    test_parallel_blend_matches_sequential()
+    test_instances_sharing_an_unprepared_reference_match()
+    print("Multi-instance tests passed")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Test script for configurable result encoding and derivative generation.
+"""
+
+import os
+import tempfile
+import cv2
+import numpy as np
+from stitching import save_result
+
+def test_save_result_writes_derivatives():
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            result_img = np.random.default_rng(0).integers(0, 255, (1500, 2000, 3), dtype=np.uint8)
+            data = {
+                'outputDir': '/stitching_results/test',
+                'output': {'format': 'webp', 'quality': 70, 'maxDimension': 1600}
+            }
+            output = save_result(result_img, data, 'full')
+
+            assert output['stitchedImageUrl'] == '/stitching_results/test/result.webp'
+            assert (output['width'], output['height']) == (1600, 1200)
+            assert set(output['derivatives']) == {'thumbnail', 'preview'}
+            thumbnail = output['derivatives']['thumbnail']
+            assert thumbnail['url'] == '/stitching_results/test/thumbnail.webp'
+            assert (thumbnail['width'], thumbnail['height']) == (320, 240)
+
+            written = cv2.imread(os.path.join('public', 'stitching_results', 'test', 'thumbnail.webp'))
+            assert written.shape == (240, 320, 3)
+        finally:
+            os.chdir(cwd)
+
+def test_small_results_reuse_main_image():
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            result_img = np.zeros((400, 600, 3), dtype=np.uint8)
+            data = {'outputDir': '/stitching_results/small', 'output': {'progressive': True, 'optimize': True}}
+            output = save_result(result_img, data, 'full')
+            assert output['stitchedImageUrl'] == '/stitching_results/small/result.jpg'
+            assert output['derivatives']['thumbnail']['url'] == '/stitching_results/small/thumbnail.jpg'
+            assert output['derivatives']['preview']['url'] == output['stitchedImageUrl']
+        finally:
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    test_save_result_writes_derivatives()
+    test_small_results_reuse_main_image()
+    print("Output encoding tests passed")
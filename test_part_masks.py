@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Test script for stitching with the stored SAM masks instead of contours.
+"""
+
+import os
+import tempfile
+import cv2
+import numpy as np
+from stitching import load_part_mask, render_part_layer, scale_part_info
+
+def make_ring_mask(path):
+    # A ring: the external contour alone would fill the hole
+    mask = np.zeros((200, 300), dtype=np.uint8)
+    cv2.circle(mask, (150, 100), 60, 255, -1)
+    cv2.circle(mask, (150, 100), 25, 0, -1)
+    cv2.imwrite(path, mask)
+
+def test_mask_keeps_holes():
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            mask_path = os.path.join(tmp, 'part_mask.jpg')
+            make_ring_mask(mask_path)
+
+            x, y, mask = load_part_mask(mask_path)
+            assert (x, y) == (90, 40)
+            assert mask.shape == (121, 121)
+            assert mask[60, 60] == 0, "hole should stay transparent"
+            assert mask[60, 10] == 255
+            assert os.listdir(os.path.join(tmp, 'tmp', 'mask_cache'))
+
+            part_info = {'x': 90, 'y': 40, 'w': 121, 'h': 121, 'contour': [], 'mask_path': mask_path}
+            ref_img = np.full((50, 50, 3), 200, dtype=np.uint8)
+            lx, ly, ref_rgb, alpha = render_part_layer(ref_img, part_info)
+            assert (lx, ly) == (90, 40)
+            assert alpha[60, 60] == 0.0 and alpha[60, 10] == 1.0
+
+            # Preview scaling resizes the cached crop
+            lx, ly, ref_rgb, alpha = render_part_layer(ref_img, scale_part_info(part_info, 0.5))
+            assert (lx, ly) == (45, 20)
+            assert alpha.shape == (60, 60)
+
+            # Without a stored mask the contour is rasterized as before
+            part_info['mask_path'] = os.path.join(tmp, 'missing_mask.jpg')
+            part_info['contour'] = [[90, 40], [210, 40], [210, 160], [90, 160]]
+            lx, ly, ref_rgb, alpha = render_part_layer(ref_img, part_info)
+            assert alpha[60, 60] == 1.0
+        finally:
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    test_mask_keeps_holes()
+    print("Part mask tests passed")
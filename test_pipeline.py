@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test script for the single-process classify -> detect -> segment -> stitch pipeline.
+"""
+
+import os
+import tempfile
+import cv2
+import numpy as np
+from pipeline import run_job, load_models
+from inference_backends import create_backend
+
+class StubTensor:
+    def __init__(self, values):
+        self.values = np.array(values)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+class StubBox:
+    def __init__(self, bbox, class_id, confidence):
+        self.xyxy = [StubTensor(bbox)]
+        self.cls = [StubTensor(class_id)]
+        self.conf = [StubTensor(confidence)]
+
+class StubResult:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+class StubDetector:
+    """Detects one fixed hood box, like ultralytics results."""
+    names = {0: 'Hood'}
+
+    def __call__(self, image, conf=None, iou=None, verbose=False):
+        return [StubResult([StubBox([40, 30, 160, 110], 0, 0.9)])]
+
+def stub_models():
+    """The real ultralytics post-processing over StubDetector, and the stub segmenter."""
+    detector = create_backend('detector', 'ultralytics', load=False)
+    detector.model = StubDetector()
+    return {'detector': detector, 'segmenter': create_backend('segmenter', 'stub')}
+
+def test_job_runs_in_memory_and_writes_ui_artifacts():
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            os.makedirs(os.path.join('public', 'refs'))
+            ref = np.zeros((50, 50, 3), dtype=np.uint8)
+            ref[:, :, 1] = 220
+            cv2.imwrite(os.path.join('public', 'refs', 'hood.png'), ref)
+            cv2.imwrite('car.jpg', np.full((200, 300, 3), 128, dtype=np.uint8))
+
+            models = stub_models()
+            job = {'jobId': 'job1', 'imagePath': 'car.jpg',
+                   'references': [{'className': 'Hood', 'imagePath': '/refs/hood.png'}]}
+            result = run_job(job, models)
+
+            assert result['success'], result
+            assert result['segmentedImageUrl'] == '/segments/job1/modified.jpg'
+            part = result['segmentedParts'][0]
+            assert (part['x'], part['y'], part['w'], part['h']) == (40, 30, 120, 80)
+            assert part['mask_path'] == '/segments/job1/Hood_0_mask.jpg'
+            assert sorted(os.listdir(os.path.join('public', 'segments', 'job1'))) == [
+                'Hood_0_0.90.jpg', 'Hood_0_mask.jpg', 'modified.jpg', 'original.jpg', 'segmentation_results.json']
+
+            stitched = cv2.imread(os.path.join('public', result['stitching']['stitchedImageUrl'].lstrip('/')))
+            assert stitched[70, 100, 1] > 200, "reference is placed inside the mask"
+            assert stitched[5, 5, 1] < 140, "outside the mask keeps the base"
+            assert set(result['timings']) >= {'decode', 'detect', 'segment', 'stitch', 'total'}
+            assert result['backends']['segmenter']['backend'] == 'stub'
+        finally:
+            os.chdir(cwd)
+
+def test_load_models_uses_configured_backends():
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            cv2.imwrite('car.jpg', np.full((200, 300, 3), 40, dtype=np.uint8))
+            models = load_models(backends={'classifier': 'stub', 'detector': 'stub', 'segmenter': 'stub'})
+            assert sorted(models) == ['classifier', 'detector', 'segmenter']
+
+            result = run_job({'jobId': 'dark', 'imagePath': 'car.jpg'}, models)
+            assert not result['success'] and 'car' in result['error']
+
+            result = run_job({'jobId': 'any', 'imagePath': 'car.jpg', 'requireCar': False}, models)
+            assert result['success'], result
+            assert len(result['segmentedParts']) == 6
+        finally:
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    test_job_runs_in_memory_and_writes_ui_artifacts()
+    test_load_models_uses_configured_backends()
+    print("Pipeline tests passed")
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test script for the offline reference background-removal cache.
+"""
+
+import os
+import tempfile
+import threading
+import cv2
+import numpy as np
+from reference_prep import prepare_reference, find_prepared_reference, remove_background
+
+def make_reference(path):
+    # Dark part on a white studio background, with a bright highlight inside
+    img = np.full((120, 160, 3), 255, dtype=np.uint8)
+    cv2.rectangle(img, (30, 30), (130, 90), (40, 40, 160), -1)
+    cv2.circle(img, (80, 60), 10, (255, 255, 255), -1)
+    cv2.imwrite(path, img)
+
+def test_remove_background():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ref.jpg')
+        make_reference(path)
+        rgba = remove_background(cv2.imread(path))
+        assert rgba.shape == (120, 160, 4)
+        assert rgba[5, 5, 3] < 10, "border background should be transparent"
+        assert rgba[40, 40, 3] > 245, "part should stay opaque"
+        assert rgba[60, 80, 3] > 245, "interior highlight should stay opaque"
+
+def test_prepare_reference_is_cached():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ref.jpg')
+        make_reference(path)
+        assert find_prepared_reference(path) is None
+
+        prepared = prepare_reference(path)
+        assert os.path.dirname(prepared) == tmp
+        assert prepared.endswith('.rgba.png')
+        assert find_prepared_reference(path) == prepared
+        mtime = os.path.getmtime(prepared)
+        assert prepare_reference(path) == prepared
+        assert os.path.getmtime(prepared) == mtime
+
+        # New contents get a new asset and the stale one is removed
+        img = cv2.imread(path)
+        img[0:10, 0:10] = 0
+        cv2.imwrite(path, img)
+        updated = prepare_reference(path)
+        assert updated != prepared
+        assert not os.path.exists(prepared)
+
+def test_threads_preparing_one_reference_all_succeed():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ref.jpg')
+        make_reference(path)
+        # Large enough that the threads overlap in background removal
+        cv2.imwrite(path, cv2.resize(cv2.imread(path), (1600, 1200)))
+        barrier = threading.Barrier(4)
+        results, errors = [], []
+
+        def prepare():
+            barrier.wait()
+            try:
+                results.append(prepare_reference(path))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=prepare) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert len(set(results)) == 1
+        assert sorted(os.listdir(tmp)) == sorted(['ref.jpg', os.path.basename(results[0])])
+
+if __name__ == "__main__":
+    test_remove_background()
+    test_prepare_reference_is_cached()
+    test_threads_preparing_one_reference_all_succeed()
+    print("Reference preparation tests passed")
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared-memory decoded-image registry.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import cv2
+import numpy as np
+import shared_images
+from shared_images import ImageRegistry, open_image, publish_encoded, segment_name, image_key
+from stitching import decode_flags
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def with_registry(test):
+    def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            with ImageRegistry(os.path.join(tmp, 'registry.sqlite3')) as registry:
+                try:
+                    test(registry, tmp)
+                finally:
+                    registry.sweep(idle_ttl=0)
+    run.__name__ = test.__name__
+    return run
+
+def write_image(directory, name='car.png', value=7, shape=(40, 60, 3)):
+    path = os.path.join(directory, name)
+    image = np.full(shape, value, dtype=np.uint8)
+    image[5:10, 5:10] = 200
+    cv2.imwrite(path, image)
+    return path
+
+def acquire_in_subprocess(registry, path, release=True):
+    """Acquire in a separate process; prints whether it attached and the pixel sum."""
+    code = (
+        "import sys\n"
+        "from shared_images import ImageRegistry\n"
+        "registry = ImageRegistry(sys.argv[1]).__enter__()\n"
+        "shared = registry.acquire(sys.argv[2])\n"
+        "print(shared.attached, int(shared.array.sum()))\n"
+        "if sys.argv[3] == '1':\n"
+        "    shared.release()\n"
+    )
+    output = subprocess.run([sys.executable, '-c', code, registry.path, path, '1' if release else '0'],
+                            cwd=HERE, capture_output=True, text=True, check=True)
+    attached, total = output.stdout.split()
+    return attached == 'True', int(total)
+
+@with_registry
+def test_second_process_attaches_instead_of_decoding(registry, tmp):
+    path = write_image(tmp)
+    with registry.acquire(path) as first:
+        assert first.shared and not first.attached
+        assert not first.array.flags.writeable
+        attached, total = acquire_in_subprocess(registry, path)
+    assert attached
+    assert total == int(cv2.imread(path).sum())
+    assert registry.stats()['holders'] == 0
+
+@with_registry
+def test_unreferenced_images_stay_until_idle(registry, tmp):
+    path = write_image(tmp)
+    registry.acquire(path).release()
+    assert registry.sweep() == []
+    with registry.acquire(path) as again:
+        assert again.attached
+    assert registry.sweep(idle_ttl=0) == [segment_name(image_key(path))]
+    assert registry.stats()['images'] == 0
+
+@with_registry
+def test_references_of_dead_processes_are_dropped(registry, tmp):
+    path = write_image(tmp)
+    acquire_in_subprocess(registry, path, release=False)
+    assert registry.stats()['holders'] == 1
+    # The holder is gone, so its reference no longer keeps the image
+    assert registry.sweep(idle_ttl=0) == [segment_name(image_key(path))]
+
+@with_registry
+def test_budget_evicts_least_recently_used(registry, tmp):
+    first = write_image(tmp, 'first.png', 1)
+    second = write_image(tmp, 'second.png', 2)
+    registry.acquire(first).release()
+    registry.budget = 40 * 60 * 3 + 1
+    with registry.acquire(second) as shared:
+        assert shared.shared
+    stats = registry.stats()
+    assert stats['images'] == 1 and stats['bytes'] == 40 * 60 * 3
+
+@with_registry
+def test_rewritten_file_is_decoded_again(registry, tmp):
+    path = write_image(tmp, value=1)
+    registry.acquire(path).release()
+    os.unlink(path)
+    write_image(tmp, value=2, shape=(20, 20, 3))
+    with registry.acquire(path) as shared:
+        assert not shared.attached
+        assert shared.array.shape == (20, 20, 3)
+
+@with_registry
+def test_release_sweeps_images_left_idle(registry, tmp):
+    first = write_image(tmp, 'first.png', 1)
+    registry.acquire(first).release()
+    registry.idle_ttl = -1
+    registry.acquire(write_image(tmp, 'second.png', 2)).release()
+    assert registry.stats()['images'] == 0
+
+def test_written_base_is_attached_by_the_stitcher():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'modified.jpg')
+        ok, encoded = cv2.imencode('.jpg', np.random.default_rng(0).integers(0, 255, (30, 50, 3), dtype=np.uint8))
+        with open(path, 'wb') as f:
+            f.write(encoded.tobytes())
+        os.environ[shared_images.REGISTRY_ENV] = os.path.join(tmp, 'registry.sqlite3')
+        shared_images._registry = None
+        try:
+            publish_encoded(path, encoded)
+            registry = shared_images.default_registry()
+            assert registry.stats()['images'] == 1
+            # The stitcher opens JPEG bases with the flags the image was published under
+            assert decode_flags(path) == cv2.IMREAD_COLOR
+            attached, total = acquire_in_subprocess(registry, path)
+            assert attached
+            assert total == int(cv2.imread(path).sum())
+        finally:
+            shared_images.default_registry().sweep(idle_ttl=0)
+            shared_images._registry.__exit__(None, None, None)
+            shared_images._registry = None
+            del os.environ[shared_images.REGISTRY_ENV]
+
+def test_disabled_sharing_decodes_privately():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_image(tmp)
+        os.environ[shared_images.SHARED_IMAGES_ENV] = '0'
+        try:
+            with open_image(path) as shared:
+                assert not shared.shared
+                assert shared.array.flags.writeable
+            with open_image(os.path.join(tmp, 'missing.png')) as missing:
+                assert missing.array is None
+        finally:
+            del os.environ[shared_images.SHARED_IMAGES_ENV]
+
+if __name__ == "__main__":
+    test_second_process_attaches_instead_of_decoding()
+    test_unreferenced_images_stay_until_idle()
+    test_references_of_dead_processes_are_dropped()
+    test_budget_evicts_least_recently_used()
+    test_rewritten_file_is_decoded_again()
+    test_release_sweeps_images_left_idle()
+    test_written_base_is_attached_by_the_stitcher()
+    test_disabled_sharing_decodes_privately()
+    print("Shared image tests passed")
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Test script for the low-resolution stitching preview.
+"""
+
+import numpy as np
+from stitching import downscale_for_preview, scale_part_info, stitch_part_with_mask
+
+def test_downscale_for_preview():
+    base_img = np.zeros((3000, 4000, 3), dtype=np.uint8)
+    preview, scale = downscale_for_preview(base_img, 1024)
+    assert preview.shape == (768, 1024, 3)
+    assert abs(scale - 0.256) < 1e-6
+
+    small = np.zeros((300, 400, 3), dtype=np.uint8)
+    preview, scale = downscale_for_preview(small, 1024)
+    assert preview is small and scale == 1.0
+
+def test_preview_matches_full_placement():
+    part_info = {
+        'x': 400, 'y': 200, 'w': 800, 'h': 400,
+        'contour': [[400, 200], [1200, 200], [1200, 600], [400, 600]]
+    }
+    base_img = np.full((1000, 2000, 3), 128, dtype=np.uint8)
+    ref_img = np.full((50, 50, 3), 255, dtype=np.uint8)
+
+    preview_base, scale = downscale_for_preview(base_img, 500)
+    scaled = scale_part_info(part_info, scale)
+    assert scaled['contour'] == [[100, 50], [300, 50], [300, 150], [100, 150]]
+
+    preview = stitch_part_with_mask(preview_base, ref_img, scaled, "test_output", "test_part")
+    assert preview.shape == (250, 500, 3)
+    assert (preview[100, 200] == 255).all()
+    assert (preview[20, 20] == 128).all()
+
+if __name__ == "__main__":
+    test_downscale_for_preview()
+    test_preview_matches_full_placement()
+    print("Stitching preview tests passed")
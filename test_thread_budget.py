@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Test script for the per-worker CPU thread budget.
+"""
+
+import os
+import cv2
+import thread_budget
+from thread_budget import (apportion, available_cpus, demand_weights, plan_threads, parse_cpus, format_cpus,
+                           configure_worker, worker_threads, CORES_ENV, THREADS_ENV, CPUS_ENV, THREAD_ENV_VARS)
+
+def restoring_budget(test):
+    """Run a test that configures this process, then undo the configuration."""
+    def run():
+        saved = {name: os.environ.get(name)
+                 for name in THREAD_ENV_VARS + (THREADS_ENV, CPUS_ENV, CORES_ENV, 'TF_NUM_INTEROP_THREADS')}
+        saved_cv2 = cv2.getNumThreads()
+        try:
+            test()
+        finally:
+            thread_budget._threads = None
+            cv2.setNumThreads(saved_cv2)
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+    run.__name__ = test.__name__
+    return run
+
+def test_cpu_lists_round_trip():
+    assert parse_cpus('0-3,6') == [0, 1, 2, 3, 6]
+    assert format_cpus([6, 0, 1, 2, 3]) == '0-3,6'
+    assert format_cpus([1, 3]) == '1,3'
+
+def test_apportion_is_proportional_and_complete():
+    assert apportion(8, [1, 2, 3, 2]) == [1, 2, 3, 2]
+    assert sum(apportion(7, [1, 2, 3])) == 7
+    assert apportion(3, [10, 1, 1]) == [1, 1, 1]
+
+def test_plan_gives_each_worker_its_own_cores():
+    plan = plan_threads({'detect': 1, 'segment': 2}, cpus=list(range(16)))
+    assert [slot['stage'] for slot in plan] == ['detect', 'segment', 'segment']
+    assert sum(slot['threads'] for slot in plan) == 16
+    assert plan[1]['threads'] > plan[0]['threads']
+    used = [cpu for slot in plan for cpu in slot['cpus']]
+    assert sorted(used) == list(range(16))
+    for slot in plan:
+        assert len(slot['cpus']) == slot['threads']
+
+def test_more_workers_than_cores_get_one_thread_each():
+    plan = plan_threads({'classify': 3}, cpus=[0, 1])
+    assert [slot['threads'] for slot in plan] == [1, 1, 1]
+    assert [slot['cpus'] for slot in plan] == [[0], [1], [0]]
+
+def test_idle_stages_leave_their_cores_to_busy_ones():
+    workers = {'classify': 1, 'detect': 1, 'segment': 1, 'stitch': 2, 'pipeline': 1}
+    assert demand_weights(workers, set()) is None
+    weights = demand_weights(workers, {'detect', 'segment', 'stitch'})
+    plan = plan_threads(workers, cpus=list(range(16)), weights=weights)
+    threads = {slot['stage']: slot['threads'] for slot in plan}
+    assert sum(slot['threads'] for slot in plan) == 16
+    static = {slot['stage']: slot['threads'] for slot in plan_threads(workers, cpus=list(range(16)))}
+    assert threads['segment'] > static['segment']
+    assert threads['segment'] > threads['pipeline'] >= 1
+
+@restoring_budget
+def test_configure_worker_sets_every_pool():
+    config = configure_worker('detect', threads=2)
+    assert config['threads'] == 2 and config['cpus'] is None
+    assert cv2.getNumThreads() == 2
+    assert worker_threads() == 2
+    assert all(os.environ[name] == '2' for name in THREAD_ENV_VARS)
+
+@restoring_budget
+def test_lone_process_uses_every_cpu_unless_cores_are_shared():
+    for name in (THREADS_ENV, CPUS_ENV, CORES_ENV):
+        os.environ.pop(name, None)
+    assert configure_worker('segment')['threads'] == len(available_cpus())
+    thread_budget._threads = None
+    del os.environ[THREADS_ENV]
+    # With the node's cores shared out, each stage takes its share next to its peers
+    os.environ[CORES_ENV] = '8'
+    cpus = available_cpus()
+    expected = next(slot['threads'] for slot in plan_threads(thread_budget.DEFAULT_PEERS, cpus)
+                    if slot['stage'] == 'segment')
+    assert configure_worker('segment')['threads'] == expected
+
+if __name__ == "__main__":
+    test_cpu_lists_round_trip()
+    test_apportion_is_proportional_and_complete()
+    test_plan_gives_each_worker_its_own_cores()
+    test_more_workers_than_cores_get_one_thread_each()
+    test_idle_stages_leave_their_cores_to_busy_ones()
+    test_configure_worker_sets_every_pool()
+    test_lone_process_uses_every_cpu_unless_cores_are_shared()
+    print("Thread budget tests passed")
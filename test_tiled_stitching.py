@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Test script for band-by-band compositing of large base images.
+"""
+
+import os
+import tempfile
+import cv2
+import numpy as np
+import stitching
+from stitching import run_stitch, stitch_references, stitch_references_tiled
+
+def test_tiled_matches_full_frame():
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            os.makedirs(os.path.join('public', 'refs'))
+            ref = np.zeros((40, 60, 4), dtype=np.uint8)
+            ref[:, :, 1] = 200
+            ref[:, :, 3] = 180
+            cv2.imwrite(os.path.join('public', 'refs', 'part.png'), ref)
+
+            data = {
+                'segmentedParts': [
+                    {'class_name': 'Hood', 'x': 10, 'y': 5, 'w': 150, 'h': 170},
+                    {'class_name': 'Door', 'x': 120, 'y': 90, 'w': 100, 'h': 60,
+                     'mask_contour': [[120, 90], [220, 90], [170, 150]]}
+                ],
+                'references': [
+                    {'className': 'Hood', 'imagePath': '/refs/part.png'},
+                    {'className': 'Door', 'imagePath': '/refs/part.png'}
+                ]
+            }
+            base_img = np.random.default_rng(0).integers(0, 255, (200, 240, 3), dtype=np.uint8)
+
+            expected = stitch_references(base_img, data)
+            result = stitch_references_tiled(base_img.copy(), data, band_height=32)
+            assert np.array_equal(result, expected)
+        finally:
+            os.chdir(cwd)
+
+def test_large_bases_are_tiled_with_default_options():
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        calls = []
+        threshold = stitching.TILED_MIN_PIXELS
+
+        def tiled(*args, **kwargs):
+            calls.append(args[0].shape)
+            return stitch_references_tiled(*args, **kwargs)
+        try:
+            os.makedirs(os.path.join('public', 'refs'))
+            ref = np.zeros((40, 60, 4), dtype=np.uint8)
+            ref[:, :, 1] = 200
+            ref[:, :, 3] = 255
+            cv2.imwrite(os.path.join('public', 'refs', 'part.png'), ref)
+            cv2.imwrite(os.path.join('public', 'base.jpg'), np.full((300, 400, 3), 90, dtype=np.uint8))
+            # Stand-in for a 24 MP shot: the same decision at a size a test can afford
+            stitching.TILED_MIN_PIXELS = 300 * 400
+            stitching.stitch_references_tiled = tiled
+
+            result = run_stitch({
+                'segmentedImage': '/base.jpg',
+                'segmentedParts': [{'class_name': 'Hood', 'x': 50, 'y': 50, 'w': 200, 'h': 100}],
+                'references': [{'className': 'Hood', 'imagePath': '/refs/part.png'}],
+                'outputDir': '/out',
+                'output': {'derivatives': {}}
+            })
+            assert calls == [(300, 400, 3)]
+            assert (result['width'], result['height']) == (400, 300)
+            stitched = cv2.imread(os.path.join('public', 'out', 'result.jpg'))
+            assert stitched[100, 150, 1] > 150
+        finally:
+            stitching.TILED_MIN_PIXELS = threshold
+            stitching.stitch_references_tiled = stitch_references_tiled
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    test_tiled_matches_full_frame()
+    test_large_bases_are_tiled_with_default_options()
+    print("Tiled stitching tests passed")
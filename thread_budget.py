@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import sys
+
+# Cores the processing stages share on this node. When set, a one-shot stage
+# process takes its share of them next to DEFAULT_PEERS; unset, it uses
+# this process's whole CPU set
+CORES_ENV = 'RCMS_CPU_CORES'
+# Threads of one worker process; job_queue serve sets it per worker
+THREADS_ENV = 'RCMS_WORKER_THREADS'
+# CPUs to pin one worker to, e.g. '0-3' or '0,2,4'
+CPUS_ENV = 'RCMS_WORKER_CPUS'
+# RCMS_CPU_AFFINITY=1 pins each planned worker to its own cores
+AFFINITY_ENV = 'RCMS_CPU_AFFINITY'
+
+# Share of the cores each stage gets when workers split a node; SAM's image
+# encoder and YOLO dominate, classification is a small network
+STAGE_WEIGHTS = {'classify': 1, 'detect': 2, 'segment': 3, 'stitch': 2, 'pipeline': 4}
+# One-shot stage processes the Node.js routes may run side by side
+DEFAULT_PEERS = {'classify': 1, 'detect': 1, 'segment': 1, 'stitch': 1}
+# Weight of a stage whose workers have not taken jobs lately (see demand_weights)
+IDLE_STAGE_WEIGHT = 0.5
+# Read by OpenMP, MKL, OpenBLAS and friends when their thread pools start
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'TF_NUM_INTRAOP_THREADS')
+
+_threads = None
+
+def available_cpus():
+    """CPUs this process may run on, limited to the first RCMS_CPU_CORES of them."""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    if os.environ.get(CORES_ENV):
+        cpus = cpus[:max(1, int(os.environ[CORES_ENV]))]
+    return cpus
+
+def parse_cpus(spec):
+    """'0-3,6' -> [0, 1, 2, 3, 6]"""
+    cpus = []
+    for item in spec.split(','):
+        first, _, last = item.strip().partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+def format_cpus(cpus):
+    """[0, 1, 2, 3, 6] -> '0-3,6'"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+def apportion(total, weights):
+    """Split total into integer shares proportional to weights, at least one each."""
+    exact = [total * weight / sum(weights) for weight in weights]
+    shares = [max(1, int(share)) for share in exact]
+    while sum(shares) > total and max(shares) > 1:
+        shares[shares.index(max(shares))] -= 1
+    # Largest remainders get the cores left over; a share already raised
+    # to the minimum of one has no remainder left
+    for i in sorted(range(len(weights)), key=lambda i: exact[i] - shares[i], reverse=True):
+        if sum(shares) >= total:
+            break
+        shares[i] += 1
+    return shares
+
+def plan_threads(workers, cpus=None, weights=None):
+    """
+    Split the node's CPUs between worker processes, {stage: count}, in
+    proportion to STAGE_WEIGHTS. Slots come in job_queue serve's order
+    (stage by stage). Returns [{'stage', 'index', 'threads', 'cpus'}];
+    CPU sets are disjoint unless there are more workers than cores.
+    """
+    cpus = list(cpus or available_cpus())
+    weights = dict(STAGE_WEIGHTS, **(weights or {}))
+    slots = [stage for stage, count in workers.items() for _ in range(count)]
+    if not slots:
+        return []
+    if len(slots) >= len(cpus):
+        return [{'stage': stage, 'index': i, 'threads': 1, 'cpus': [cpus[i % len(cpus)]]}
+                for i, stage in enumerate(slots)]
+    shares = apportion(len(cpus), [weights.get(stage, 1) for stage in slots])
+    plan = []
+    start = 0
+    for i, (stage, share) in enumerate(zip(slots, shares)):
+        plan.append({'stage': stage, 'index': i, 'threads': share, 'cpus': cpus[start:start + share]})
+        start += share
+    return plan
+
+def demand_weights(workers, active_stages):
+    """
+    plan_threads weights that shrink stages whose workers take no jobs
+    (e.g. a pipeline worker no route feeds) to IDLE_STAGE_WEIGHT, leaving
+    their cores to the stages that do. None (plain STAGE_WEIGHTS) when no
+    stage has had jobs, as on a fresh node.
+    """
+    if not any(stage in active_stages for stage in workers):
+        return None
+    return {stage: IDLE_STAGE_WEIGHT for stage in workers if stage not in active_stages}
+
+def default_slot(stage):
+    """This stage's slot when it runs next to the default set of peer processes."""
+    peers = DEFAULT_PEERS if stage in DEFAULT_PEERS else {stage: 1}
+    return next(slot for slot in plan_threads(peers) if slot['stage'] == stage)
+
+def affinity_enabled():
+    return os.environ.get(AFFINITY_ENV, '').lower() in ('1', 'true', 'yes')
+
+def configure_worker(stage=None, threads=None, cpus=None):
+    """
+    Give this process its share of the node: thread counts for OpenCV,
+    torch (now, or when it is imported, see apply_torch_threads), ONNX
+    Runtime/TFLite (see worker_threads) and the OpenMP/MKL/BLAS pools of
+    libraries not loaded yet, and optionally a CPU set.
+
+    Explicit arguments win, then RCMS_WORKER_THREADS / RCMS_WORKER_CPUS,
+    then, with RCMS_CPU_CORES set, the stage's share of those cores next
+    to DEFAULT_PEERS. Otherwise a process runs alone and gets every CPU
+    it may use. Returns the applied configuration.
+    """
+    global _threads
+    import cv2
+    if threads is None and os.environ.get(THREADS_ENV):
+        threads = int(os.environ[THREADS_ENV])
+    if cpus is None and os.environ.get(CPUS_ENV):
+        cpus = parse_cpus(os.environ[CPUS_ENV])
+    if threads is None:
+        if stage and os.environ.get(CORES_ENV):
+            slot = default_slot(stage)
+        else:
+            slot = {'threads': len(available_cpus()), 'cpus': None}
+        threads = slot['threads']
+        if cpus is None and affinity_enabled():
+            cpus = slot['cpus']
+    threads = max(1, int(threads))
+
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    # Child processes (e.g. resident workers started from here) inherit the budget
+    os.environ[THREADS_ENV] = str(threads)
+    cv2.setNumThreads(threads)
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+        os.environ[CPUS_ENV] = format_cpus(cpus)
+    _threads = threads
+    apply_torch_threads()
+    return {'stage': stage, 'threads': threads, 'cpus': format_cpus(cpus) if cpus else None}
+
+def worker_threads():
+    """Threads this process should use for inference and its own pools."""
+    if _threads is not None:
+        return _threads
+    if os.environ.get(THREADS_ENV):
+        return max(1, int(os.environ[THREADS_ENV]))
+    return len(available_cpus())
+
+def apply_torch_threads():
+    """
+    Apply the budget to torch if it is loaded; model loaders call this
+    right after importing torch, which sizes its pools on first use.
+    """
+    torch = sys.modules.get('torch')
+    if torch is None or (_threads is None and not os.environ.get(THREADS_ENV)):
+        return
+    torch.set_num_threads(worker_threads())
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only allowed before the first inter-op parallel work
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Plan how worker processes split the CPU cores.')
+    parser.add_argument('workers', help="Workers per stage, e.g. 'detect=1,segment=2'")
+    parser.add_argument('--cpus', help="CPUs to split, e.g. '0-7' (default: this process's CPU set)")
+    args = parser.parse_args()
+
+    workers = {}
+    for item in args.workers.split(','):
+        stage, _, count = item.partition('=')
+        workers[stage] = int(count or 1)
+    plan = plan_threads(workers, parse_cpus(args.cpus) if args.cpus else None)
+    print(json.dumps([dict(slot, cpus=format_cpus(slot['cpus'])) for slot in plan], indent=2))
+
+if __name__ == "__main__":
+    main()
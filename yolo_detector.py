@@ -1,10 +1,16 @@
 import sys
 import cv2
 import json
-from ultralytics import YOLO
 import numpy as np
+from instrumentation import span, log, is_quiet
+from shared_images import open_image
+from thread_budget import configure_worker, apply_torch_threads
+from model_prep import current_prepared, FUSED_SUFFIX
+from model_assets import resolve_model_path
+from inference_backends import create_backend, configured_backend
 
-# Path to the trained YOLOv8 model
+# The trained YOLOv8 model in the model manifest, and its old place in the project root
+YOLO_MODEL_NAME = 'car_parts_detector'
 YOLO_MODEL_PATH = 'car_parts_detector.pt'
 
 # Detection parameters
@@ -57,113 +63,180 @@ def filter_detections(detections, min_size=MIN_PART_SIZE):
     
     return filtered
 
-def debug_detection(input_path, output_path, json_output_path):
+def detector_model_path():
+    return resolve_model_path(YOLO_MODEL_NAME, YOLO_MODEL_PATH)
+
+def load_yolo_model(model_path=None):
     """
-    Debug version with detailed logging and improved detection
+    Load the YOLOv8 model; ultralytics is only imported here. A pre-fused
+    copy from model_prep.py is used when it is current.
     """
-    try:
-        # Load the YOLOv8 model
-        print(f"Loading YOLO model from: {YOLO_MODEL_PATH}")
-        model = YOLO(YOLO_MODEL_PATH)
-        
-        # Print model info
-        print(f"Model classes: {model.names}")
-        print(f"Number of classes: {len(model.names)}")
-        
-        # Read and preprocess the input image
-        print(f"Loading image from: {input_path}")
-        image = cv2.imread(input_path)
-        if image is None:
-            raise ValueError("Failed to load input image")
-        
-        print(f"Original image shape: {image.shape}")
+    model_path = model_path or detector_model_path()
+    with span('detect', 'model_load'):
+        from ultralytics import YOLO
+        apply_torch_threads()
+        return YOLO(current_prepared(model_path, FUSED_SUFFIX) or model_path)
+
+def warmup_yolo_model(model):
+    """
+    One throwaway inference: sets up the predictor (and fuses an unprepared
+    model) before the first real image
+    """
+    with span('detect', 'warmup'):
+        model(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+
+def parse_detections(result, names):
+    """
+    Turn one ultralytics result into detection dicts
+    """
+    detected_parts = []
+    boxes = result.boxes
+    
+    if boxes is not None:
+        log(f"Number of boxes detected: {len(boxes)}")
         
-        # Preprocess image
+        for i, box in enumerate(boxes):
+            # Get bounding box coordinates
+            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
+            
+            # Calculate center point for SAM prompt
+            center_x = int((x1 + x2) / 2)
+            center_y = int((y1 + y2) / 2)
+            
+            # Get class name and confidence
+            class_id = int(box.cls[0].cpu().numpy())
+            confidence = float(box.conf[0].cpu().numpy())
+            class_name = names[class_id] if class_id < len(names) else f"class_{class_id}"
+            
+            log(f"Detection {i}: {class_name} (conf: {confidence:.3f}) at [{x1:.1f}, {y1:.1f}, {x2:.1f}, {y2:.1f}]")
+            
+            detected_parts.append({
+                "class_name": class_name,
+                "confidence": confidence,
+                "bbox": [float(x1), float(y1), float(x2), float(y2)],
+                "center_point": [center_x, center_y]
+            })
+    else:
+        log("No boxes detected in this result")
+    return detected_parts
+
+def detect_parts(model, image):
+    """
+    Run detection on an already decoded BGR image.
+    Returns (filtered_parts, results) where results are the raw model results.
+    """
+    # Preprocess image
+    with span('detect', 'preprocess'):
         processed_image = preprocess_image(image)
-        print(f"Preprocessed image shape: {processed_image.shape}")
-        
-        # Perform inference with optimized parameters
-        print("Running inference...")
+    log(f"Preprocessed image shape: {processed_image.shape}")
+    
+    # Perform inference with optimized parameters
+    log("Running inference...")
+    with span('detect', 'inference'):
         results = model(processed_image, 
                        conf=CONFIDENCE_THRESHOLD, 
                        iou=IOU_THRESHOLD,
-                       verbose=True)
-        
-        # Print raw results info
-        print(f"Number of results: {len(results)}")
-        
+                       verbose=not is_quiet())
+    
+    # Print raw results info
+    log(f"Number of results: {len(results)}")
+    
+    with span('detect', 'postprocess'):
         detected_parts = []
-        
         for idx, result in enumerate(results):
-            print(f"Processing result {idx}")
-            boxes = result.boxes
-            
-            if boxes is not None:
-                print(f"Number of boxes detected: {len(boxes)}")
-                
-                for i, box in enumerate(boxes):
-                    # Get bounding box coordinates
-                    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                    
-                    # Calculate center point for SAM prompt
-                    center_x = int((x1 + x2) / 2)
-                    center_y = int((y1 + y2) / 2)
-                    
-                    # Get class name and confidence
-                    class_id = int(box.cls[0].cpu().numpy())
-                    confidence = float(box.conf[0].cpu().numpy())
-                    class_name = model.names[class_id] if class_id < len(model.names) else f"class_{class_id}"
-                    
-                    print(f"Detection {i}: {class_name} (conf: {confidence:.3f}) at [{x1:.1f}, {y1:.1f}, {x2:.1f}, {y2:.1f}]")
-                    
-                    detected_parts.append({
-                        "class_name": class_name,
-                        "confidence": confidence,
-                        "bbox": [float(x1), float(y1), float(x2), float(y2)],
-                        "center_point": [center_x, center_y]
-                    })
-            else:
-                print("No boxes detected in this result")
+            log(f"Processing result {idx}")
+            detected_parts.extend(parse_detections(result, model.names))
         
         # Filter detections
         filtered_parts = filter_detections(detected_parts)
-        print(f"Total detected parts before filtering: {len(detected_parts)}")
-        print(f"Total detected parts after filtering: {len(filtered_parts)}")
-        
-        # Save detection results as JSON with metadata
-        output_data = {
-            "detections": filtered_parts,
-            "metadata": {
-                "image_dimensions": {
-                    "width": image.shape[1],
-                    "height": image.shape[0]
-                },
-                "detection_parameters": {
-                    "confidence_threshold": CONFIDENCE_THRESHOLD,
-                    "iou_threshold": IOU_THRESHOLD,
-                    "min_part_size": MIN_PART_SIZE
-                },
-                "model_info": {
-                    "classes": model.names,
-                    "num_classes": len(model.names)
-                }
+    print(f"Total detected parts before filtering: {len(detected_parts)}")
+    print(f"Total detected parts after filtering: {len(filtered_parts)}")
+    return filtered_parts, results
+
+def draw_detections(image, detections):
+    """
+    A copy of the image with each detection's box and label, for
+    backends without a plotting routine of their own
+    """
+    annotated = image.copy()
+    for detection in detections:
+        x1, y1, x2, y2 = (int(round(v)) for v in detection['bbox'])
+        cv2.rectangle(annotated, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(annotated, f"{detection['class_name']} {detection['confidence']:.2f}", (x1, max(15, y1 - 5)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+    return annotated
+
+def detection_output(filtered_parts, image, names):
+    """
+    Detection results with the metadata the Node.js routes read;
+    names are the detector's class names by id
+    """
+    return {
+        "detections": filtered_parts,
+        "metadata": {
+            "image_dimensions": {
+                "width": image.shape[1],
+                "height": image.shape[0]
+            },
+            "detection_parameters": {
+                "confidence_threshold": CONFIDENCE_THRESHOLD,
+                "iou_threshold": IOU_THRESHOLD,
+                "min_part_size": MIN_PART_SIZE
+            },
+            "model_info": {
+                "classes": names,
+                "num_classes": len(names)
             }
         }
+    }
+
+def debug_detection(input_path, output_path, json_output_path):
+    """
+    Debug version with detailed logging and improved detection
+    """
+    try:
+        # Load the configured detector (DETECTOR_BACKEND, YOLOv8 by default)
+        print(f"Loading {configured_backend('detector')} detector...")
+        detector = create_backend('detector')
+        info = detector.metadata()
+        if info.get('modelPath'):
+            print(f"Loaded YOLO model from: {info['modelPath']}")
+        
+        # Print model info
+        print(f"Model classes: {info['classes']}")
+        print(f"Number of classes: {len(info['classes'])}")
+        
+        # Read and preprocess the input image; a segment stage started later
+        # for the same upload attaches to this decode instead of repeating it
+        print(f"Loading image from: {input_path}")
+        with span('detect', 'decode'):
+            shared = open_image(input_path)
+        with shared:
+            image = shared.array
+            if image is None:
+                raise ValueError("Failed to load input image")
+        
+            print(f"Original image shape: {image.shape}")
+        
+            filtered_parts, annotated_image = detector.detect(image, annotate=True)
+        
+            # Save detection results as JSON with metadata
+            output_data = detection_output(filtered_parts, image, info['classes'])
+        
+            with span('detect', 'write'):
+                with open(json_output_path, 'w') as f:
+                    json.dump(output_data, f, indent=2)
         
-        with open(json_output_path, 'w') as f:
-            json.dump(output_data, f, indent=2)
-        
-        # Create annotated image
-        if len(results) > 0:
-            # Use original image for visualization
-            annotated_image = results[0].plot(img=image)
-            cv2.imwrite(output_path, annotated_image)
-        else:
-            # If no detections, save original image with text overlay
-            annotated_image = image.copy()
-            cv2.putText(annotated_image, "No detections found", (50, 50), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-            cv2.imwrite(output_path, annotated_image)
+            # Create annotated image
+            with span('detect', 'encode'):
+                if annotated_image is not None:
+                    cv2.imwrite(output_path, annotated_image)
+                else:
+                    # If no detections, save original image with text overlay
+                    annotated_image = image.copy()
+                    cv2.putText(annotated_image, "No detections found", (50, 50), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+                    cv2.imwrite(output_path, annotated_image)
         
         return filtered_parts
         
@@ -180,7 +253,7 @@ def test_with_pretrained_model(input_path):
     try:
         print("\n--- Testing with pretrained YOLOv8 model ---")
         # Use pretrained model
-        model = YOLO('yolov8n.pt')  # This will download if not present
+        model = load_yolo_model('yolov8n.pt')  # This will download if not present
         
         image = cv2.imread(input_path)
         results = model(image, conf=0.3)
@@ -208,13 +281,15 @@ if __name__ == "__main__":
     input_image_path = sys.argv[1]
     output_image_path = sys.argv[2]
     json_output_path = sys.argv[3]
+    configure_worker('detect')
     
     try:
         # Test with your custom model
         detected_parts = debug_detection(input_image_path, output_image_path, json_output_path)
         
-        # Also test with pretrained model for comparison
-        test_with_pretrained_model(input_image_path)
+        # Also test with pretrained model for comparison (not for stand-in detectors)
+        if configured_backend('detector') == 'ultralytics':
+            test_with_pretrained_model(input_image_path)
         
         print(f"\nFinal result: Detected {len(detected_parts)} parts")
         